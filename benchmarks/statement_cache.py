@@ -0,0 +1,89 @@
+"""
+CPU cost of the per-update lookups with prebuilt statements against select() built per call.
+
+Runs the user, group and topic lookups by Telegram ID against an in-memory SQLite
+database, once with the prebuilt statements of the services and once built inline
+the way they used to be, and prints the CPU time per call. SQLite answers these
+lookups in microseconds, so the difference is the Python side of each call:
+building the statement and finding its compiled SQL in the cache.
+
+Usage: python -m benchmarks.statement_cache [calls]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# The services import config and database, which need a URL before import.
+# Their engines never connect here, the benchmark uses its own in-memory database.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/benchmark.sqlite3")
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from database import Base
+from models import User, Group, Topic
+import handlers  # the services import handlers.funcs, which must load first
+from services.user_services import USER_BY_TELEGRAM_ID
+from services.task_services import GROUP_BY_TELEGRAM_ID, TOPIC_BY_TELEGRAM_ID
+
+CALLS = 20000
+
+# (name, inline call, prebuilt call); i picks one of the 100 rows of each table
+CASES = [
+    (
+        "user by telegram_id",
+        lambda db, i: db.scalar(select(User).where(User.telegram_id == str(i % 100)).limit(1)),
+        lambda db, i: db.scalar(USER_BY_TELEGRAM_ID, {"user_tID": str(i % 100)}),
+    ),
+    (
+        "group by telegram_id",
+        lambda db, i: db.scalar(select(Group).where(Group.telegram_id == str(-(i % 100))).limit(1)),
+        lambda db, i: db.scalar(GROUP_BY_TELEGRAM_ID, {"tID": str(-(i % 100))}),
+    ),
+    (
+        "topic by telegram_id",
+        lambda db, i: db.scalar(select(Topic).where(Topic.telegram_id == str(i % 100)).limit(1)),
+        lambda db, i: db.scalar(TOPIC_BY_TELEGRAM_ID, {"tID": str(i % 100)}),
+    ),
+]
+
+
+async def cpu_per_call(db: AsyncSession, call, calls: int) -> float:
+    """CPU microseconds per call, after a warm-up which fills the compiled cache"""
+    for i in range(100):
+        await call(db, i)
+    start = time.process_time()
+    for i in range(calls):
+        await call(db, i)
+    return (time.process_time() - start) / calls * 1e6
+
+
+async def main(calls: int):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(User.__table__.insert(), [
+            {"username": f"user{i}", "telegram_id": str(i), "is_admin": False} for i in range(100)
+        ])
+        await conn.execute(Group.__table__.insert(), [
+            {"name": f"group{i}", "telegram_id": str(-i)} for i in range(100)
+        ])
+        await conn.execute(Topic.__table__.insert(), [
+            {"name": f"topic{i}", "telegram_id": str(i), "group_id": i + 1, "link": ""} for i in range(100)
+        ])
+
+    print(f"{calls} calls per lookup, CPU µs per call")
+    print(f"{'lookup':<22}{'inline':>10}{'prebuilt':>10}{'saved':>10}")
+    async with AsyncSession(engine) as db:
+        for name, inline, prebuilt in CASES:
+            inline_us = await cpu_per_call(db, inline, calls)
+            prebuilt_us = await cpu_per_call(db, prebuilt, calls)
+            saved = (inline_us - prebuilt_us) / inline_us * 100
+            print(f"{name:<22}{inline_us:>10.1f}{prebuilt_us:>10.1f}{saved:>9.0f}%")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else CALLS))
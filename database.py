@@ -1,10 +1,242 @@
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import time
+from sqlalchemy import Select, create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from config import config
+from logger import logger
 
-engine = create_engine(config.DATABASE_URL)
+# Async drivers used for each sync driver of DATABASE_URL
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def get_async_url(url: str) -> str:
+    """
+    Convert a database URL to the matching async driver.
+    URLs which already name an async driver are returned unchanged.
+    """
+    url = make_url(url)
+    if url.drivername in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[url.drivername])
+    elif url.drivername == "postgresql+psycopg2":
+        url = url.set(drivername=ASYNC_DRIVERS["postgresql"])
+    return url.render_as_string(hide_password=False)
+
+# ===== Connection pools =====
+# Pool settings shared by every engine, see Config
+POOL_SIZE = config.DB_POOL_SIZE
+MAX_OVERFLOW = config.DB_MAX_OVERFLOW
+POOL_OPTIONS = {
+    "pool_timeout": config.DB_POOL_TIMEOUT,
+    # Drop connections older than this, before the server or a proxy closes them
+    "pool_recycle": config.DB_POOL_RECYCLE,
+    # Test connections on checkout, so a database restart does not fail the next updates
+    "pool_pre_ping": config.DB_POOL_PRE_PING,
+}
+
+class PoolStats:
+    """
+    Checkout counters of one pool, read by pool_status.
+    Updated from the event loop and from db_executor threads, hence the lock.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def record(self, wait: float, timed_out: bool):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+def instrumented(pool_class):
+    """Subclass of a queue pool which records in self.stats how long each checkout waited"""
+    class InstrumentedPool(pool_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.stats = PoolStats()
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                self.stats.record(time.perf_counter() - started, timed_out=True)
+                raise
+            self.stats.record(time.perf_counter() - started, timed_out=False)
+            return connection
+
+        def recreate(self):
+            # Keep the counters when the engine is disposed or the pool invalidated
+            pool = super().recreate()
+            pool.stats = self.stats
+            return pool
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+InstrumentedQueuePool = instrumented(QueuePool)
+InstrumentedAsyncQueuePool = instrumented(AsyncAdaptedQueuePool)
+
+def pool_status(engine) -> dict:
+    """Current connections and checkout counters of an engine's pool"""
+    pool = engine.pool
+    stats = pool.stats
+    with stats.lock:
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "checkouts": stats.checkouts,
+            "wait_ms_avg": round(stats.wait_total / stats.checkouts * 1000, 3) if stats.checkouts else 0.0,
+            "wait_ms_max": round(stats.wait_max * 1000, 3),
+            "timeouts": stats.timeouts,
+        }
+
+# ===== SQLite profile, used when config.IS_SQLITE =====
+# Run on every new connection:
+# - WAL lets readers work while a writer commits, and synchronous=NORMAL only
+#   fsyncs at checkpoints instead of on every commit (safe in WAL mode).
+# - busy_timeout makes a writer wait for the lock instead of failing at once.
+# - A negative cache_size is in KiB.
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}",
+    f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KB}",
+    "PRAGMA foreign_keys=ON",
+]
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # pysqlite and aiosqlite only emit BEGIN before DML on their own, so a SAVEPOINT opened
+    # first starts the transaction and its RELEASE commits it. Turn that off and let
+    # begin_sqlite_transaction emit BEGIN when SQLAlchemy starts a transaction.
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+def begin_sqlite_transaction(conn):
+    conn.exec_driver_sql("BEGIN")
+
+# SQLite has a single writer, connections over the pool size would only queue on its lock
+ASYNC_MAX_OVERFLOW = 0 if config.IS_SQLITE else MAX_OVERFLOW
+
+# Sync engine, used for creating tables and other maintenance work
+engine = create_engine(
+    config.DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    **POOL_OPTIONS,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Threads for blocking calls on the sync engine, one per pool connection
+DB_EXECUTOR_WORKERS = POOL_SIZE + MAX_OVERFLOW
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+# Async engine, used by the service layer inside the bot handlers
+async_engine = create_async_engine(
+    get_async_url(config.DATABASE_URL),
+    poolclass=InstrumentedAsyncQueuePool,
+    pool_size=POOL_SIZE,
+    max_overflow=ASYNC_MAX_OVERFLOW,
+    **POOL_OPTIONS,
+)
+
+if config.IS_SQLITE:
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    event.listen(engine, "begin", begin_sqlite_transaction)
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "begin", begin_sqlite_transaction)
+
+# Async engine of the read replica, None when no replica is configured
+async_replica_engine = (
+    create_async_engine(
+        get_async_url(config.DATABASE_REPLICA_URL),
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=ASYNC_MAX_OVERFLOW,
+        **POOL_OPTIONS,
+    )
+    if config.DATABASE_REPLICA_URL else None
+)
+
+class RoutingSession(Session):
+    """
+    Session which sends plain SELECTs to the read replica and everything else to the primary.
+    Once use_primary was called, or after its first write, the session sticks to the primary,
+    so the rest of the update reads its own writes. Writing service methods call use_primary
+    before their first read, see handlers.funcs.transactional. Without a replica everything uses the primary.
+    """
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if async_replica_engine is None or self.info.get("primary"):
+            return async_engine.sync_engine
+        is_read = (
+            not self._flushing
+            and (clause is None or isinstance(clause, Select))
+            and getattr(clause, "_for_update_arg", None) is None
+        )
+        if is_read:
+            return async_replica_engine.sync_engine
+        self.info["primary"] = True
+        return async_engine.sync_engine
+
+def use_primary(db) -> None:
+    """Send the rest of the session's queries to the primary, for write paths and reads whose result is cached"""
+    db.info["primary"] = True
+
+# ===== Work deferred until commit =====
+# In-process caches must not see rows of a transaction which may still roll back
+def after_commit(db, callback) -> None:
+    """Run callback once the session's transaction committed. It is dropped if the transaction rolls back"""
+    db.info.setdefault("after_commit", []).append(callback)
+
+def pending_after_commit(db) -> list:
+    """Callbacks waiting for the commit, transactional drops the ones of a failed call"""
+    return db.info.setdefault("after_commit", [])
+
+# Both events also fire for SAVEPOINTs, which neither commit nor end the update's transaction
+@event.listens_for(RoutingSession, "after_commit")
+def run_after_commit(session):
+    if session.in_nested_transaction():
+        return
+    for callback in session.info.pop("after_commit", []):
+        try:
+            callback()
+        except Exception:
+            logger.exception("Failed to run after commit callback")
+
+@event.listens_for(RoutingSession, "after_rollback")
+def drop_after_commit(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop("after_commit", None)
+
+AsyncSessionLocal = async_sessionmaker(
+    sync_session_class=RoutingSession,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
 
 def get_db():
@@ -12,4 +244,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
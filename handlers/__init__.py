@@ -1,9 +1,16 @@
 from aiogram import Router
-from .funcs import get_main_menu_keyboard, chat_type_filter, del_message, get_callback
+from .funcs import get_main_menu_keyboard, chat_type_filter, del_message, get_callback, page_buttons, is_chat_admin, get_chat_admins
 from .handler_requirements import admin_require
+from .middlewares import DBSessionMiddleware
 
 main_router = Router()
 
-from . import start_handlers
-from .task_handlers import add, edit
+# One database session per update for every handler of the router
+main_router.message.outer_middleware(DBSessionMiddleware())
+main_router.callback_query.outer_middleware(DBSessionMiddleware())
+main_router.chat_member.outer_middleware(DBSessionMiddleware())
+main_router.my_chat_member.outer_middleware(DBSessionMiddleware())
+
+from . import start_handlers, member_handlers
+from .task_handlers import add, edit, search
 from .user_handlers import add, delete
\ No newline at end of file
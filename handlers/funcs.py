@@ -1,11 +1,19 @@
 from __future__ import annotations
 from aiogram.enums import ChatType
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton
 from aiogram import F
 from logger import logger
 import asyncio
-from functools import wraps
-from aiogram.types import Message, CallbackQuery
+import random
+from collections import Counter
+from functools import wraps, partial
+from aiogram import Bot
+from aiogram.types import Message, CallbackQuery, User
+from database import db_executor, DB_EXECUTOR_WORKERS, pending_after_commit, use_primary
+from services.cache import MISSING, chat_admin_cache
+from services.errors import ServiceError, is_locked, is_transient
+from services.pagination import Page
+from typing import Dict, List
 
 def exception_decorator(func):
     """
@@ -46,6 +54,92 @@ def exception_decorator(func):
         return sync_wrapper
 
 
+# Attempts of a transactional call failing with a transient conflict, and the first retry delay in seconds
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.05
+
+# Failed transactional calls since start, by method name
+failure_counts: Counter = Counter()
+
+def transactional(func=None, *, read_only: bool = False):
+    """
+    Decorator for async service methods which take the update's session as `db`.
+    - Inside a started transaction a method runs in a SAVEPOINT, so a failure only rolls back
+      its own changes and the rest of the update can still commit. Reads too: on Postgres a
+      failed statement aborts the whole transaction unless its SAVEPOINT is rolled back.
+      As the first call of the update it runs directly and the session is rolled back on failure.
+    - Methods not decorated with read_only=True pin the session to the primary before running,
+      so the rows they check and change are not read from a lagging replica.
+    - Transient conflicts are retried up to RETRY_ATTEMPTS times with exponential backoff and jitter,
+      when retrying can succeed: serialization failures and deadlocks abort the whole transaction
+      on Postgres, so they are only retried by the call which started it. A locked SQLite database
+      only fails the statement and is retried anywhere.
+    - Returns a ServiceError instead of raising, and counts the failure in failure_counts.
+      after_commit callbacks registered by the failed call are dropped with its changes.
+    """
+    if func is None:
+        return partial(transactional, read_only=read_only)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        db = kwargs["db"] if "db" in kwargs else args[0]
+        name = func.__qualname__
+        if not read_only:
+            use_primary(db)
+
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            started = not db.in_transaction()
+            callbacks = pending_after_commit(db)
+            pending = len(callbacks)
+            try:
+                if started:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception:
+                        await db.rollback()
+                        raise
+                async with db.begin_nested():
+                    return await func(*args, **kwargs)
+
+            except Exception as e:
+                del callbacks[pending:]
+                retryable = is_transient(e) if started else is_locked(e)
+                if retryable and attempt < RETRY_ATTEMPTS:
+                    delay = RETRY_BASE_DELAY * 2 ** (attempt - 1) * (1 + random.random())
+                    logger.warning(f"Retrying {name} in {delay:.2f}s after a conflict: {e}")
+                    await asyncio.sleep(delay)
+                    continue
+
+                failure_counts[name] += 1
+                logger.error(f"Error in {name}: {e}")
+                return ServiceError.from_exception(name, e)
+
+    return wrapper
+
+
+# Limits the calls running or waiting in db_executor to the pool's connection count
+_db_executor_slots = asyncio.Semaphore(DB_EXECUTOR_WORKERS)
+
+def executor_exception_decorator(func):
+    """
+    Awaitable variant of exception_decorator for blocking (sync) database functions.
+    - The call runs in db_executor, so it does not block the event loop.
+    - At most DB_EXECUTOR_WORKERS calls are sent to the executor at once; the rest wait here.
+    - Returns None if an exception occurs, like exception_decorator.
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            async with _db_executor_slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
+        except Exception as e:
+            logger.error(f"Error in {func.__name__}: {e}")
+            return None
+
+    return wrapper
+
+
 
 # ===== Create Callback Function ======
 @exception_decorator
@@ -65,6 +159,28 @@ def get_callback(callback_query, new_callback_data):
 
 
 
+# ===== Chat administrators =====
+# Member statuses which can manage a group
+ADMIN_STATUSES = ("administrator", "creator")
+
+async def get_chat_admins(bot: Bot, chat_id: int) -> Dict[int, User]:
+    """
+    Administrators of a group chat by Telegram user ID, bots included.
+    Fetched with one get_chat_administrators call per chat and CHAT_ADMIN_CACHE_TTL seconds;
+    chat_member updates keep the cached list current in between, see member_handlers.py.
+    """
+    admins = chat_admin_cache.get(chat_id)
+    if admins is MISSING:
+        members = await bot.get_chat_administrators(chat_id=chat_id)
+        admins = {member.user.id: member.user for member in members}
+        chat_admin_cache.set(chat_id, admins)
+    return admins
+
+async def is_chat_admin(bot: Bot, chat_id: int, user_id: int) -> bool:
+    """Whether a user is an administrator or the creator of a group chat"""
+    return user_id in await get_chat_admins(bot, chat_id)
+
+
 @exception_decorator
 def chat_type_filter(chat_type):
     """
@@ -76,9 +192,24 @@ def chat_type_filter(chat_type):
 
 
 @exception_decorator
-def get_main_menu_keyboard(chat_type: ChatType, is_admin: bool = False) -> ReplyKeyboardMarkup:
+def page_buttons(page: Page, callback_prefix: str) -> List[InlineKeyboardButton]:
+    """
+    Build the previous/next row of a paginated inline keyboard.
+    Each button carries its page cursor as the last part of the callback data: "<callback_prefix>|<cursor>".
+    Returns an empty row when the list fits in one page.
+    """
+    buttons = []
+    if page.prev_cursor:
+        buttons.append(InlineKeyboardButton(text="◀️ قبلی", callback_data=f"{callback_prefix}|{page.prev_cursor}"))
+    if page.next_cursor:
+        buttons.append(InlineKeyboardButton(text="بعدی ▶️", callback_data=f"{callback_prefix}|{page.next_cursor}"))
+    return buttons
+
+
+def build_main_menu_keyboard(chat_type: ChatType, is_admin: bool = False) -> ReplyKeyboardMarkup:
     """
     Generate the main menu keyboard depending on the chat type.
+    Only used to build MAIN_MENU_KEYBOARDS, handlers use get_main_menu_keyboard.
     """
 
     keyboards = []
@@ -157,8 +288,41 @@ def get_main_menu_keyboard(chat_type: ChatType, is_admin: bool = False) -> Reply
     return keyboard
 
 
+# ===== Prebuilt main menu keyboards =====
+# The only three main menus, built once. aiogram types are frozen, so the same markup is safely shared by every message
+MAIN_MENU_KEYBOARDS = {
+    (ChatType.PRIVATE, True): build_main_menu_keyboard(ChatType.PRIVATE, is_admin=True),
+    (ChatType.PRIVATE, False): build_main_menu_keyboard(ChatType.PRIVATE, is_admin=False),
+    (ChatType.GROUP, False): build_main_menu_keyboard(ChatType.GROUP),
+}
+
+def get_main_menu_keyboard(chat_type: ChatType, is_admin: bool = False) -> ReplyKeyboardMarkup:
+    """
+    Main menu keyboard of a chat type, from MAIN_MENU_KEYBOARDS.
+    The admin menu only exists in private chats, every other chat type gets the group menu.
+    """
+    if chat_type == ChatType.PRIVATE:
+        return MAIN_MENU_KEYBOARDS[ChatType.PRIVATE, bool(is_admin)]
+    return MAIN_MENU_KEYBOARDS[ChatType.GROUP, False]
+
+
+# Pending del_message deletions, referenced here so they are not garbage collected before they run
+_deletions: set[asyncio.Task] = set()
+
 @exception_decorator
 async def del_message(sleep: float = 3.0, *args: Message) -> True | None :
+    """
+    Delete messages after `sleep` seconds.
+    Returns at once, the deletion runs in the background, so the handler's
+    session is committed and closed without waiting for it.
+    """
+    task = asyncio.create_task(_delete_later(sleep, *args))
+    _deletions.add(task)
+    task.add_done_callback(_deletions.discard)
+    return True
+
+
+async def _delete_later(sleep: float, *args: Message) -> None:
     await asyncio.sleep(sleep)
     errors = 0
     for i in args:
@@ -170,5 +334,3 @@ async def del_message(sleep: float = 3.0, *args: Message) -> True | None :
     if errors != 0:
         logger.exception(f"Failed to delete {errors} {"message" if errors == 1 else "messages"} from chat")
 
-    return True
-
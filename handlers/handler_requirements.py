@@ -1,5 +1,5 @@
 from aiogram.types import Message, CallbackQuery
-from . import del_message
+from . import del_message, is_chat_admin
 from services.user_services import UserService
 from logger import logger
 
@@ -18,11 +18,7 @@ async def admin_require(db, message: Message) -> bool:
 
         # Case 1: if in a group or supergroup, check Telegram chat admin status
         if chat.type in ("group", "supergroup"):
-            chat_member = await bot.get_chat_member(
-                chat_id=chat.id,
-                user_id=user.id
-            )    
-            is_admin = chat_member.status in ['administrator', 'creator']
+            is_admin = await is_chat_admin(bot, chat_id=chat.id, user_id=user.id)
 
             if not is_admin:
                 # Send "not allowed" message depending on message type
@@ -35,7 +31,7 @@ async def admin_require(db, message: Message) -> bool:
             return True
 
         # Case 2: if not in a group (private chat), check admin status in database
-        is_admin = UserService.is_admin(db=db, user_tID=str(user.id))
+        is_admin = await UserService.is_admin(db=db, user_tID=str(user.id))
         if not is_admin:
             # Send "not allowed" message depending on message type
             response = await (message.message.answer if isinstance(message, CallbackQuery) else message.answer)(
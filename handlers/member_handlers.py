@@ -0,0 +1,63 @@
+from aiogram.types import ChatMemberUpdated
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import main_router as router
+from .funcs import ADMIN_STATUSES
+from services.cache import MISSING, chat_admin_cache
+from services.task_services import TaskService
+from services.user_services import GroupMemberService, MEMBER_STATUSES
+from logger import logger
+
+
+def member_status(update: ChatMemberUpdated) -> str:
+    """New status of the member, "left" for restricted users who are not in the chat"""
+    member = update.new_chat_member
+    if member.status == "restricted" and not member.is_member:
+        return "left"
+    return member.status
+
+
+# ===== Mirror member changes of a group =====
+@router.chat_member()
+async def handle_chat_member(update: ChatMemberUpdated, db: AsyncSession):
+    """
+    A member of a group changed status.
+    The group_members row of the user is updated, and promotions and demotions update the cached admin list.
+    """
+    try:
+        user = update.new_chat_member.user
+        status = member_status(update)
+
+        admins = chat_admin_cache.get(update.chat.id)
+        if admins is not MISSING:
+            if status in ADMIN_STATUSES:
+                admins = {**admins, user.id: user}
+            else:
+                admins = {user_id: admin for user_id, admin in admins.items() if user_id != user.id}
+            chat_admin_cache.set(update.chat.id, admins)
+
+        # Only registered groups are mirrored
+        group_id = await TaskService.resolve_group_id(db=db, tID=str(update.chat.id))
+        if group_id:
+            await GroupMemberService.set_member_status(
+                db=db, group_id=group_id, telegram_user_id=str(user.id), status=status
+            )
+
+    except Exception:
+        logger.exception("Unexpected error occurred")
+
+
+@router.my_chat_member()
+async def handle_my_chat_member(update: ChatMemberUpdated, db: AsyncSession):
+    """The bot itself was added to or removed from a group"""
+    try:
+        if member_status(update) in MEMBER_STATUSES:
+            return
+
+        # No more updates come from the group, so what is known about its members goes stale
+        chat_admin_cache.pop(update.chat.id)
+        group_id = await TaskService.resolve_group_id(db=db, tID=str(update.chat.id))
+        if group_id:
+            await GroupMemberService.clear_group(db=db, group_id=group_id)
+
+    except Exception:
+        logger.exception("Unexpected error occurred")
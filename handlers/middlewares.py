@@ -0,0 +1,47 @@
+from __future__ import annotations
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from database import AsyncSessionLocal
+from logger import logger
+
+
+class DBSessionMiddleware(BaseMiddleware):
+    """
+    Outer middleware which opens one database session per update.
+    - The session is passed to handlers as the `db` argument.
+    - Commits once after the handler finished, or rolls back if it raised.
+    - A failed commit is rolled back and re-raised, so the update is reported as failed
+      instead of its changes being lost silently.
+    - The session is always closed, so no connection leaks from a failed handler.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as db:
+                data["db"] = db
+                try:
+                    result = await handler(event, data)
+                except Exception:
+                    await db.rollback()
+                    raise
+
+                try:
+                    await db.commit()
+                except Exception:
+                    logger.exception(f"Failed to commit db session of {type(event).__name__}")
+                    await db.rollback()
+                    raise
+
+                return result
+
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            logger.debug(f"DB session for {type(event).__name__} took {elapsed:.1f} ms")
@@ -3,10 +3,10 @@ from aiogram.filters import Command
 from aiogram.enums import ChatType
 from services.task_services import TaskService
 from services.user_services import UserService
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from logger import logger
 from . import main_router as router
-from . import chat_type_filter, get_main_menu_keyboard
+from . import chat_type_filter, get_main_menu_keyboard, is_chat_admin
 from config import config
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
@@ -17,18 +17,16 @@ class TopicStates(StatesGroup):
 
 # ===== Start in Private chat =====
 @router.message(Command("start"), chat_type_filter(ChatType.PRIVATE))
-async def cmd_start_private(message: Message):
+async def cmd_start_private(message: Message, db: AsyncSession):
     """Handle /start command in private chats"""
     try:
-        db = next(get_db())
-
         if message.from_user.is_bot:
             await message.answer("❌ ربات ها نمیتوانند از این ربات استفاده کنند ❌")
         
         # Get or create user based on mode
         if config.MODE == "DEV":
             # Development mode - create user if not exists with admin privileges
-            user = UserService.get_or_create_user(
+            user = await UserService.get_or_create_user(
                 db=db,
                 telegram_id=str(message.from_user.id),
                 username=message.from_user.username,
@@ -39,7 +37,7 @@ async def cmd_start_private(message: Message):
                 return
         else:
             # Production mode - only allow existing users
-            user = UserService.get_user(
+            user = await UserService.get_user(
                 db=db,
                 user_tID=str(message.from_user.id),
                 username=message.from_user.username,
@@ -73,29 +71,14 @@ async def cmd_start_private(message: Message):
             await message.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Ensure database connection is closed
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 # ===== Start in Group or Supergroup chat =====
 @router.message(Command("start"), F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}))
-async def cmd_start_group(message: Message, state: FSMContext):
+async def cmd_start_group(message: Message, state: FSMContext, db: AsyncSession):
     """Handle /start command in groups and supergroups"""
-    db = None
     try:
-        db = next(get_db())
-        
         # Check if the user who triggered the command is an admin or the owner of the group
-        chat_member = await message.bot.get_chat_member(
-            chat_id=message.chat.id,
-            user_id=message.from_user.id
-        )
-        is_admin = chat_member.status in ["administrator", "creator"]
+        is_admin = await is_chat_admin(message.bot, chat_id=message.chat.id, user_id=message.from_user.id)
         if not is_admin:
             await message.answer("❌ فقط ادمین‌ها یا مالک گروه می‌توانند ربات را راه اندازی کنند.")
             return
@@ -103,14 +86,14 @@ async def cmd_start_group(message: Message, state: FSMContext):
         # In DEV mode: create or get the user and automatically mark as admin
         # In PROD mode: only existing users with admin rights are allowed
         if config.MODE == "DEV":
-            user = UserService.get_or_create_user(
+            user = await UserService.get_or_create_user(
                 db=db,
                 telegram_id=str(message.from_user.id),
                 username=message.from_user.username,
                 is_admin=True
             )
         else:
-            user = UserService.get_user(
+            user = await UserService.get_user(
                 db=db,
                 user_tID=str(message.from_user.id),
                 username=message.from_user.username,
@@ -120,7 +103,7 @@ async def cmd_start_group(message: Message, state: FSMContext):
                 return
 
         # Create or fetch the group record in the database
-        group = TaskService.get_or_create_group(
+        group = await TaskService.get_or_create_group(
             db, telegram_group_id=str(message.chat.id), name=message.chat.title
         )
         if not group:
@@ -165,21 +148,11 @@ async def cmd_start_group(message: Message, state: FSMContext):
             await message.answer("❌ خطایی در راه اندازی ربات رخ داد.")
         except Exception:
             logger.exception("Failed to send error message")
-    
-    finally:
-        # Always close database connection safely
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 # ----- Step 2: Handle the conversation where the bot waits for the topic name -----
 @router.message(TopicStates.waiting_for_name)
-async def process_topic_name(message: Message, state: FSMContext):
-    db = None
+async def process_topic_name(message: Message, state: FSMContext, db: AsyncSession):
     try:
-        db = next(get_db())
         # Retrieve previously stored data from FSM context
         data = await state.get_data()
         group_id = data["group_id"]
@@ -190,7 +163,7 @@ async def process_topic_name(message: Message, state: FSMContext):
         topic_name = message.text.strip()
 
         # Create or fetch the topic record in the database
-        topic = TaskService.get_or_create_topic(
+        topic = await TaskService.get_or_create_topic(
             db,
             telegram_topic_id=topic_id,
             group_id=group_id,
@@ -218,11 +191,5 @@ async def process_topic_name(message: Message, state: FSMContext):
         await message.answer("❌ خطا در ذخیره‌سازی تاپیک رخ داد.")
     
     finally:
-        # Always close the database connection and reset FSM state
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
-
+        # Always reset FSM state
         await state.clear()
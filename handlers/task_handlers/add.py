@@ -1,10 +1,10 @@
 from .. import main_router as router
-from .. import chat_type_filter, get_main_menu_keyboard, del_message
+from .. import chat_type_filter, get_main_menu_keyboard, del_message, is_chat_admin
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.enums import ChatType
 from aiogram import F
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from logger import logger
 from services.task_services import TaskService
 from services.user_services import UserService
@@ -12,23 +12,48 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from config import config
+from typing import List
+import re
+
+# Bullets and numbering at the start of a pasted line, e.g. "- ", "• ", "3) "
+LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+
+def split_task_titles(text: str) -> List[str]:
+    """Split a message into task titles, one per non-empty line, without list markers"""
+    titles = []
+    for line in text.splitlines():
+        title = LIST_MARKER.sub("", line).strip()
+        if title:
+            titles.append(title)
+    return titles
+
+async def create_tasks_from_text(db: AsyncSession, text: str, admin_id: int, group_id: int = None, topic_id: int = None) -> str:
+    """
+    Create a task from text, or one task per line if it has several lines.
+    Several tasks are created with one INSERT. Returns the reply for the user.
+    """
+    titles = split_task_titles(text)
+    if len(titles) <= 1:
+        add_res = await TaskService.create_task(db=db, title=text.strip(), admin_id=admin_id, group_id=group_id, topic_id=topic_id)
+        if not add_res:
+            return "❌ مشکلی در ساخت تسک به وجود آمد. لطفاً دوباره تلاش کنید"
+        return "✅ تسک با موفقیت ساخته شد."
+
+    task_ids = await TaskService.create_tasks_bulk(db=db, titles=titles, admin_id=admin_id, group_id=group_id, topic_id=topic_id)
+    if not task_ids:
+        return "❌ مشکلی در ساخت تسک ها به وجود آمد. لطفاً دوباره تلاش کنید"
+    titles_text = "\n".join(f"{i}. {title}" for i, title in enumerate(titles, 1))
+    return f"✅ {len(task_ids)} تسک با موفقیت ساخته شد:\n\n{titles_text}"
 
 # ===== Handler for create new task in group/supergroup chats =====
 @router.message(Command("add"), chat_type_filter(ChatType.GROUP))
 @router.message(Command("add"), chat_type_filter(ChatType.SUPERGROUP))
-async def add_task(message: Message):
-    db = None
+async def add_task(message: Message, db: AsyncSession):
     try:
-        db = next(get_db())  # Open database session
-
-        group = TaskService.get_group(db, tID=str(message.chat.id))
+        group_id = await TaskService.resolve_group_id(db=db, tID=str(message.chat.id))
 
         # Check if user is an admin of the group
-        chat_member = await message.bot.get_chat_member(
-            chat_id=message.chat.id,
-            user_id=message.from_user.id
-        )    
-        is_admin = chat_member.status in ['administrator', 'creator']
+        is_admin = await is_chat_admin(message.bot, chat_id=message.chat.id, user_id=message.from_user.id)
         if not is_admin:
             response = await message.answer(
                 "اجرای این دستور فقط توسط ادمین ممکن است ❌\n"
@@ -38,7 +63,7 @@ async def add_task(message: Message):
             return
         
         # Check if user exists in DB and is admin
-        user = UserService.get_user(db=db, user_tID=str(message.from_user.id))
+        user = await UserService.get_identity(db=db, user_tID=str(message.from_user.id))
         if not user or not user.is_admin:
             response = await message.answer(
                 "اجرای این دستور فقط توسط ادمین ممکن است ❌\n"
@@ -46,23 +71,23 @@ async def add_task(message: Message):
             # Delete response and message after 3 seconds
             await del_message(3, response, message)
             return
+
+        if not group_id:
+            response = await message.answer("❌ این گروه ثبت نشده است")
+            await del_message(3, response, message)
+            return
         
         topic = None
         if message.is_topic_message:
-            topic = TaskService.get_topic(db=db, tID=str(message.message_thread_id))
-            if topic:
-                topic = topic.id
+            topic = await TaskService.resolve_topic_id(db=db, group_id=group_id, tID=str(message.message_thread_id)) or None
 
         # User replied to another message
         if message.reply_to_message and message.reply_to_message.text and message.reply_to_message.from_user.username and message.reply_to_message.from_user.username != config.BOT_USERNAME:
             original_text = message.reply_to_message.text
             if original_text and type(original_text) == str:
-                original_text = original_text.strip()
-                add_res = TaskService.create_task(db=db, title=original_text, admin_id=user.id, group_id=group.id, topic_id=topic)
-                if not add_res:
-                    response = await message.answer("❌ مشکلی در ساخت تسک به وجود آمد. لطفاً دوباره تلاش کنید")    
-                else:
-                    response = await message.answer("✅ تسک با موفقیت ساخته شد.")
+                # One task per line of the replied message
+                response_text = await create_tasks_from_text(db=db, text=original_text, admin_id=user.id, group_id=group_id, topic_id=topic)
+                response = await message.answer(response_text)
             else:
                 response = await message.answer(
                     "❌\n"
@@ -76,11 +101,9 @@ async def add_task(message: Message):
                 except Exception:
                     logger.exception("Failed to processing task_name")
                     response = await message.answer("❌ مشکلی در پردازش نام تسک به وجود آمد. لطفاً دوباره تلاش کنید")    
-                add_res = TaskService.create_task(db=db, title=task_name, admin_id=user.id, group_id=group.id, topic_id=topic)
-                if not add_res:
-                    response = await message.answer("❌ مشکلی در ساخت تسک به وجود آمد. لطفاً دوباره تلاش کنید")    
-                else:
-                    response = await message.answer("✅ تسک با موفقیت ساخته شد.")
+                # One task per line after /add
+                response_text = await create_tasks_from_text(db=db, text=task_name, admin_id=user.id, group_id=group_id, topic_id=topic)
+                response = await message.answer(response_text)
         # Invalid usage of /add command
         else:
             response = await message.answer(
@@ -88,7 +111,8 @@ async def add_task(message: Message):
                 " دستور شما معتبر نیست برای استفاده\n"
                 "از این دستو از راههای زیر استفاده کنید\n"
                 "/add [نام تسک] :راه اول \n"
-                "راه دوم : فرستادن /add در ریپلای به یک پیام"
+                "راه دوم : فرستادن /add در ریپلای به یک پیام\n"
+                "برای ساخت چند تسک، هر نام را در یک خط بنویسید"
             )
             # Delete response and message after 3 seconds
             await del_message(3, response, message)
@@ -104,26 +128,16 @@ async def add_task(message: Message):
             await message.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 # ===== Handler for create new task in private chats =====
 class AddTaskStates(StatesGroup):
     waiting_for_title = State()
 
 @router.message(Command("add"), chat_type_filter(ChatType.PRIVATE))
-async def add_task_in_private(message: Message, state: FSMContext):
+async def add_task_in_private(message: Message, state: FSMContext, db: AsyncSession):
     try:
-        db = next(get_db())  # Open database session
-
         # Check if user exists in DB and is admin
-        user = UserService.get_user(db=db, user_tID=str(message.from_user.id))
+        user = await UserService.get_identity(db=db, user_tID=str(message.from_user.id))
         if not user or not user.is_admin:
             response = await message.answer(
                 "اجرای این دستور فقط توسط ادمین ممکن است ❌\n"
@@ -137,12 +151,9 @@ async def add_task_in_private(message: Message, state: FSMContext):
         if message.reply_to_message and message.reply_to_message.text and message.reply_to_message.from_user.username and message.reply_to_message.from_user.username != config.BOT_USERNAME:
             original_text = message.reply_to_message.text
             if original_text and type(original_text) == str:
-                original_text = original_text.strip()
-                add_res = TaskService.create_task(db=db, title=original_text, admin_id=user.id)
-                if not add_res:
-                    response = await message.answer("❌ مشکلی در ساخت تسک به وجود آمد. لطفاً دوباره تلاش کنید")    
-                else:
-                    response = await message.answer("✅ تسک با موفقیت ساخته شد.")
+                # One task per line of the replied message
+                response_text = await create_tasks_from_text(db=db, text=original_text, admin_id=user.id)
+                response = await message.answer(response_text)
                 # Delete response and message after 3 seconds
                 await del_message(3, response, message)
                 return
@@ -214,14 +225,6 @@ async def add_task_in_private(message: Message, state: FSMContext):
             await message.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 @router.message(AddTaskStates.waiting_for_title, F.text == "❌ کنسل کردن")
 async def cancel_add_task(message: Message, state: FSMContext):
@@ -269,7 +272,7 @@ async def cancel_add_task(message: Message, state: FSMContext):
             logger.exception("Failed to send error message")  
 
 @router.message(AddTaskStates.waiting_for_title)
-async def process_task_and_create(message: Message, state: FSMContext):
+async def process_task_and_create(message: Message, state: FSMContext, db: AsyncSession):
     """Process task title and create the task immediately"""
     try:
         data = await state.get_data()
@@ -285,14 +288,21 @@ async def process_task_and_create(message: Message, state: FSMContext):
         message_ids = data.get('message_ids', [])
         message_ids.append(message.message_id)
         
-        db = next(get_db())
-        
-        # Create task with only title and admin ID (other fields will be None)
-        task = TaskService.create_task(
-            db=db,
-            admin_id=data['user_id'],
-            title=message.text,
-        )
+        # Several lines create one task per line in a single insert
+        titles = split_task_titles(message.text)
+        if len(titles) > 1:
+            task = await TaskService.create_tasks_bulk(
+                db=db,
+                admin_id=data['user_id'],
+                titles=titles,
+            )
+        else:
+            # Create task with only title and admin ID (other fields will be None)
+            task = await TaskService.create_task(
+                db=db,
+                admin_id=data['user_id'],
+                title=message.text,
+            )
         if not task:
             error = await message.answer("❌ خطایی در ساخت تسک پیش آمد. لطفاً دوباره تلاش کنید")
             message_ids = data.get('message_ids', [])
@@ -304,14 +314,22 @@ async def process_task_and_create(message: Message, state: FSMContext):
         keyboard = get_main_menu_keyboard(chat_type=data['chat_type'], is_admin=data.get('user_admin', False))
         
         # Send final confirmation message
-        final_response = await message.answer(
-            f"✅ تسک با موفقیت ایجاد شد!\n\n"
-            f"📋 عنوان: {message.text}\n"
-            f"📝 توضیحات: بدون توضیح\n"
-            f"⏰ شروع: تعیین نشده\n"
-            f"⏰ پایان: تعیین نشده",
-            reply_markup=keyboard
-        )
+        if len(titles) > 1:
+            titles_text = "\n".join(f"{i}. {title}" for i, title in enumerate(titles, 1))
+            final_response = await message.answer(
+                f"✅ {len(task)} تسک با موفقیت ایجاد شد!\n\n"
+                f"{titles_text}",
+                reply_markup=keyboard
+            )
+        else:
+            final_response = await message.answer(
+                f"✅ تسک با موفقیت ایجاد شد!\n\n"
+                f"📋 عنوان: {message.text}\n"
+                f"📝 توضیحات: بدون توضیح\n"
+                f"⏰ شروع: تعیین نشده\n"
+                f"⏰ پایان: تعیین نشده",
+                reply_markup=keyboard
+            )
         
         try:
             # Delete all messages related to the add task operation
@@ -339,10 +357,3 @@ async def process_task_and_create(message: Message, state: FSMContext):
         except Exception:
             logger.exception("Failed to send error message")
     
-    finally:
-        # Always close database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
@@ -1,14 +1,18 @@
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from aiogram.filters import Command
-from .. import admin_require, del_message, get_callback, chat_type_filter
+from .. import admin_require, del_message, get_callback, chat_type_filter, page_buttons, get_chat_admins
 from .. import main_router as router
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from aiogram.enums import ChatType
 from logger import logger
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from services.task_services import TaskService, TaskAttachmentService
 from services.user_services import UserService
+from services.errors import ServiceError
+from services.cache import MISSING, RenderedCard, cached_task_card, task_card_cache
+from database import after_commit, use_primary
+from functools import partial
 from typing import Tuple, List
 from ..funcs import exception_decorator
 from aiogram import F
@@ -20,61 +24,170 @@ import uuid
 
 media_cache = {}
 
+# Bot method and its file argument used to send each stored media type
+ATTACHMENT_SENDERS = {
+    "photo": ("send_photo", "photo"),
+    "video": ("send_video", "video"),
+    "audio": ("send_audio", "audio"),
+    "voice": ("send_voice", "voice"),
+    "document": ("send_document", "document"),
+}
+
 
 @exception_decorator
 def chunk_list(lst:list, chunk_size: int) -> List[List] | None:
     return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
 
 
-def task_manage_keyboard(db) -> Tuple[List[str], InlineKeyboardMarkup]:
+@exception_decorator
+def get_message_media(message: Message) -> List[Tuple[str, str, str]] | None:
+    """Return (file_id, file_unique_id, media_type) for every media of a message"""
+    media = []
+    if message.photo:
+        # For photo, take the highest resolution
+        photo = message.photo[-1]
+        media.append((photo.file_id, photo.file_unique_id, "photo"))
+    for media_type in ("video", "audio", "voice", "document"):
+        item = getattr(message, media_type)
+        if item:
+            media.append((item.file_id, item.file_unique_id, media_type))
+    return media
+
+
+async def task_manage_keyboard(db, cursor: str = None) -> Tuple[List[str], InlineKeyboardMarkup]:
     text = []
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
     
-    groups = TaskService.get_all_groups(db=db)
-    if groups is None:
+    groups = await TaskService.get_groups_page(db=db, cursor=cursor)
+    if isinstance(groups, ServiceError):
         text.append("⚠️ هیچ گروهی برای نمایش وجود ندارد ⚠️")
-        tasks = TaskService.get_all_tasks(db=db)
-        if tasks is None:
+        tasks = await TaskService.get_tasks_page(db=db)
+        if isinstance(tasks, ServiceError):
             text.append("⚠️ هیچ تسکی برای نمایش وجود ندارد ⚠️")
         else:
-            text.append(f"تسک ها : \n تعداد: {len(groups)}")
+            task_count = await TaskService.count_tasks(db=db)
+            text.append(f"تسک ها : \n تعداد: {task_count}")
             keyboard.inline_keyboard.extend(
                 [
                     [InlineKeyboardButton(text=b.title, callback_data=f"view_task|{b.id}") for b in c]
-                    for c in chunk_list(tasks, 2)
+                    for c in chunk_list(tasks.items, 2)
                 ]
             )
     
     else:
-        text.append(f"گروه ها : \n تعداد: {len(groups)}")
+        # Totals are counted in SQL, the page only holds the groups shown
+        group_count = await TaskService.count_groups(db=db)
+        task_counts = await TaskService.count_tasks_per_group(db=db, group_ids=[g.id for g in groups.items]) or {}
+        status_counts = await TaskService.count_tasks_by_status(db=db)
+
+        text.append(f"گروه ها : \n تعداد: {group_count}")
+        if status_counts:
+            text.append("وضعیت تسک ها : " + " | ".join(f"{status}: {count}" for status, count in status_counts.items()))
         keyboard.inline_keyboard.extend(
             [
-                [InlineKeyboardButton(text=b.name, callback_data=f"view_group|{b.id}") for b in c]
-                for c in chunk_list(groups, 2)
+                [InlineKeyboardButton(text=f"{b.name} ({task_counts.get(b.id, 0)})", callback_data=f"view_group|{b.id}") for b in c]
+                for c in chunk_list(groups.items, 2)
             ]
         )
+        navigation = page_buttons(groups, "view_groups")
+        if navigation:
+            keyboard.inline_keyboard.append(navigation)
         keyboard.inline_keyboard.append(
             [InlineKeyboardButton(text="سایر ...", callback_data=f"view_group|OTHER")]
         )
 
+    keyboard.inline_keyboard.append(
+        [InlineKeyboardButton(text="🗄 آرشیو", callback_data="view_archive|")]
+    )
+
     return text, keyboard
 
 
+def task_card_text(task) -> str:
+    """Message text of a TaskCard, shared by live and archived tasks"""
+    # Create message text for assigned users
+    if task.usernames:
+        users_text = "👥 کاربران اختصاص داده شده به این تسک:\n\n"
+        for i, username in enumerate(task.usernames, 1):
+            users_text += f"{i}. {username}\n"
+    else:
+        users_text = "📝 هیچ کاربری به این تسک اختصاص داده نشده است."
+    
+    text = [
+        f"📋 {task.title}\n\n",
+        f"مدیر : @{task.admin_username}\n",
+        f"📝 توضیحات: {task.description or 'بدون توضیح'}\n",
+        f"📅 شروع: {task.start_date.strftime('%Y-%m-%d') if task.start_date else 'تعیین نشده'}\n",
+        f"📅 پایان: {task.end_date.strftime('%Y-%m-%d') if task.end_date else 'تعیین نشده'}\n",
+        f"🔧 وضعیت: {task.status}\n\n",
+        users_text,
+    ]
+    if task.topic_id:
+        text.insert(2, f"تاپیک : {task.topic_name} - {task.topic_link}\n")
+    if task.group_id:
+        text.insert(2, f"گروه : {task.group_name}\n")
+
+    return "".join(text)
+
+
+def task_card_keyboard(task, show_type: str) -> InlineKeyboardMarkup:
+    """Inline keyboard of a TaskCard, the management buttons for view_task and the read-only ones for show_task"""
+    if show_type == "show_task":
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text="🔙 بازگشت", callback_data="back_show"),
+            ],
+            [
+                InlineKeyboardButton(text="📝 دریافت اتچمنت", callback_data=f"get_attachments|{task.id}"), 
+            ],
+        ])
+
+    # Create task management buttons
+    keyboard_buttons = [
+        [
+            InlineKeyboardButton(text="🔙 بازگشت", callback_data="back"),
+            InlineKeyboardButton(text="🗑️ حذف تسک", callback_data=f"delete_task|{task.id}"),
+        ],
+        [
+            InlineKeyboardButton(text="👥 افزودن کاربر", callback_data=f"add_user|{task.id}"), 
+            InlineKeyboardButton(text="👥 حذف کاربر", callback_data=f"del_users|{task.id}")
+        ],
+        [
+            InlineKeyboardButton(text="👥 کاربران", callback_data=f"view_task_users|{task.id}"),
+            InlineKeyboardButton(text="⏰ ویرایش زمان پایان", callback_data=f"edit_end|{task.id}")
+        ],
+        [
+            InlineKeyboardButton(text="📝 ویرایش توضیحات", callback_data=f"edit_desc|{task.id}"), 
+            InlineKeyboardButton(text="📋 ویرایش نام", callback_data=f"edit_name|{task.id}")
+        ],
+        [
+            InlineKeyboardButton(text="📝 افزودن اتچمنت", callback_data=f"add_attachment|{task.id}"), 
+            InlineKeyboardButton(text="📝 دریافت اتچمنت", callback_data=f"get_attachments|{task.id}"), 
+        ],
+        [
+            InlineKeyboardButton(text="↩️ بازگشایی تسک", callback_data=f"finish_task|{task.id}")
+            if task.status == "done" else
+            InlineKeyboardButton(text="✅ اتمام تسک", callback_data=f"finish_task|{task.id}")
+        ],
+    ]
+
+    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+
 # ===== Handler for show group's tasks =====
 @router.callback_query(F.data.startswith("view_group|"))
-async def handle_view_group_tasks(callback_query: CallbackQuery):
-    db = None
+@router.callback_query(F.data.startswith("group_tasks|"))
+async def handle_view_group_tasks(callback_query: CallbackQuery, db: AsyncSession):
     try:
-        # Get database session
-        db = next(get_db())
-
-        # Extract group's ID
+        # Extract group's ID and page cursor
         try:
-            group_ID = callback_query.data.split("|")[1]
+            parts = callback_query.data.split("|")
+            group_ID = parts[1]
+            cursor = parts[2] if len(parts) > 2 else None
             if group_ID != "OTHER":
                 group_ID = int(group_ID)
-                group = TaskService.get_group(db=db, id=group_ID)
-                if group is None:
+                group = await TaskService.get_group(db=db, id=group_ID)
+                if not group:
                     await callback_query.answer("❌ مشکلی در پیدا کردن این گروه به وجود آمد")
             else:
                 group = None
@@ -86,16 +199,19 @@ async def handle_view_group_tasks(callback_query: CallbackQuery):
         
         topics = None
         tasks = None
-        if group:
-            topics = TaskService.get_all_topics(db=db, group_id=group.id)
-        if topics and len(topics) > 0:
+        if group and parts[0] == "view_group":
+            topics = await TaskService.get_topics_page(db=db, group_id=group.id, cursor=cursor)
+        if topics and topics.items:
             keyboard = InlineKeyboardMarkup(inline_keyboard=[])
             keyboard.inline_keyboard.extend(
                 [
                     [InlineKeyboardButton(text=b.name, callback_data=f"view_topic|{b.id}") for b in c]
-                    for c in chunk_list(topics, 2)
+                    for c in chunk_list(topics.items, 2)
                 ]
             )
+            navigation = page_buttons(topics, f"view_group|{group.id}")
+            if navigation:
+                keyboard.inline_keyboard.append(navigation)
             keyboard.inline_keyboard.append(
                 [
                     InlineKeyboardButton(text="باز گشت 🔙", callback_data="back"),
@@ -104,8 +220,9 @@ async def handle_view_group_tasks(callback_query: CallbackQuery):
             )
         
         else:
-            tasks = TaskService.get_all_tasks(db=db, group_id=group_ID)
-            if not tasks:
+            # Groups without topics page through their tasks instead
+            tasks = await TaskService.get_tasks_page(db=db, group_id=group_ID, cursor=cursor if parts[0] == "group_tasks" else None)
+            if not tasks or not tasks.items:
                 await callback_query.answer("⚠️ تسکی برای این گروه پیدا نشد ⚠️")
                 return
             
@@ -113,16 +230,25 @@ async def handle_view_group_tasks(callback_query: CallbackQuery):
             keyboard.inline_keyboard.extend(
                 [
                     [InlineKeyboardButton(text=b.title, callback_data=f"view_task|{b.id}") for b in c]
-                    for c in chunk_list(tasks, 2)
+                    for c in chunk_list(tasks.items, 2)
                 ]
             )
+            navigation = page_buttons(tasks, f"group_tasks|{group.id if group else 'OTHER'}")
+            if navigation:
+                keyboard.inline_keyboard.append(navigation)
             keyboard.inline_keyboard.append(
                 [InlineKeyboardButton(text="باز گشت 🔙", callback_data="back")]
             )
             
+        # Count the whole list, not just this page
+        if tasks:
+            total = await TaskService.count_tasks(db=db, group_id=group_ID)
+        else:
+            total = await TaskService.count_topics(db=db, group_id=group.id)
+
         await callback_query.message.edit_text(
             f"{"تسک" if tasks else "تاپیک"}{f"های گروه {group.name}" if group else " های سایر"}: \n"
-            f"تعداد: {len(tasks) if tasks else len(topics)}\n\n",
+            f"تعداد: {total}\n\n",
             reply_markup=keyboard
         )
     
@@ -133,41 +259,36 @@ async def handle_view_group_tasks(callback_query: CallbackQuery):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Ensure database connection is always closed
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close database connection")
 
 
 # ===== Handler for show topic's tasks =====
 @router.callback_query(F.data.startswith("view_topic|"))
-async def handle_view_topic_tasks(callback_query: CallbackQuery):
-    db = None
+async def handle_view_topic_tasks(callback_query: CallbackQuery, db: AsyncSession):
     try:
-        # Get database session
-        db = next(get_db())
-
-        # Extract topic's ID
+        # Extract topic's ID and page cursor
         try:
-            topic_ID = callback_query.data.split("|")[1]
+            parts = callback_query.data.split("|")
+            topic_ID = parts[1]
             if topic_ID == "OTHER":
-                group_ID = int(callback_query.data.split("|")[2])
+                group_ID = int(parts[2])
                 topic = None
                 topic_ID = False
+                cursor = parts[3] if len(parts) > 3 else None
+                callback_prefix = f"view_topic|OTHER|{group_ID}"
+            else:
+                topic_ID = int(topic_ID)
+                cursor = parts[2] if len(parts) > 2 else None
+                callback_prefix = f"view_topic|{topic_ID}"
         except Exception:
             logger.exception("Failed to extract topic's ID from callback_query")
             await callback_query.answer("❌ مشکلی در پیدا کردن این تاپیک به وجود آمد")
             return
 
         if topic_ID == False:
-            tasks = TaskService.get_all_tasks(db=db, topic_id=topic_ID, group_id=group_ID)
+            tasks = await TaskService.get_tasks_page(db=db, topic_id=topic_ID, group_id=group_ID, cursor=cursor)
         else:
-            tasks = TaskService.get_all_tasks(db=db, topic_id=topic_ID)
-        if not tasks:
+            tasks = await TaskService.get_tasks_page(db=db, topic_id=topic_ID, cursor=cursor)
+        if not tasks or not tasks.items:
             await callback_query.answer("⚠️ تسکی برای این تاپیک پیدا نشد ⚠️")
             return
         
@@ -175,16 +296,25 @@ async def handle_view_topic_tasks(callback_query: CallbackQuery):
         keyboard.inline_keyboard.extend(
             [
                 [InlineKeyboardButton(text=b.title, callback_data=f"view_task|{b.id}") for b in c]
-                for c in chunk_list(tasks, 2)
+                for c in chunk_list(tasks.items, 2)
             ]
         )
+        navigation = page_buttons(tasks, callback_prefix)
+        if navigation:
+            keyboard.inline_keyboard.append(navigation)
         keyboard.inline_keyboard.append(
             [InlineKeyboardButton(text="باز گشت 🔙", callback_data="back")]
         )
             
+        # Count the whole list, not just this page
+        if topic_ID == False:
+            total = await TaskService.count_tasks(db=db, topic_id=topic_ID, group_id=group_ID)
+        else:
+            total = await TaskService.count_tasks(db=db, topic_id=topic_ID)
+
         await callback_query.message.edit_text(
             f"تسک ها\n"
-            f"تعداد: {len(tasks)}\n\n",
+            f"تعداد: {total}\n\n",
             reply_markup=keyboard
         )
         await callback_query.answer()
@@ -196,14 +326,6 @@ async def handle_view_topic_tasks(callback_query: CallbackQuery):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Ensure database connection is always closed
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close database connection")
 
 
 
@@ -223,18 +345,22 @@ async def handle_view_group_tasks(callback_query: CallbackQuery):
 
 # ===== Handler for manage tasks =====
 @router.callback_query(F.data == "back")
+@router.callback_query(F.data.startswith("view_groups|"))
 @router.message(Command("tasks"))
-async def handle_task_manage(event: Message | CallbackQuery):
+async def handle_task_manage(event: Message | CallbackQuery, db: AsyncSession):
     """Main handler for manage tasks"""
-    db = None
     try:
-        db = next(get_db())  # Open a database session        
         # Check admin permission before proceeding
         permission = await admin_require(db, event)
         if not permission:
             return
         
-        text, keyboard = task_manage_keyboard(db=db)
+        # Page cursor of the group list, if a previous/next button was pressed
+        cursor = None
+        if isinstance(event, CallbackQuery) and event.data.startswith("view_groups|"):
+            cursor = event.data.split("|")[1]
+
+        text, keyboard = await task_manage_keyboard(db=db, cursor=cursor)
 
         text="\n".join(text)
         if isinstance(event, CallbackQuery):
@@ -253,106 +379,43 @@ async def handle_task_manage(event: Message | CallbackQuery):
                 await event.answer(text=text, reply_markup=keyboard)
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 # ====== Task View Menu ======
 @router.callback_query(F.data.startswith("view_task|"))
 @router.callback_query(F.data.startswith("show_task|"))
-async def handle_view_task(callback_query: CallbackQuery, state: FSMContext = None):
+async def handle_view_task(callback_query: CallbackQuery, db: AsyncSession, state: FSMContext = None):
     """Handle view task callback"""   
-    db = None 
     try:
         show_type = callback_query.data.split("|")[0]
         task_id = int(callback_query.data.split("|")[1])
         if state:
             await state.clear()
 
-        db = next(get_db())
-        task = TaskService.get_task_by_id(db=db, id=task_id)
-        admin = UserService.get_user(db, user_ID=task.admin_id)
-        group = TaskService.get_group(db, task.group_id)
-        topic = TaskService.get_topic(db=db, id=task.topic_id)
-            
-        
-        if not task or not admin:
-            await callback_query.answer("❌ تسک یافت نشد")
-            return
-        
-        # Create task management buttons
-        keyboard_buttons = [
-            [
-                InlineKeyboardButton(text="🔙 بازگشت", callback_data="back"),
-                InlineKeyboardButton(text="🗑️ حذف تسک", callback_data=f"delete_task|{task.id}"),
-            ],
-            [
-                InlineKeyboardButton(text="👥 افزودن کاربر", callback_data=f"add_user|{task.id}"), 
-                InlineKeyboardButton(text="👥 حذف کاربر", callback_data=f"del_users|{task.id}")
-            ],
-            [
-                InlineKeyboardButton(text="👥 کاربران", callback_data=f"view_task_users|{task.id}"),
-                InlineKeyboardButton(text="⏰ ویرایش زمان پایان", callback_data=f"edit_end|{task.id}")
-            ],
-            [
-                InlineKeyboardButton(text="📝 ویرایش توضیحات", callback_data=f"edit_desc|{task.id}"), 
-                InlineKeyboardButton(text="📋 ویرایش نام", callback_data=f"edit_name|{task.id}")
-            ],
-            [
-                InlineKeyboardButton(text="📝 افزودن اتچمنت", callback_data=f"add_attachment|{task.id}"), 
-                InlineKeyboardButton(text="📝 دریافت اتچمنت", callback_data=f"get_attachments|{task.id}"), 
-            ],
-        ]
-
-        if show_type == "show_task":
-            keyboard_buttons = [
-                [
-                    InlineKeyboardButton(text="🔙 بازگشت", callback_data="back_show"),
-                ],
-                [
-                    InlineKeyboardButton(text="📝 دریافت اتچمنت", callback_data=f"get_attachments|{task.id}"), 
-                ],
-            ]
-
-        
-        inline_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-
-        # Get all users assigned to this task
-        assigned_users = TaskService.get_task_users(db=db, task_id=task_id)
-        
-        # Create message text for assigned_users
-        if assigned_users:
-            users_text = "👥 کاربران اختصاص داده شده به این تسک:\n\n"
-            for i, user in enumerate(assigned_users, 1):
-                users_text += f"{i}. {user.username}\n"
-        else:
-            users_text = "📝 هیچ کاربری به این تسک اختصاص داده نشده است."
-        
-        text = [
-            f"📋 {task.title}\n\n",
-            f"مدیر : @{admin.username}\n",
-            f"📝 توضیحات: {task.description or 'بدون توضیح'}\n",
-            f"📅 شروع: {task.start_date.strftime('%Y-%m-%d') if task.start_date else 'تعیین نشده'}\n",
-            f"📅 پایان: {task.end_date.strftime('%Y-%m-%d') if task.end_date else 'تعیین نشده'}\n",
-            f"🔧 وضعیت: {task.status}\n\n",
-            users_text,
-        ]
-        if topic:
-            text.insert(2, f"تاپیک : {topic.name} - {topic.link}\n")
-        if group:
-            text.insert(2, f"گروه : {group.name}\n")
+        # Rendered card of the task, only built from the database after the task changed
+        card = cached_task_card(db, (task_id, show_type))
+        if card is MISSING:
+            generation = task_card_cache.generation
+            # A lagging replica could render a card older than the last invalidation
+            use_primary(db)
+            # Task with its admin, group, topic and assigned users
+            task = await TaskService.get_task_card(db=db, task_id=task_id)
+
+            if not task or not task.admin_username:
+                await callback_query.answer("❌ تسک یافت نشد")
+                return
 
-        text = "".join(text)
+            card = RenderedCard(
+                text=task_card_text(task),
+                keyboard=task_card_keyboard(task, show_type),
+                usernames=frozenset((task.admin_username, *task.usernames)),
+            )
+            # Cached once the update committed, so a card rendered from changes which roll back is never kept
+            after_commit(db, partial(task_card_cache.set_if_current, (task_id, show_type), card, generation))
 
         # Edit previous message
         await callback_query.message.edit_text(
-            text=text,
-            reply_markup=inline_keyboard
+            text=card.text,
+            reply_markup=card.keyboard
         )
         
         await callback_query.answer()
@@ -364,43 +427,33 @@ async def handle_view_task(callback_query: CallbackQuery, state: FSMContext = No
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 # ====== Delete Task ======
 @router.callback_query(F.data.startswith("delete_task|"))
-async def handle_delete_task(callback_query: CallbackQuery):
+async def handle_delete_task(callback_query: CallbackQuery, db: AsyncSession):
     """Handle delete task callback"""
-    db = None
     try:
         task_id = int(callback_query.data.split("|")[1])
 
-        db = next(get_db())
-        task = TaskService.get_task_by_id(db=db, id=task_id)
+        task = await TaskService.get_task_by_id(db=db, id=task_id)
         
         if not task:
             await callback_query.answer("❌ تسک یافت نشد")
             # Return to task list if task not found
-            await handle_task_manage(callback_query)
+            await handle_task_manage(callback_query, db=db)
             return
         
         task_title = task.title
         
         # Delete task
-        res = TaskService.delete_task(db=db, task=task)
+        res = await TaskService.delete_task(db=db, task=task)
         if not res:
             await callback_query.answer("❌ خطا در حذف تسک")
 
         await callback_query.answer(f"✅ حذف شد {task_title} تسک")
         
         # Return to task list
-        await handle_task_manage(callback_query)
+        await handle_task_manage(callback_query, db=db)
         
     except Exception:
         # Log unexpected errors
@@ -409,14 +462,126 @@ async def handle_delete_task(callback_query: CallbackQuery):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
+
+
+# ====== Finish / Reopen Task ======
+@router.callback_query(F.data.startswith("finish_task|"))
+async def handle_finish_task(callback_query: CallbackQuery, db: AsyncSession):
+    """Mark a task as done, or reopen a done task. Done tasks are archived by the archive job"""
+    try:
+        permission = await admin_require(db, callback_query)
+        if not permission:
+            return
+
+        task_id = int(callback_query.data.split("|")[1])
+
+        # The new status depends on the current one, which the replica may not have yet
+        use_primary(db)
+        task = await TaskService.get_task_by_id(db=db, id=task_id)
+        if not task:
+            await callback_query.answer("❌ تسک یافت نشد")
+            return
+
+        status = "pending" if task.status == "done" else "done"
+        res = await TaskService.edit_task(db=db, task_id=task_id, status=status)
+        if res is not True:
+            await callback_query.answer("❌ خطا در تغییر وضعیت تسک")
+            return
+
+        # Show the task again with its new status
+        mock_callback = get_callback(callback_query, f"view_task|{task_id}")
+        await handle_view_task(mock_callback, db=db)
+
+    except Exception:
+        # Log unexpected errors
+        logger.exception("Unexpected error occurred")
+        try:
+            await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
+        except Exception:
+            logger.exception("Failed to send error message")
+
+
+# ====== Archived Tasks ======
+@router.callback_query(F.data.startswith("view_archive|"))
+async def handle_view_archive(callback_query: CallbackQuery, db: AsyncSession):
+    """Paginated list of archived tasks, read from the archive tables only"""
+    try:
+        permission = await admin_require(db, callback_query)
+        if not permission:
+            return
+
+        cursor = callback_query.data.split("|")[1] or None
+
+        tasks = await TaskService.get_archived_tasks_page(db=db, cursor=cursor)
+        if isinstance(tasks, ServiceError):
+            await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
+            return
+        task_count = await TaskService.count_archived_tasks(db=db)
+
+        keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text=b.title, callback_data=f"archived_task|{b.id}") for b in c]
+                for c in chunk_list(tasks.items, 2)
+            ]
+        )
+        navigation = page_buttons(tasks, "view_archive")
+        if navigation:
+            keyboard.inline_keyboard.append(navigation)
+        keyboard.inline_keyboard.append(
+            [InlineKeyboardButton(text="باز گشت 🔙", callback_data="back")]
+        )
+
+        if task_count:
+            text = f"🗄 تسک های آرشیو شده : \n تعداد: {task_count}"
+        else:
+            text = "⚠️ هیچ تسک آرشیو شده ای وجود ندارد ⚠️"
+
+        await callback_query.message.edit_text(text=text, reply_markup=keyboard)
+        await callback_query.answer()
+
+    except Exception:
+        # Log unexpected errors
+        logger.exception("Unexpected error occurred")
+        try:
+            await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
+        except Exception:
+            logger.exception("Failed to send error message")
+
+
+@router.callback_query(F.data.startswith("archived_task|"))
+async def handle_view_archived_task(callback_query: CallbackQuery, db: AsyncSession):
+    """Read-only view of an archived task"""
+    try:
+        permission = await admin_require(db, callback_query)
+        if not permission:
+            return
+
+        archive_id = int(callback_query.data.split("|")[1])
+
+        task = await TaskService.get_archived_task_card(db=db, archive_id=archive_id)
+        if not task:
+            await callback_query.answer("❌ تسک یافت نشد")
+            return
+
+        keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text="🔙 بازگشت", callback_data="view_archive|")]
+            ]
+        )
+
+        await callback_query.message.edit_text(
+            text="🗄 آرشیو شده\n\n" + task_card_text(task),
+            reply_markup=keyboard
+        )
+        await callback_query.answer()
+
+    except Exception:
+        # Log unexpected errors
+        logger.exception("Unexpected error occurred")
+        try:
+            await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
+        except Exception:
+            logger.exception("Failed to send error message")
 
 
 # ====== Edit Task States ======
@@ -428,12 +593,10 @@ class EditTaskStates(StatesGroup):
 
 # ====== Edit Task Name ======
 @router.callback_query(F.data.startswith("edit_name|"))
-async def handle_edit_name(callback_query: CallbackQuery, state: FSMContext):
-    db = None
+async def handle_edit_name(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
     try:
         task_id = int(callback_query.data.split("|")[1])
-        db = next(get_db())
-        task = TaskService.get_task_by_id(db=db, id=task_id)
+        task = await TaskService.get_task_by_id(db=db, id=task_id)
 
         if not task:
             await callback_query.answer("❌ تسک یافت نشد")
@@ -464,26 +627,16 @@ async def handle_edit_name(callback_query: CallbackQuery, state: FSMContext):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 @router.message(EditTaskStates.waiting_for_name)
-async def process_edit_name(message: Message, state: FSMContext):
-    db = None
+async def process_edit_name(message: Message, state: FSMContext, db: AsyncSession):
     try:
         new_name = message.text.strip()
         data = await state.get_data()
         task_id = int(data.get("task_id"))
         prompt_msg_id = data.get("prompt_msg_id")
 
-        db = next(get_db())
-        res = TaskService.edit_task(db=db, task_id=task_id, name=new_name)
+        res = await TaskService.edit_task(db=db, task_id=task_id, name=new_name)
 
         # پیام کاربر پاک بشه
         await message.delete()
@@ -534,23 +687,13 @@ async def process_edit_name(message: Message, state: FSMContext):
             )
         except Exception:
             logger.exception(f"Failed to send error message")
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 # ====== Edit Task Description ======
 @router.callback_query(F.data.startswith("edit_desc|"))
-async def handle_edit_desc(callback_query: CallbackQuery, state: FSMContext):
-    db = None
+async def handle_edit_desc(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
     try:
         task_id = int(callback_query.data.split("|")[1])
-        db = next(get_db())
-        task = TaskService.get_task_by_id(db=db, id=task_id)
+        task = await TaskService.get_task_by_id(db=db, id=task_id)
 
         if not task:
             await callback_query.answer("❌ تسک یافت نشد")
@@ -581,26 +724,16 @@ async def handle_edit_desc(callback_query: CallbackQuery, state: FSMContext):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 @router.message(EditTaskStates.waiting_for_desc)
-async def process_edit_desc(message: Message, state: FSMContext):
-    db = None
+async def process_edit_desc(message: Message, state: FSMContext, db: AsyncSession):
     try:
         new_des = message.text.strip()
         data = await state.get_data()
         task_id = int(data.get("task_id"))
         prompt_msg_id = data.get("prompt_msg_id")
 
-        db = next(get_db())
-        res = TaskService.edit_task(db=db, task_id=task_id, description=new_des)
+        res = await TaskService.edit_task(db=db, task_id=task_id, description=new_des)
 
         # پیام کاربر پاک بشه
         await message.delete()
@@ -651,31 +784,20 @@ async def process_edit_desc(message: Message, state: FSMContext):
             )
         except Exception:
             logger.exception(f"Failed to send error message")
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 
 
 # ====== Edit Task End Date ======
 @router.callback_query(F.data.startswith("edit_end|"))
-async def handle_edit_end(callback_query: CallbackQuery, state: FSMContext):
+async def handle_edit_end(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
     """
     When user clicks 'edit_end|<task_id>', ask them for a new end date.
     """
-    db = None
     try:
         # Extract task_id from callback data
         task_id = int(callback_query.data.split("|")[1])
 
-        # Open DB session
-        db = next(get_db())
-        task = TaskService.get_task_by_id(db=db, id=task_id)
+        task = await TaskService.get_task_by_id(db=db, id=task_id)
 
         # If task does not exist
         if not task:
@@ -713,22 +835,13 @@ async def handle_edit_end(callback_query: CallbackQuery, state: FSMContext):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message") 
-    
-    finally:
-        # Always close DB session
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close DB session in handle_edit_end")
 
 # ====== Process new end date ======
 @router.message(EditTaskStates.waiting_for_end)
-async def process_edit_end(message: Message, state: FSMContext):
+async def process_edit_end(message: Message, state: FSMContext, db: AsyncSession):
     """
     Process user input (new end date) and update the task in DB.
     """
-    db = None
     try:
         # Get text input from user
         date_text = message.text.strip()
@@ -771,8 +884,7 @@ async def process_edit_end(message: Message, state: FSMContext):
             return
 
         # Update task in DB
-        db = next(get_db())
-        res = TaskService.edit_task(
+        res = await TaskService.edit_task(
             db=db,
             task_id=task_id,
             end_date=new_end
@@ -847,88 +959,97 @@ async def process_edit_end(message: Message, state: FSMContext):
             await message.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message in process_edit_end") 
-    
-    finally:
-        # Always close DB session
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close DB session in process_edit_end")
 
 
 # ====== Add User to Task ======
+async def assign_candidates_page(db: AsyncSession, callback_query: CallbackQuery, task_id: int, group_id: int | None, cursor: str = None):
+    """
+    One page of the users who can be assigned to a task on the multi-select screen.
+    In groups these are the members of the group as mirrored in group_members, plus its
+    administrators, which are cached and known even before any member update arrived.
+    """
+    telegram_ids = []
+    if group_id:
+        chat_admins = await get_chat_admins(callback_query.message.bot, callback_query.message.chat.id)
+        telegram_ids = [str(user.id) for user in chat_admins.values() if not user.is_bot]
+    return await UserService.get_users_page(
+        db,
+        user_tID=callback_query.from_user.id,
+        task_id=task_id,
+        group_id=group_id,
+        telegram_ids=telegram_ids,
+        cursor=cursor,
+    )
+
+
+def assign_users_keyboard(task_id: int, page, selected_ids: List[int]) -> InlineKeyboardMarkup:
+    """
+    Keyboard of the multi-select assignment screen: one page of candidates, selected users are shown ticked.
+    """
+    keyboard_buttons = []
+    for user in page.items:
+        mark = "✅" if user.id in selected_ids else "⬜️"
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=f"{mark} {user.username}",
+                callback_data=f"toggle_assign|{user.id}"
+            )
+        ])
+
+    navigation = page_buttons(page, "assign_page")
+    if navigation:
+        keyboard_buttons.append(navigation)
+
+    # Confirm the selection, and a back button
+    keyboard_buttons.append([
+        InlineKeyboardButton(text="🔙 بازگشت", callback_data=f"view_task|{task_id}"),
+        InlineKeyboardButton(text=f"✔️ تایید ({len(selected_ids)})", callback_data="confirm_assign"),
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
 @router.callback_query(F.data.startswith("add_user|"))
-async def handle_add_user(callback_query: CallbackQuery, state: FSMContext):
+async def handle_add_user(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Handle add user to task callback"""   
-    db = None 
     try:
         task_id = int(callback_query.data.split("|")[1])
 
-        db = next(get_db())
-        task = TaskService.get_task_by_id(db=db, id=task_id)
+        task = await TaskService.get_task_by_id(db=db, id=task_id)
         
         if not task:
             await callback_query.answer("❌ تسک یافت نشد")
             return
         
-        # Store task info in state
-        await state.update_data(
-            task_id=task_id,
-            callback_message_id=callback_query.message.message_id
-        )
-        
-        # Get suggested users from database
-        suggested_users = list(UserService.get_all_users(db, user_tID=callback_query.from_user.id, task_id=task_id))
-        if len(suggested_users) == 0:
-            await callback_query.answer("⚠️ کاربری برای نمایش وجود ندارد ⚠️")
-            return
-        
+        group_id = None
         if callback_query.message.chat.type in ("group", "supergroup"):
-            try:
-                # Get all chat members
-                chat_members = await callback_query.message.bot.get_chat_administrators(callback_query.message.chat.id)
-                group_users = [member.user for member in chat_members if not member.user.is_bot]
-
-                group_users_ids = {user.id for user in group_users}
-                suggested_users = [user.username for user in suggested_users if user.telegram_id in group_users_ids]
-
-                if len(suggested_users) == 0:
-                    await callback_query.answer("⚠️ کاربری برای نمایش وجود ندارد ⚠️")
-                    return
-
-            except Exception:
-                logger.exception("Failed to fetch group members for suggested users")
-                await callback_query.answer("❌ خطایی در پیدا کردن کاربران به وجود آمد")
+            group_id = await TaskService.resolve_group_id(db=db, tID=str(callback_query.message.chat.id))
+            if not group_id:
+                await callback_query.answer("⚠️ کاربری برای نمایش وجود ندارد ⚠️")
                 return
-        else:
-            suggested_users = [user.username for user in suggested_users]
-        
-        # Create inline keyboard with suggested users
-        keyboard_buttons = []
-        
-        # Add suggested users as buttons
-        if len(list(suggested_users)) != 0:
-            for username in suggested_users:
-                keyboard_buttons.append([
-                    InlineKeyboardButton(
-                        text=f"👤 {username}",
-                        callback_data=f"select_user|{username}"
-                    )
-                ])
+
+        page = await assign_candidates_page(db, callback_query, task_id=task_id, group_id=group_id)
+        if isinstance(page, ServiceError):
+            await callback_query.answer("❌ خطایی در پیدا کردن کاربران به وجود آمد")
+            return
+        if not page.items:
+            await callback_query.answer("⚠️ کاربری برای نمایش وجود ندارد ⚠️")
+            return
         
-        # Add back button
-        keyboard_buttons.append([
-            InlineKeyboardButton(
-                text="🔙 بازگشت",
-                callback_data=f"view_task|{task_id}"
-            )
-        ])
+        # Only the selection and where to find the candidates are kept in state, candidates are paged from the database
+        await state.update_data(
+            task_id=task_id,
+            callback_message_id=callback_query.message.message_id,
+            assign_group_id=group_id,
+            assign_cursor=None,
+            selected_user_ids=[],
+        )
         
-        inline_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+        inline_keyboard = assign_users_keyboard(task_id, page, [])
         
         # Edit message to show user selection
-        message_text = f"👥 افزودن کاربر به تسک: {task.title}\n\n"
+        message_text = (
+            f"👥 افزودن کاربر به تسک: {task.title}\n\n"
+            "کاربران مورد نظر را انتخاب کنید و سپس تایید را بزنید"
+        )
         
         await callback_query.message.edit_text(
             message_text,
@@ -944,49 +1065,80 @@ async def handle_add_user(callback_query: CallbackQuery, state: FSMContext):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
-@router.callback_query(F.data.startswith("select_user|"))
-async def handle_select_user(callback_query: CallbackQuery, state: FSMContext):
-    """Handle user selection from suggested users"""
+@router.callback_query(F.data.startswith("assign_page|"))
+@router.callback_query(F.data.startswith("toggle_assign|"))
+async def handle_toggle_assign(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
+    """Show another page of candidates, or select or unselect a candidate on the assignment screen"""
     try:
-        username = callback_query.data.split("|")[1]
+        action, value = callback_query.data.split("|", maxsplit=1)
 
         data = await state.get_data()
-        task_id_str = data.get('task_id')
-        if not task_id_str:
+        task_id = data.get('task_id')
+        if not task_id or 'assign_cursor' not in data:
             await callback_query.answer("❌ اطلاعات تسک یافت نشد")
             return
-        task_id = int(task_id_str)
-        
+
+        cursor = value if action == "assign_page" else data['assign_cursor']
+        page = await assign_candidates_page(db, callback_query, task_id=task_id, group_id=data.get('assign_group_id'), cursor=cursor)
+        if isinstance(page, ServiceError):
+            await callback_query.answer("❌ خطایی در پیدا کردن کاربران به وجود آمد")
+            return
+
+        selected_ids = data.get('selected_user_ids', [])
+        if action == "toggle_assign":
+            user_id = int(value)
+            # Only users offered on the screen can be selected
+            if user_id not in {user.id for user in page.items}:
+                await callback_query.answer("❌ این کاربر قابل انتخاب نیست")
+                return
+            if user_id in selected_ids:
+                selected_ids.remove(user_id)
+            else:
+                selected_ids.append(user_id)
+        await state.update_data(selected_user_ids=selected_ids, assign_cursor=cursor)
+
+        await callback_query.message.edit_reply_markup(
+            reply_markup=assign_users_keyboard(task_id, page, selected_ids)
+        )
+        await callback_query.answer()
+
+    except Exception:
+        # Log unexpected errors
+        logger.exception("Unexpected error occurred")
+        try:
+            await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
+        except Exception:
+            logger.exception("Failed to send error message")   
+
+@router.callback_query(F.data == "confirm_assign")
+async def handle_confirm_assign(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
+    """Assign all selected users to the task at once"""
+    try:
+        data = await state.get_data()
+        task_id = data.get('task_id')
         if not task_id:
             await callback_query.answer("❌ اطلاعات تسک یافت نشد")
             return
-        
-        db = next(get_db())
-        
-        # Find or create user
-        user = UserService.get_or_create_user(db, username=username)
-        if not user:
-            await callback_query.answer("❌ خطا در پیدا کردن کاربر")
-                
-        # Assign user to task
-        res = UserService.assign_user_to_task(db, user.id, task_id)
-        if not res:
+
+        selected_ids = data.get('selected_user_ids', [])
+        if not selected_ids:
+            await callback_query.answer("⚠️ هیچ کاربری انتخاب نشده است")
+            return
+
+        # Assign users to task
+        assigned = await UserService.assign_users_to_task(db, task_id=int(task_id), user_ids=selected_ids)
+        if isinstance(assigned, ServiceError):
             await callback_query.answer("❌  خطا در افزودن کاربر به تسک")
-        
-        await callback_query.answer(f"✅ کاربر @{username} اضافه شد")
-        
-        # Clear state
+            return
+
+        await callback_query.answer(f"✅ {len(assigned)} کاربر اضافه شد")
+
+        # Clear state and go back to the task view
         await state.clear()
-        
+        mock_callback = get_callback(callback_query, f"view_task|{task_id}")
+        await handle_view_task(mock_callback, db=db)
+
     except Exception:
         # Log unexpected errors
         logger.exception("Unexpected error occurred")
@@ -994,46 +1146,29 @@ async def handle_select_user(callback_query: CallbackQuery, state: FSMContext):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 
 # ====== View Task Users ======
 @router.callback_query(F.data.startswith("view_task_users|"))
-async def handle_view_task_users(callback_query: CallbackQuery):
+async def handle_view_task_users(callback_query: CallbackQuery, db: AsyncSession):
     """Handle view task users callback - display users assigned to a task"""    
-    db = None
     try:
         task_id = int(callback_query.data.split("|")[1])
 
-        db = next(get_db())
         
-        # Get task information
-        task = TaskService.get_task_by_id(db=db, id=task_id)
+        # Get task information with its admin and assigned users
+        task = await TaskService.get_task_card(db=db, task_id=task_id)
         if not task:
             await callback_query.answer("❌ تسک یافت نشد")
             return
-        
-        # Get all users assigned to this task
-        assigned_users = TaskService.get_task_users(db=db, task_id=task_id)
 
-        admin_user = UserService.get_user(db=db, user_ID=task.admin_id)
-        if admin_user:
-            task_admin_username = admin_user.username
-        else:
-            task_admin_username = "نامشخص"
+        task_admin_username = task.admin_username or "نامشخص"
         
         # Create message text
-        if assigned_users:
+        if task.usernames:
             users_text = "👥 کاربران اختصاص داده شده به این تسک:\n\n"
-            for i, user in enumerate(assigned_users, 1):
-                users_text += f"{i}. {user.username}\n"
+            for i, username in enumerate(task.usernames, 1):
+                users_text += f"{i}. {username}\n"
         else:
             users_text = "📝 هیچ کاربری به این تسک اختصاص داده نشده است."
         
@@ -1061,14 +1196,6 @@ async def handle_view_task_users(callback_query: CallbackQuery):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 
 # ====== Delete User States ======
@@ -1078,16 +1205,13 @@ class DeleteUserStates(StatesGroup):
 
 # ====== Delete User from Task ======
 @router.callback_query(F.data.startswith("del_users|"))
-async def handle_delete_user_menu(callback_query: CallbackQuery, state: FSMContext):
+async def handle_delete_user_menu(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Handle delete user from task menu callback"""
-    db = None
     try:
         # Extract task ID from callback data
         task_id = int(callback_query.data.split("|")[1])
 
-        # Open a database session
-        db = next(get_db())
-        task = TaskService.get_task_by_id(db=db, id=task_id)
+        task = await TaskService.get_task_by_id(db=db, id=task_id)
         
         if not task:
             # Task not found
@@ -1095,7 +1219,7 @@ async def handle_delete_user_menu(callback_query: CallbackQuery, state: FSMConte
             return
         
         # Get all users assigned to this task
-        assigned_users = TaskService.get_task_users(db=db, task_id=task_id)
+        assigned_users = await TaskService.get_task_users(db=db, task_id=task_id)
         
         if not assigned_users:
             # No users to delete
@@ -1154,21 +1278,12 @@ async def handle_delete_user_menu(callback_query: CallbackQuery, state: FSMConte
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database session
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 # ====== Final User Deletion ======
 @router.callback_query(F.data.startswith("delete_user_final|"))
-async def handle_delete_user_final(callback_query: CallbackQuery, state: FSMContext):
+async def handle_delete_user_final(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Handle final deletion of a selected user from a task"""
     user_id_to_delete = int(callback_query.data.split("|")[1])
-    db = None
     try:
         # Get stored FSM state data
         data = await state.get_data()
@@ -1178,19 +1293,17 @@ async def handle_delete_user_final(callback_query: CallbackQuery, state: FSMCont
             await callback_query.answer("❌ اطلاعات تسک یافت نشد")
             return
         
-        # Open a database session
-        db = next(get_db())
         
         # Fetch user and task info for display
-        user_to_delete = UserService.get_user(db=db, user_ID=user_id_to_delete)
-        task = TaskService.get_task_by_id(db=db, id=task_id)
+        user_to_delete = await UserService.get_user(db=db, user_ID=user_id_to_delete)
+        task = await TaskService.get_task_by_id(db=db, id=task_id)
         
         if not user_to_delete or not task:
             await callback_query.answer("❌ اطلاعات یافت نشد")
             return
         
         # Attempt to delete the user from the task
-        res = TaskService.delete_user_from_task(db=db, task_id=task_id, user_id=user_id_to_delete)
+        res = await TaskService.delete_user_from_task(db=db, task_id=task_id, user_id=user_id_to_delete)
 
         # Prepare a mock callback for returning to task view
         mock_callback = get_callback(callback_query, f"view_task|{task_id}")
@@ -1200,7 +1313,7 @@ async def handle_delete_user_final(callback_query: CallbackQuery, state: FSMCont
             await callback_query.answer(f"✅ کاربر @{user_to_delete.username} حذف شد")
             
             # Call view task handler to refresh the view
-            await handle_view_task(mock_callback)
+            await handle_view_task(mock_callback, db=db)
 
             # Clear FSM state
             await state.clear()
@@ -1210,7 +1323,7 @@ async def handle_delete_user_final(callback_query: CallbackQuery, state: FSMCont
             await callback_query.answer("❌ کاربر در این تسک وجود ندارد")
 
             # Refresh task view
-            await handle_view_task(mock_callback)
+            await handle_view_task(mock_callback, db=db)
 
             # Clear FSM state
             await state.clear()
@@ -1221,7 +1334,7 @@ async def handle_delete_user_final(callback_query: CallbackQuery, state: FSMCont
             await callback_query.answer("❌ خطا در حذف کاربر")
 
             # Refresh task view
-            await handle_view_task(mock_callback)
+            await handle_view_task(mock_callback, db=db)
 
             # Clear FSM state
             await state.clear()
@@ -1234,14 +1347,6 @@ async def handle_delete_user_final(callback_query: CallbackQuery, state: FSMCont
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database session
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")            
 
 
 
@@ -1290,11 +1395,10 @@ async def handle_add_attachment(callback_query: CallbackQuery, state: FSMContext
 
 
 @router.message(F.document | F.photo | F.video | F.audio | F.voice)
-async def handle_new_attachment(message: Message, state: FSMContext):
+async def handle_new_attachment(message: Message, state: FSMContext, db: AsyncSession):
     """
     Handle any new messages or files as attachments if the user is in 'adding_attachments' mode.
     """
-    db = None
     try:
         data = await state.get_data()
         adding_attachments = data.get("adding_attachments", False)
@@ -1304,31 +1408,29 @@ async def handle_new_attachment(message: Message, state: FSMContext):
             # Not in attachment adding mode
             return
 
-        db = next(get_db())
-
-        attachment_id = None
-
         # Determine attachment type
-        if message.document:
-            attachment_id = message.document.file_id
-        elif message.photo:
-            # For photo, take the highest resolution
-            attachment_id = message.photo[-1].file_id
-        elif message.video:
-            attachment_id = message.video.file_id
-        elif message.audio:
-            attachment_id = message.audio.file_id
-        elif message.voice:
-            attachment_id = message.voice.file_id
-        else:
+        media = get_message_media(message)
+        if not media:
             # You can extend for other message types
             return
+        file_id, file_unique_id, media_type = media[0]
 
         # Save attachment to database
-        TaskAttachmentService.add_attachment(db=db, task_id=task_id, attachment_id=attachment_id)
+        res = await TaskAttachmentService.add_attachment(
+            db=db,
+            task_id=task_id,
+            file_id=file_id,
+            file_unique_id=file_unique_id,
+            media_type=media_type
+        )
 
         # Optionally notify user
-        msg = await message.answer("✅ فایل به عنوان اتچمنت اضافه شد")
+        if res == "EXIST":
+            msg = await message.answer("⚠️ این فایل قبلاً به تسک اضافه شده است")
+        elif res:
+            msg = await message.answer("✅ فایل به عنوان اتچمنت اضافه شد")
+        else:
+            msg = await message.answer("❌ خطا در افزودن فایل به اتچمنت")
         await del_message(3, msg)
 
     except Exception:
@@ -1337,49 +1439,32 @@ async def handle_new_attachment(message: Message, state: FSMContext):
             await message.answer("❌ خطا در افزودن فایل به اتچمنت")
         except Exception:
             logger.exception("Failed to send error message")
-    
-    finally:
-        if db:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close DB session")
 
 
 # ====== Send Attachments of Task to User ======
 @router.callback_query(F.data.startswith("get_attachments|"))
-async def handle_get_attachments(callback_query: CallbackQuery):
+async def handle_get_attachments(callback_query: CallbackQuery, db: AsyncSession):
     """
     Send all attachments of a task to the same chat without editing the original message.
     Detect attachment type and use appropriate send method.
     """
-    db = None
     try:
         task_id = int(callback_query.data.split("|")[1])
-        db = next(get_db())
 
         # Get all attachments for the task
-        attachments = TaskAttachmentService.get_attachments(db=db, task_id=task_id)
+        attachments = await TaskAttachmentService.get_attachments(db=db, task_id=task_id)
 
         if not attachments:
             await callback_query.answer("⚠️ هیچ اتچمنتی برای این تسک وجود ندارد", show_alert=True)
             return
 
-        # Send each attachment using the correct method
+        # Send each attachment using the method of its stored media type
         for attachment in attachments:
-            file_id = attachment
-
-            # Simple detection based on file_id prefix (Telegram file_id conventions)
-            if file_id.startswith("AgAC"):  # likely photo/video (depends on your storage)
-                await callback_query.message.bot.send_photo(
-                    chat_id=callback_query.message.chat.id,
-                    photo=file_id
-                )
-            else:
-                await callback_query.message.bot.send_document(
-                    chat_id=callback_query.message.chat.id,
-                    document=file_id
-                )
+            method, argument = ATTACHMENT_SENDERS.get(attachment.media_type, ATTACHMENT_SENDERS["document"])
+            await getattr(callback_query.message.bot, method)(
+                chat_id=callback_query.message.chat.id,
+                **{argument: attachment.file_id}
+            )
 
         await callback_query.answer("✅ همه اتچمنت‌ها ارسال شدند", show_alert=True)
 
@@ -1389,28 +1474,19 @@ async def handle_get_attachments(callback_query: CallbackQuery):
             await callback_query.answer("❌ خطا در ارسال اتچمنت‌ها", show_alert=True)
         except Exception:
             logger.exception("Failed to send error message")
-    
-    finally:
-        if db:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close DB session")
 
 
 # ====== Show user's tasks ======
-async def handle_my_tasks(event: Message | CallbackQuery):
+async def handle_my_tasks(event: Message | CallbackQuery, db: AsyncSession, cursor: str = None):
     """
-    Show all tasks assigned to the current user with inline buttons.
+    Show one page of the tasks assigned to the current user with inline buttons.
     """
-    db = None
     try:
         # Assuming telegram_id is unique for users
         telegram_id = event.from_user.id
-        db = next(get_db())
 
         # Get the User object
-        user = UserService.get_user(user_tID=telegram_id)
+        user = await UserService.get_identity(db=db, user_tID=telegram_id)
         if not user:
             if isinstance(event, CallbackQuery):
                 await event.answer("⚠️ شما در سیستم ثبت نشده‌اید", show_alert=True)
@@ -1418,9 +1494,9 @@ async def handle_my_tasks(event: Message | CallbackQuery):
                 await event.answer("⚠️ شما در سیستم ثبت نشده‌اید")
             return
 
-        # Get tasks assigned to this user
-        tasks = TaskService.get_tasks_for_user(db=db, user_id=user.id)
-        if not tasks:
+        # Get one page of the tasks assigned to this user
+        tasks = await TaskService.get_tasks_page(db=db, user_id=user.id, cursor=cursor)
+        if not tasks or not tasks.items:
             if isinstance(event, CallbackQuery):
                 await event.answer("⚠️ هیچ تسکی برای شما وجود ندارد", show_alert=True)
             else:
@@ -1429,13 +1505,16 @@ async def handle_my_tasks(event: Message | CallbackQuery):
 
         # Build inline keyboard
         keyboard_buttons = []
-        for task in tasks:
+        for task in tasks.items:
             keyboard_buttons.append([
                 InlineKeyboardButton(
                     text=task.title,
                     callback_data=f"show_task|{task.id}"
                 )
             ])
+        navigation = page_buttons(tasks, "my_tasks_page")
+        if navigation:
+            keyboard_buttons.append(navigation)
         inline_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
         # Send message with tasks
@@ -1468,33 +1547,59 @@ async def handle_my_tasks(event: Message | CallbackQuery):
                 await event.answer("⚠️ هیچ تسکی برای شما وجود ندارد")
         except Exception:
             logger.exception("Failed to send error message")
-    
-    finally:
-        if db:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close DB session")
 
 
 @router.message(F.text == "تسک های من")
-async def handle_my_tasks_message(message: Message):
-    await handle_my_tasks(event=message)
+async def handle_my_tasks_message(message: Message, db: AsyncSession):
+    await handle_my_tasks(event=message, db=db)
 
 @router.callback_query(F.data == "back_show")
-async def handle_my_tasks_callback(callback: CallbackQuery):
-    await handle_my_tasks(event=callback)
+async def handle_my_tasks_callback(callback: CallbackQuery, db: AsyncSession):
+    await handle_my_tasks(event=callback, db=db)
+
+@router.callback_query(F.data.startswith("my_tasks_page|"))
+async def handle_my_tasks_page(callback: CallbackQuery, db: AsyncSession):
+    cursor = callback.data.split("|")[1] or None
+    await handle_my_tasks(event=callback, db=db, cursor=cursor)
 
 # ===== Short Edit Commands Handler (Time, Attach, Des and Name commands) =====
+async def short_edit_tasks_page(db: AsyncSession, message: Message, cursor: str = None):
+    """
+    Get one page of the tasks of the message's topic, or of its group outside topics.
+    Returns None if the topic or group is not registered.
+    """
+    group_id = await TaskService.resolve_group_id(db=db, tID=str(message.chat.id))
+    if not group_id:
+        return None
+
+    if message.is_topic_message:
+        topic_id = await TaskService.resolve_topic_id(db=db, group_id=group_id, tID=str(message.message_thread_id))
+        if not topic_id:
+            return None
+        return await TaskService.get_tasks_page(db=db, topic_id=topic_id, cursor=cursor)
+
+    return await TaskService.get_tasks_page(db=db, group_id=group_id, cursor=cursor)
+
+
+def short_edit_keyboard(tasks, callback_text: str) -> InlineKeyboardMarkup:
+    """Keyboard for selecting a task from one page of tasks, with previous/next buttons"""
+    keyboard = []
+    for t in tasks.items:
+        keyboard.append([
+            InlineKeyboardButton(text=t.title, callback_data=f"{callback_text}|{t.id}")
+        ])
+    navigation = page_buttons(tasks, "short_edit_page")
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
 @router.message(Command("name"))
 @router.message(Command("des"))
 @router.message(Command("attach"))
 @router.message(Command("time"))
-async def handle_short_edits(message: Message):
-    db = None
+async def handle_short_edits(message: Message, db: AsyncSession):
     try:
-        db = next(get_db())
-
         # Define command patterns with regex
         patterns = {
             # /name <any non-empty text>
@@ -1549,24 +1654,12 @@ async def handle_short_edits(message: Message):
                     await del_message(3, em, message)
                     return
 
-                reply_msg = message.reply_to_message
-                file_ids = []
-
-                # Collect file_ids from all possible media types in the replied message
-                if reply_msg.photo:
-                    file_ids.append(reply_msg.photo[-1].file_id)
-                if reply_msg.video:
-                    file_ids.append(reply_msg.video.file_id)
-                if reply_msg.audio:
-                    file_ids.append(reply_msg.audio.file_id)
-                if reply_msg.voice:
-                    file_ids.append(reply_msg.voice.file_id)
-                if reply_msg.document:
-                    file_ids.append(reply_msg.document.file_id)
+                # Collect all possible media types in the replied message
+                media = get_message_media(message.reply_to_message) or []
 
                 # Generate a unique key for storing these files in memory
                 media_key = str(uuid.uuid4()) 
-                media_cache[media_key] = file_ids
+                media_cache[media_key] = media
 
                 # Set callback text for the attach operation
                 callback_text = f"short_edit|attach|{media_key}"
@@ -1579,41 +1672,28 @@ async def handle_short_edits(message: Message):
 
         tasks = None
 
-        # Fetch tasks depending on chat type and topic
+        # Fetch the first page of tasks depending on chat type and topic
         if message.chat.type in ("group", "supergroup"):
-            if message.is_topic_message:
-                topic = TaskService.get_topic(db=db, tID=str(message.message_thread_id))
-                if not topic:
+            tasks = await short_edit_tasks_page(db=db, message=message)
+            if not tasks:
+                if message.is_topic_message:
                     em = await message.answer("هیچ تسکی برای این تاپیک وجود ندارد")
-                    await del_message(3, message, em)
-                    return
-                tasks = TaskService.get_all_tasks(db=db, topic_id=topic.id)
-            else:
-                group = TaskService.get_group(db=db, tID=str(message.chat.id))
-                if not group:
+                else:
                     em = await message.answer("هیچ تسکی برای این گروه وجود ندارد")
-                    await del_message(3, message, em)
-                    return
-                tasks = TaskService.get_all_tasks(db=db, group_id=group.id)
+                await del_message(3, message, em)
+                return
         else:
             return
 
         # If no tasks found, notify user
-        if not tasks:
+        if not tasks.items:
             em = await message.answer("❌ هیچ تسکی پیدا نشد")
             await del_message(3, em, message)
             return
-        
-        # Prepare inline keyboard for selecting task
-        keyboard = []
-        for t in tasks:
-            keyboard.append([
-                InlineKeyboardButton(text=t.title, callback_data=f"{callback_text}|{t.id}")
-            ])
 
         await message.answer(
             "تسک مورد نظر را برای اعمال این عملیات انتحاب کنید",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+            reply_markup=short_edit_keyboard(tasks, callback_text)
         )
         await message.delete()
     
@@ -1623,19 +1703,51 @@ async def handle_short_edits(message: Message):
             await message.answer("❌ خطا در انجام عملیات")
         except Exception:
             logger.exception("Failed to send error message")
-    
-    finally:
-        # Ensure DB session is closed
-        if db:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close DB session")
+
+
+# ===== Callback Handler for Short Edit pages =====
+@router.callback_query(F.data.startswith("short_edit_page|"))
+async def short_edit_page(callback_query: CallbackQuery, db: AsyncSession):
+    """
+    Show another page of tasks for a short edit.
+    The edit itself is recovered from the task buttons of the current page,
+    since their callback data is "<callback_text>|<task_id>".
+    """
+    try:
+        cursor = callback_query.data.split("|")[1]
+
+        callback_text = None
+        for row in callback_query.message.reply_markup.inline_keyboard:
+            for button in row:
+                if button.callback_data and button.callback_data.startswith("short_edit|"):
+                    callback_text = button.callback_data.rsplit("|", 1)[0]
+                    break
+            if callback_text:
+                break
+
+        if not callback_text:
+            await callback_query.answer("❌ این عملیات دیگر معتبر نیست")
+            return
+
+        tasks = await short_edit_tasks_page(db=db, message=callback_query.message, cursor=cursor)
+        if not tasks or not tasks.items:
+            await callback_query.answer("❌ هیچ تسکی پیدا نشد")
+            return
+
+        await callback_query.message.edit_reply_markup(reply_markup=short_edit_keyboard(tasks, callback_text))
+        await callback_query.answer()
+
+    except Exception:
+        logger.exception("Unexpected error occurred")
+        try:
+            await callback_query.answer("❌ خطا در انجام عملیات")
+        except Exception:
+            logger.exception("Failed to send error message")
 
 
 # ===== Callback Handler for Short Edit =====
 @router.callback_query(F.data.startswith("short_edit|"))
-async def short_edit_confirm(callback_query: CallbackQuery):
+async def short_edit_confirm(callback_query: CallbackQuery, db: AsyncSession):
     """
     Handles the callback when a user selects a task to apply a short edit.
     Triggered by inline buttons from handle_short_edits.
@@ -1644,10 +1756,7 @@ async def short_edit_confirm(callback_query: CallbackQuery):
     - <value>: new value or list of file IDs for attachments
     - <task_id>: the task to apply the change to
     """
-    db = None
     try:
-        db = next(get_db())
-
         # Split the callback data to extract edit type, value, and task ID
         data_parts = callback_query.data.split("|")
 
@@ -1662,12 +1771,12 @@ async def short_edit_confirm(callback_query: CallbackQuery):
 
         # Handle changing the task's name
         if edit_type == "name":
-            result = TaskService.edit_task(db=db, task_id=task_id, name=edit_value)
+            result = await TaskService.edit_task(db=db, task_id=task_id, name=edit_value)
             success_message = f"✅ نام تسک تغییر کرد به: {edit_value}"
 
         # Handle changing the task's description
         elif edit_type == "des":
-            result = TaskService.edit_task(db=db, task_id=task_id, description=edit_value)
+            result = await TaskService.edit_task(db=db, task_id=task_id, description=edit_value)
             success_message = "✅ توضیحات تغییر کرد"
 
         # Handle changing the task's end date
@@ -1677,23 +1786,29 @@ async def short_edit_confirm(callback_query: CallbackQuery):
             except ValueError:
                 await callback_query.answer("❌ Invalid date format. Expected YYYY-MM-DD")
                 return
-            result = TaskService.edit_task(db=db, task_id=task_id, end_date=end_date)
+            result = await TaskService.edit_task(db=db, task_id=task_id, end_date=end_date)
             success_message = f"✅ تاریخ تسک تغییر کرد به : {edit_value}"
 
         # Handle attaching files to the task
         elif edit_type == "attach":
             result = True
             media_key = edit_value
-            file_ids = media_cache.get(media_key, [])
+            media = media_cache.get(media_key, [])
             added_count = 0
 
-            # Add each file ID to the task using TaskAttachmentService
-            for file_id in file_ids:
-                try:
-                    TaskAttachmentService.add_attachment(db=db, task_id=task_id, attachment_id=file_id)
+            # Add each file to the task using TaskAttachmentService
+            for file_id, file_unique_id, media_type in media:
+                res = await TaskAttachmentService.add_attachment(
+                    db=db,
+                    task_id=task_id,
+                    file_id=file_id,
+                    file_unique_id=file_unique_id,
+                    media_type=media_type
+                )
+                if res == True:
                     added_count += 1
-                except Exception:
-                    logger.exception(f"Failed to attach file {file_id} to task {task_id}")
+                elif not res:
+                    logger.error(f"Failed to attach file {file_id} to task {task_id}")
 
             # Notify user if no files were added
             if added_count == 0:
@@ -1702,7 +1817,7 @@ async def short_edit_confirm(callback_query: CallbackQuery):
 
             # Inform user about successful attachments and remove cache
             success_message = f"✅ تعداد {added_count} فایل به تسک اضافه شد"
-            file_ids = media_cache.__delitem__(media_key)
+            media_cache.pop(media_key, None)
 
             view_keyboard = InlineKeyboardMarkup(
                 inline_keyboard=[
@@ -1743,14 +1858,6 @@ async def short_edit_confirm(callback_query: CallbackQuery):
             await callback_query.answer("❌ خطا در انجام عملیات", show_alert=True)
         except Exception:
             logger.exception("Failed to send error message")
-    
-    finally:
-        # Ensure the DB session is closed
-        if db:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close DB session")
 
 
 # ===== Callback Handler for Ending Short Edit =====
@@ -0,0 +1,114 @@
+from .. import main_router as router
+from .. import del_message, page_buttons
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram import F
+from sqlalchemy.ext.asyncio import AsyncSession
+from logger import logger
+from services.task_services import TaskService
+from services.user_services import UserService
+from services.errors import ServiceError
+
+
+async def search_results(db: AsyncSession, chat, user_tID: str, query: str, cursor: str = None):
+    """
+    Run a task search for a user in a chat.
+    In groups the search covers the group's tasks, in private chats the user's own and assigned tasks.
+    Returns (text, keyboard), or (error text, None).
+    """
+    user = await UserService.get_identity(db=db, user_tID=user_tID)
+    if not user:
+        return "❌ حساب کاربری شما پیدا نشد !", None
+
+    if chat.type in ("group", "supergroup"):
+        group_id = await TaskService.resolve_group_id(db=db, tID=str(chat.id))
+        if not group_id:
+            return "❌ این گروه ثبت نشده است", None
+        page = await TaskService.search_tasks(db=db, query=query, group_id=group_id, cursor=cursor)
+    else:
+        page = await TaskService.search_tasks(db=db, query=query, user_id=user.id, cursor=cursor)
+
+    if isinstance(page, ServiceError):
+        return "❌ خطایی در جستجو رخ داد. لطفاً دوباره تلاش کنید.", None
+    if not page.items:
+        return f"🔎 هیچ تسکی برای «{query}» پیدا نشد", None
+
+    # Admins open the management view, other users the read-only view
+    view = "view_task" if user.is_admin else "show_task"
+    keyboard = [
+        [InlineKeyboardButton(text=task.title, callback_data=f"{view}|{task.id}")]
+        for task in page.items
+    ]
+    navigation = page_buttons(page, "search_page")
+    if navigation:
+        keyboard.append(navigation)
+
+    return f"🔎 نتایج جستجو برای «{query}»:", InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+# ===== Handler for /search =====
+@router.message(Command("search"))
+async def handle_search(message: Message, state: FSMContext, db: AsyncSession):
+    """Search tasks by title and description: /search <text>"""
+    try:
+        parts = message.text.split(maxsplit=1)
+        query = parts[1].strip() if len(parts) > 1 else ""
+        if not query:
+            response = await message.answer(
+                "❌ متن جستجو را بعد از دستور بنویسید\n"
+                "مثال: /search گزارش"
+            )
+            await del_message(3, response, message)
+            return
+
+        text, keyboard = await search_results(db=db, chat=message.chat, user_tID=str(message.from_user.id), query=query)
+        if keyboard is None:
+            response = await message.answer(text)
+            await del_message(3, response, message)
+            return
+
+        # The query is kept in state since it may not fit in callback data
+        await state.update_data(search_query=query)
+        await message.answer(text, reply_markup=keyboard)
+
+    except Exception:
+        logger.exception("Unexpected error occurred")
+        try:
+            await message.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
+        except Exception:
+            logger.exception("Failed to send error message")
+
+
+@router.callback_query(F.data.startswith("search_page|"))
+async def handle_search_page(callback_query: CallbackQuery, state: FSMContext, db: AsyncSession):
+    """Show another page of the last search"""
+    try:
+        cursor = callback_query.data.split("|")[1]
+
+        data = await state.get_data()
+        query = data.get("search_query")
+        if not query:
+            await callback_query.answer("❌ این جستجو دیگر معتبر نیست")
+            return
+
+        text, keyboard = await search_results(
+            db=db,
+            chat=callback_query.message.chat,
+            user_tID=str(callback_query.from_user.id),
+            query=query,
+            cursor=cursor,
+        )
+        if keyboard is None:
+            await callback_query.answer(text)
+            return
+
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+        await callback_query.answer()
+
+    except Exception:
+        logger.exception("Unexpected error occurred")
+        try:
+            await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
+        except Exception:
+            logger.exception("Failed to send error message")
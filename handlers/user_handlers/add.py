@@ -1,32 +1,52 @@
 from .. import main_router as router
-from .. import del_message, admin_require
+from .. import del_message, admin_require, page_buttons
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from aiogram.filters import Command
 from aiogram import F
 from aiogram.exceptions import TelegramBadRequest
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from .delete import del_user_directly
 from logger import logger
 from services.user_services import UserService
+from services.errors import ServiceError
 from config import config
 import re
 
-async def view_users(db, message: Message = None, original_message_id: int = None, callback_query: CallbackQuery = None, user_tID = None):
+def current_page_cursor(callback_query: CallbackQuery) -> str | None:
     """
-    Display all users with interactive action buttons.
+    Get the page cursor of the user list a callback came from.
+    It is kept as the last part of the refresh button's callback data.
+    """
+    if not callback_query.message.reply_markup:
+        return None
+    for row in callback_query.message.reply_markup.inline_keyboard:
+        for button in row:
+            if button.text == "رفرش 🔄" and button.callback_data:
+                parts = button.callback_data.split("|")
+                return parts[3] if len(parts) > 3 else None
+    return None
+
+async def view_users(db, message: Message = None, original_message_id: int = None, callback_query: CallbackQuery = None, user_tID = None, cursor: str = None):
+    """
+    Display one page of users with interactive action buttons.
     Shows promote/demote, delete, and info buttons for each user.
     """
     
-    # Get users generator (excludes current user)
+    # Get one page of the users list (excludes current user)
     user_tID = message.from_user.id if message else user_tID
-    users_generator = UserService.get_all_users(db=db, user_tID=user_tID)
+    page = await UserService.get_users_page(db=db, user_tID=user_tID, cursor=cursor)
+    if page and not page.items and cursor:
+        # Every user of this page was deleted, go back to the first page
+        cursor = None
+        page = await UserService.get_users_page(db=db, user_tID=user_tID)
+    users = page.items if page else []
     
     # Initialize empty keyboard
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
     user_count = 0
     
-    # Process each user in the generator
-    for user in users_generator:
+    # Process each user in the list
+    for user in users:
         user_count += 1
         
         # Create appropriate button based on admin status
@@ -46,18 +66,31 @@ async def view_users(db, message: Message = None, original_message_id: int = Non
     
     # Check if no users were found
     if user_count == 0:
+        if callback_query is not None:
+            await callback_query.answer("❌ هیچ کاربری پیدا نشد")
+            return
         response = await message.answer("❌ هیچ کاربری پیدا نشد")
         await del_message(3, response, message)
         return
     
+    # Count all users, not just this page
+    total_users = await UserService.count_users(db=db, user_tID=user_tID)
+
+    # Add previous/next page buttons, handled like a refresh of that page
+    navigation = page_buttons(page, f"refresh_operation|{original_message_id}|{user_tID}")
+    if navigation:
+        keyboard.inline_keyboard.append(navigation)
+
     # Add finish operation button at the bottom
     finish_callback = f"finish_operation|{original_message_id}" if original_message_id else "finish_operation"
     keyboard.inline_keyboard.append([
         InlineKeyboardButton(text="اتمام عملیات ✅", callback_data=finish_callback),
     ])
 
-    # Add refresh operation button at the bottom
+    # Add refresh operation button at the bottom, it keeps the current page
     refresh_callback = f"refresh_operation|{original_message_id}|{user_tID}"
+    if cursor:
+        refresh_callback += f"|{cursor}"
     keyboard.inline_keyboard.append([
         InlineKeyboardButton(text="رفرش 🔄", callback_data=refresh_callback),
     ])
@@ -65,13 +98,13 @@ async def view_users(db, message: Message = None, original_message_id: int = Non
     # Send the message with user list
     if callback_query is None:
         await message.answer(
-            f"👥 مدیریت کاربران (تعداد: {user_count})",
+            f"👥 مدیریت کاربران (تعداد: {total_users})",
             reply_markup=keyboard
         )
     else:
         try:
             await callback_query.message.edit_text(
-                f"👥 مدیریت کاربران (تعداد: {user_count})",
+                f"👥 مدیریت کاربران (تعداد: {total_users})",
                 reply_markup=keyboard
             )
             await callback_query.answer()
@@ -96,14 +129,14 @@ async def add_user_with_reply(db, message: Message):
             return
         
         # Check if user already exists
-        user_exist = UserService.get_user(db=db, username=original_text)
-        if user_exist is not None:
+        user_exist = await UserService.get_user(db=db, username=original_text)
+        if user_exist:
             response = await message.answer("❌ این کاربر از قبل وجود دارد")
             await del_message(3, response, message)
             return
 
         # Try to add user to database
-        add_res = UserService.get_or_create_user(db=db, username=original_text)
+        add_res = await UserService.get_or_create_user(db=db, username=original_text)
         if not add_res:
             response = await message.answer("❌ مشکلی در افزودن کاربر به وجود آمد. لطفاً دوباره تلاش کنید")    
         else:
@@ -123,14 +156,14 @@ async def add_user_directly(db, message: Message, username: str):
     """Add a user directly from /user command with username"""    
     
     # Check if user already exists
-    user_exist = UserService.get_user(db=db, username=username)
-    if user_exist is not None:
+    user_exist = await UserService.get_user(db=db, username=username)
+    if user_exist:
         response = await message.answer("❌ این کاربر از قبل وجود دارد")
         await del_message(3, response, message)
         return
 
     # Try to add user
-    add_res = UserService.get_or_create_user(db=db, username=username)
+    add_res = await UserService.get_or_create_user(db=db, username=username)
     if not add_res:
         response = await message.answer("❌ مشکلی در افزودن کاربر به وجود آمد. لطفاً دوباره تلاش کنید")    
     else:
@@ -141,17 +174,15 @@ async def add_user_directly(db, message: Message, username: str):
     return
 
 @router.callback_query(F.data.startswith("del_user|"))
-async def handle_del_user(callback_query: CallbackQuery):
+async def handle_del_user(callback_query: CallbackQuery, db: AsyncSession):
     """Delete a user directly from /user command with username"""
-    db = None
     try:
-        db = next(get_db())
         user_ID = None 
         try:
             if callback_query is not None:
                 original_message_id = None
                 parts = callback_query.data.split("|")
-                user_ID = parts[1]
+                user_ID = int(parts[1])
                 user_tID = parts[2]
                 if len(parts) == 4:                    
                     original_message_id = parts[3]
@@ -162,9 +193,9 @@ async def handle_del_user(callback_query: CallbackQuery):
             return
 
         # Delete the user
-        del_user = UserService.del_user(db=db, user_ID=user_ID)
+        del_user = await UserService.del_user(db=db, user_ID=user_ID)
 
-        if del_user is None:
+        if isinstance(del_user, ServiceError):
             await callback_query.answer("❌ مشکلی در حذف کاربر به وجود آمد. لطفاً دوباره تلاش کنید")
         elif del_user == "NOT_EXIST":
             await callback_query.answer("❌ این کاربر وجود ندارد")
@@ -172,10 +203,11 @@ async def handle_del_user(callback_query: CallbackQuery):
             await callback_query.answer("✅ کاربر با موفقیت حذف شد.")
 
         # Refresh the user list after deletion
+        cursor = current_page_cursor(callback_query)
         if original_message_id:
-            await view_users(db=db, original_message_id=original_message_id, callback_query=callback_query, user_tID=user_tID)
+            await view_users(db=db, original_message_id=original_message_id, callback_query=callback_query, user_tID=user_tID, cursor=cursor)
         else:
-            await view_users(db=db, callback_query=callback_query, user_tID=user_tID)
+            await view_users(db=db, callback_query=callback_query, user_tID=user_tID, cursor=cursor)
     
     except Exception:
         # Log unexpected errors
@@ -184,27 +216,18 @@ async def handle_del_user(callback_query: CallbackQuery):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 @router.callback_query(F.data.startswith("refresh_operation|"))
-async def handle_refresh(callback_query: CallbackQuery):
+async def handle_refresh(callback_query: CallbackQuery, db: AsyncSession):
     """Handle refresh operation to update the user list"""
-    db = None
     try:
-        db = next(get_db())
         try:
             if callback_query is not None:
                 original_message_id = None
                 parts = callback_query.data.split("|")
                 user_tID = parts[2]
                 original_message_id = parts[1]                  
+                cursor = parts[3] if len(parts) > 3 else None
                     
         except Exception:
             user_ID = None
@@ -213,7 +236,7 @@ async def handle_refresh(callback_query: CallbackQuery):
             return
 
         # Refresh the user list view
-        await view_users(db=db, original_message_id=original_message_id, callback_query=callback_query, user_tID=user_tID)
+        await view_users(db=db, original_message_id=original_message_id, callback_query=callback_query, user_tID=user_tID, cursor=cursor)
     
     except Exception:
         # Log unexpected errors
@@ -222,14 +245,6 @@ async def handle_refresh(callback_query: CallbackQuery):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
 
 @router.callback_query(F.data.startswith("finish_operation"))
 async def finish_operation(callback_query: CallbackQuery):
@@ -265,22 +280,18 @@ async def finish_operation(callback_query: CallbackQuery):
             logger.exception("Failed to send error message")   
 
 @router.callback_query(F.data.startswith("toggle_user|"))
-async def handle_toggle_user(callback_query: CallbackQuery):
+async def handle_toggle_user(callback_query: CallbackQuery, db: AsyncSession):
     """
     Handle user role toggle (admin/normal user)
     Extracts user_tID from callback data and toggles their role
     """
-    db = None
     try:
-        # Get database session
-        db = next(get_db())
-
         # Extract user_tID from callback data
         try:
             if callback_query is not None:
                 original_message_id = None
                 parts = callback_query.data.split("|")
-                user_ID = parts[1]
+                user_ID = int(parts[1])
                 user_tID = parts[2]
                 if len(parts) == 4:                    
                     original_message_id = parts[3]
@@ -292,17 +303,18 @@ async def handle_toggle_user(callback_query: CallbackQuery):
             return
 
         # Toggle user role using service
-        res = UserService.toggle_user(db=db, user_ID=user_ID)
+        res = await UserService.toggle_user(db=db, user_ID=user_ID)
         if not res:
             await callback_query.answer("❌ مشکلی در تغییر رول این کاربر به وجود آمد")
             return
 
         # Send success confirmation and refresh the view
         await callback_query.answer("✅ رول کاربر با موفقیت تغییر کرد")
+        cursor = current_page_cursor(callback_query)
         if original_message_id:
-            await view_users(db=db, original_message_id=original_message_id, callback_query=callback_query, user_tID=user_tID)
+            await view_users(db=db, original_message_id=original_message_id, callback_query=callback_query, user_tID=user_tID, cursor=cursor)
         else:
-            await view_users(db=db, callback_query=callback_query, user_tID=user_tID)
+            await view_users(db=db, callback_query=callback_query, user_tID=user_tID, cursor=cursor)
     
     except Exception:
         # Log unexpected errors
@@ -311,23 +323,12 @@ async def handle_toggle_user(callback_query: CallbackQuery):
             await callback_query.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Ensure database connection is always closed
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close database connection")
 
 # ===== Handler for create new user =====
 @router.message(Command("user"))
-async def add_user(message: Message):
+async def add_user(message: Message, db: AsyncSession):
     """Main handler for adding a user with /user command"""
-    db = None
     try:
-        db = next(get_db())  # Open a database session
-
         # Check admin permission before proceeding
         permission = await admin_require(db=db, message=message)
         if not permission:
@@ -363,11 +364,4 @@ async def add_user(message: Message):
             await message.answer("❌خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception:
             logger.exception("Failed to send error message")   
-    
-    finally:
-        # Always close the database connection
-        if db is not None:
-            try:
-                db.close()
-            except Exception:
-                logger.exception("Failed to close db")
\ No newline at end of file
+    
\ No newline at end of file
@@ -1,5 +1,6 @@
 from aiogram.types import Message
 from services.user_services import UserService
+from services.errors import ServiceError
 from .. import del_message
 from aiogram import F
 from logger import logger
@@ -9,9 +10,9 @@ async def del_user_directly(db, message: Message = None, username: str = None):
     try:
 
         # Delete the user
-        del_user = UserService.del_user(db=db, username=username)
+        del_user = await UserService.del_user(db=db, username=username)
 
-        if del_user is None:
+        if isinstance(del_user, ServiceError):
             response = await message.answer("❌ مشکلی در حذف کاربر به وجود آمد. لطفاً دوباره تلاش کنید")
         elif del_user == "NOT_EXIST":
             response = await message.answer("❌ این کاربر وجود ندارد")
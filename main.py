@@ -1,3 +1,4 @@
+import asyncio
 from logger import logger
 from aiogram import Bot, Dispatcher
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
@@ -7,9 +8,13 @@ from handlers import main_router
 from aiogram.client.default import DefaultBotProperties
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.types import BotCommand
-from models import init_db
-
-init_db()
+from migrations import pending as pending_migrations
+from database import AsyncSessionLocal, async_engine, async_replica_engine, db_executor, engine, pool_status
+from handlers.funcs import executor_exception_decorator, failure_counts
+from services.cache import chat_admin_cache, chat_map, task_card_cache, user_identity_cache
+from services.task_services import TaskService
+from services.archive import archive_tasks
+from services.dialect import supports_upserts
 
 # Just when we need proxy
 if config.PROXY_URL:
@@ -38,7 +43,8 @@ async def set_commands(bot: Bot):
             BotCommand(command="/name", description='تغییر نام تسک. مثال: " نام_جدید name/ "'),
             BotCommand(command="/des", description='ویرایش توضیحات تسک. مثال: " توضیحات_جدید des/ "'),
             BotCommand(command="/attach", description='افزودن فایل یا تصویر به تسک. کافی است روی فایل یا تصویر ریپلای کرده و بنویسید "attach/"'),
-            BotCommand(command="/time", description='تعیین یا تغییر زمان تسک. مثال: " 2025-10-08 time/ "')
+            BotCommand(command="/time", description='تعیین یا تغییر زمان تسک. مثال: " 2025-10-08 time/ "'),
+            BotCommand(command="/search", description='جستجو در تسک‌ها. مثال: " گزارش search/ "')
         ]
 
         await bot.set_my_commands(commands)
@@ -50,14 +56,75 @@ dp = Dispatcher()
 # Add router
 dp.include_router(main_router)
 
+async def archive_loop():
+    """Move finished and old tasks to the archive tables every ARCHIVE_INTERVAL_HOURS"""
+    while True:
+        if await executor_exception_decorator(archive_tasks)():
+            # Archived tasks left the live tables, their cached cards point at nothing
+            task_card_cache.clear()
+        await asyncio.sleep(config.ARCHIVE_INTERVAL_HOURS * 3600)
+
+archive_job: asyncio.Task | None = None
+
 async def on_startup(bot: Bot):
-    #await bot.set_webhook(config.WEBHOOK_URL)
+    global archive_job
+    if not supports_upserts(async_engine.dialect.name):
+        raise RuntimeError(f"Unsupported database {async_engine.dialect.name}, DATABASE_URL must be Postgres or SQLite")
+    # The webhook is registered outside the bot, see "Webhook" in README.md. It must list
+    # chat_member in allowed_updates, they keep the chat admin cache and group_members current
+    #await bot.set_webhook(config.WEBHOOK_URL, allowed_updates=dp.resolve_used_update_types())
+    # Migrations run separately, only warn when the schema is behind
+    waiting = await executor_exception_decorator(pending_migrations)()
+    if waiting:
+        logger.warning(f"{len(waiting)} pending migration(s), run `python -m migrations upgrade`")
+    else:
+        # Group commands resolve their group and topic from the map instead of the database
+        async with AsyncSessionLocal() as db:
+            await TaskService.load_chat_map(db=db)
+        if config.ARCHIVE_INTERVAL_HOURS > 0:
+            archive_job = asyncio.create_task(archive_loop())
     logger.info("Bot started!")
 
 async def on_shutdown(bot: Bot):
     #await bot.delete_webhook()
+    if archive_job is not None:
+        archive_job.cancel()
+    await async_engine.dispose()
+    if async_replica_engine is not None:
+        await async_replica_engine.dispose()
+    db_executor.shutdown(wait=False)
     logger.info("Bot stopped!")
 
+def check_metrics_token(request: web.Request) -> None:
+    """The internal routes share the public webhook server, they are closed until METRICS_TOKEN is set"""
+    if not config.METRICS_TOKEN:
+        raise web.HTTPForbidden()
+    if request.headers.get("Authorization") != f"Bearer {config.METRICS_TOKEN}":
+        raise web.HTTPUnauthorized()
+
+async def db_metrics(request: web.Request) -> web.Response:
+    """Pool usage of each engine, cache hit rates and failed service calls, as JSON"""
+    check_metrics_token(request)
+    pools = {"primary": pool_status(async_engine), "sync": pool_status(engine)}
+    if async_replica_engine is not None:
+        pools["replica"] = pool_status(async_replica_engine)
+    caches = {
+        "user_identity": user_identity_cache.stats(),
+        "chat_admins": chat_admin_cache.stats(),
+        "chat_map": chat_map.stats(),
+        "task_cards": task_card_cache.stats(),
+    }
+    return web.json_response({"pools": pools, "caches": caches, "service_failures": dict(failure_counts)})
+
+async def rebuild_chat_map(request: web.Request) -> web.Response:
+    """Reload the group and topic map, after groups or topics were changed outside the bot"""
+    check_metrics_token(request)
+    async with AsyncSessionLocal() as db:
+        version = await TaskService.load_chat_map(db=db)
+    if not version:
+        raise web.HTTPServiceUnavailable()
+    return web.json_response(chat_map.stats())
+
 def main():
     dp.startup.register(set_commands)
     dp.startup.register(on_startup)
@@ -70,6 +137,8 @@ def main():
     )
     
     webhook_requests_handler.register(app, path="/webhook")
+    app.router.add_get("/metrics/db", db_metrics)
+    app.router.add_post("/chat-map/rebuild", rebuild_chat_map)
     setup_application(app, dp, bot=bot)
     
     web.run_app(app, host=config.WEBAPP_HOST, port=config.WEBAPP_PORT)
@@ -0,0 +1,153 @@
+"""
+Versioned schema migrations.
+
+Migration scripts live in `migrations/versions` and are named `<version>_<name>.py`,
+for example `0001_initial.py`. Each script defines `upgrade(conn)`, which receives
+a SQLAlchemy connection inside a transaction. Applied versions are recorded in the
+`schema_migrations` table, so every script runs exactly once per database.
+
+Run pending migrations with:
+    python -m migrations upgrade
+"""
+from __future__ import annotations
+import importlib
+import pkgutil
+from datetime import datetime
+from typing import List, NamedTuple, Set
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from logger import logger
+
+VERSIONS_PACKAGE = f"{__name__}.versions"
+
+# Arbitrary key of the Postgres advisory lock held while migrating
+ADVISORY_LOCK_ID = 7_340_211
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False, default=datetime.now),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    module: str
+
+
+def discover() -> List[Migration]:
+    """
+    Find all migration scripts, ordered by version.
+    """
+    from . import versions
+
+    migrations = []
+    for module_info in pkgutil.iter_modules(versions.__path__):
+        version, _, name = module_info.name.partition("_")
+        if not version.isdigit():
+            continue
+        migrations.append(Migration(int(version), name, f"{VERSIONS_PACKAGE}.{module_info.name}"))
+
+    migrations.sort(key=lambda m: m.version)
+    for previous, current in zip(migrations, migrations[1:]):
+        if previous.version == current.version:
+            raise RuntimeError(f"Duplicate migration version {current.version}")
+    return migrations
+
+
+def applied_versions(conn: Connection) -> Set[int]:
+    """
+    Return the versions already applied to the database.
+    """
+    if not has_table(conn, schema_migrations.name):
+        return set()
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending(engine: Engine = None) -> List[Migration]:
+    """
+    Return the migrations not applied to the database yet.
+    """
+    engine = engine or _default_engine()
+    with engine.connect() as conn:
+        applied = applied_versions(conn)
+    return [m for m in discover() if m.version not in applied]
+
+
+def upgrade(engine: Engine = None, target: int = None) -> List[Migration]:
+    """
+    Apply pending migrations in version order, up to and including `target`.
+    Each migration runs in its own transaction together with its version record.
+    Returns the applied migrations.
+    """
+    engine = engine or _default_engine()
+    applied = []
+
+    with engine.connect() as lock_conn:
+        _acquire_lock(lock_conn)
+        try:
+            schema_migrations.create(lock_conn, checkfirst=True)
+            lock_conn.commit()
+            done = applied_versions(lock_conn)
+            lock_conn.commit()
+
+            for migration in discover():
+                if migration.version in done:
+                    continue
+                if target is not None and migration.version > target:
+                    break
+
+                logger.info(f"Applying migration {migration.version:04d}_{migration.name} ...")
+                module = importlib.import_module(migration.module)
+                with engine.begin() as conn:
+                    module.upgrade(conn)
+                    conn.execute(
+                        schema_migrations.insert().values(
+                            version=migration.version,
+                            name=migration.name,
+                            applied_at=datetime.now(),
+                        )
+                    )
+                applied.append(migration)
+        finally:
+            _release_lock(lock_conn)
+
+    if applied:
+        logger.info(f"Applied {len(applied)} migration(s)")
+    else:
+        logger.info("Database schema is up to date")
+    return applied
+
+
+# ===== Helpers for migration scripts =====
+def has_table(conn: Connection, table: str) -> bool:
+    return inspect(conn).has_table(table)
+
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def has_index(conn: Connection, table: str, index: str) -> bool:
+    return any(i["name"] == index for i in inspect(conn).get_indexes(table))
+
+
+def _default_engine() -> Engine:
+    from database import engine
+    return engine
+
+
+def _acquire_lock(conn: Connection) -> None:
+    """Stop two processes from migrating the same Postgres database at once"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        conn.commit()
+
+
+def _release_lock(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": ADVISORY_LOCK_ID})
+        conn.commit()
@@ -0,0 +1,37 @@
+"""
+Command line interface for the schema migrations.
+
+    python -m migrations upgrade [--to VERSION]
+    python -m migrations status
+"""
+import argparse
+from . import discover, pending, upgrade
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m migrations", description="Manage the database schema")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    upgrade_parser = commands.add_parser("upgrade", help="apply pending migrations")
+    upgrade_parser.add_argument("--to", type=int, default=None, metavar="VERSION", help="stop after this version")
+
+    commands.add_parser("status", help="show applied and pending migrations")
+
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        applied = upgrade(target=args.to)
+        for migration in applied:
+            print(f"applied  {migration.version:04d}_{migration.name}")
+        if not applied:
+            print("Database schema is up to date")
+
+    elif args.command == "status":
+        waiting = {m.version for m in pending()}
+        for migration in discover():
+            state = "pending" if migration.version in waiting else "applied"
+            print(f"{state:<8} {migration.version:04d}_{migration.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Initial schema: groups, topics, users, tasks, users_tasks and task_attachments.
+
+The tables are defined here as they were before migrations existed, so later
+model changes do not alter this script. Existing tables are left untouched,
+which adopts databases created by the old init_db().
+"""
+from datetime import datetime
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, MetaData, PickleType, String, Table, Text
+from sqlalchemy.engine import Connection
+
+metadata = MetaData()
+
+Table(
+    "groups", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("telegram_id", String(255), unique=True, nullable=False),
+    Column("name", String(255), nullable=True),
+)
+
+Table(
+    "topics", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("telegram_id", String(255), nullable=False),
+    Column("link", String(255), nullable=True),
+    Column("name", String(255), nullable=True),
+    Column("group_id", Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False),
+)
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("telegram_id", String(255), nullable=True),
+    Column("username", String(255), nullable=False),
+    Column("is_admin", Boolean, nullable=True, default=False),
+)
+
+Table(
+    "tasks", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("group_id", Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=True),
+    Column("topic_id", Integer, ForeignKey("topics.id", ondelete="CASCADE"), nullable=True),
+    Column("admin_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("title", String(255), nullable=False),
+    Column("description", Text, nullable=True),
+    Column("start_date", DateTime, nullable=True, default=datetime.now),
+    Column("end_date", DateTime, nullable=True),
+    Column("status", String(50), default="pending", nullable=False),
+)
+
+Table(
+    "users_tasks", metadata,
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    Column("task_id", Integer, ForeignKey("tasks.id", ondelete="CASCADE"), primary_key=True),
+)
+
+Table(
+    "task_attachments", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("task_id", Integer, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False),
+    Column("attachment_ids", PickleType),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    metadata.create_all(conn, checkfirst=True)
@@ -0,0 +1,30 @@
+"""
+Secondary indexes for the columns filtered on by the service layer.
+
+groups.telegram_id is not listed, its unique constraint is already an index.
+tasks.group_id is served by the leading column of ix_tasks_group_id_topic_id.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from migrations import has_index
+
+INDEXES = [
+    ("ix_users_telegram_id", "users", ["telegram_id"]),
+    ("ix_users_username", "users", ["username"]),
+    ("ix_topics_telegram_id", "topics", ["telegram_id"]),
+    ("ix_topics_group_id", "topics", ["group_id"]),
+    ("ix_tasks_group_id_topic_id", "tasks", ["group_id", "topic_id"]),
+    ("ix_tasks_topic_id", "tasks", ["topic_id"]),
+    ("ix_tasks_admin_id", "tasks", ["admin_id"]),
+    ("ix_tasks_end_date", "tasks", ["end_date"]),
+    ("ix_tasks_status", "tasks", ["status"]),
+    ("ix_users_tasks_task_id", "users_tasks", ["task_id"]),
+    ("ix_task_attachments_task_id", "task_attachments", ["task_id"]),
+]
+
+
+def upgrade(conn: Connection) -> None:
+    for name, table, columns in INDEXES:
+        if has_index(conn, table, name):
+            continue
+        conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
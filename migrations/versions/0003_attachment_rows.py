@@ -0,0 +1,66 @@
+"""
+Store one task_attachments row per file instead of a pickled list per task.
+
+Existing lists are unpickled and copied row by row. Telegram's file_unique_id
+was never stored, so legacy rows reuse the file_id for it, and their media type
+is guessed from the file_id prefix like the old handler did.
+"""
+import pickle
+from datetime import datetime
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table, UniqueConstraint, select, text
+from sqlalchemy.engine import Connection
+from migrations import has_column, has_index, has_table
+
+LEGACY_TABLE = "task_attachments_legacy"
+
+metadata = MetaData()
+
+# Only referenced by the foreign key below
+Table("tasks", metadata, Column("id", Integer, primary_key=True))
+
+task_attachments = Table(
+    "task_attachments", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("task_id", Integer, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False, index=True),
+    Column("file_id", String(255), nullable=False),
+    Column("file_unique_id", String(255), nullable=False),
+    Column("media_type", String(20), nullable=False),
+    Column("added_at", DateTime, nullable=False),
+    UniqueConstraint("task_id", "file_unique_id", name="uq_task_attachments_task_id_file_unique_id"),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    if has_table(conn, "task_attachments") and not has_column(conn, "task_attachments", "attachment_ids"):
+        return
+
+    # Index names are global, free them before the new table takes them
+    for index in ("ix_task_attachments_id", "ix_task_attachments_task_id"):
+        if has_index(conn, "task_attachments", index):
+            conn.execute(text(f"DROP INDEX {index}"))
+    conn.execute(text(f"ALTER TABLE task_attachments RENAME TO {LEGACY_TABLE}"))
+
+    task_attachments.create(conn)
+
+    legacy = conn.execute(text(f"SELECT task_id, attachment_ids FROM {LEGACY_TABLE} ORDER BY id"))
+    rows, seen = [], set()
+    now = datetime.now()
+    for task_id, blob in legacy:
+        if blob is None:
+            continue
+        for file_id in pickle.loads(bytes(blob)):
+            if (task_id, file_id) in seen:
+                continue
+            seen.add((task_id, file_id))
+            rows.append({
+                "task_id": task_id,
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "media_type": "photo" if file_id.startswith("AgAC") else "document",
+                "added_at": now,
+            })
+
+    if rows:
+        conn.execute(task_attachments.insert(), rows)
+
+    conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
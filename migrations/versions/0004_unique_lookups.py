@@ -0,0 +1,44 @@
+"""
+Unique indexes for the get-or-create lookups, so they can be done as upserts.
+
+users.telegram_id and users.username replace their plain indexes from 0002.
+topics get a unique (group_id, telegram_id), whose leading column also covers
+ix_topics_group_id. Duplicates already in the tables must be merged by hand
+first; the migration stops and lists them instead of picking a row to keep.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from migrations import has_index
+
+# (unique index, table, columns, plain index it replaces)
+UNIQUE_INDEXES = [
+    ("uq_users_telegram_id", "users", ["telegram_id"], "ix_users_telegram_id"),
+    ("uq_users_username", "users", ["username"], "ix_users_username"),
+    ("uq_topics_group_id_telegram_id", "topics", ["group_id", "telegram_id"], "ix_topics_group_id"),
+]
+
+
+def find_duplicates(conn: Connection, table: str, columns: list) -> list:
+    """Return the column values held by more than one row (NULLs never conflict)"""
+    columns_sql = ", ".join(columns)
+    not_null = " AND ".join(f"{c} IS NOT NULL" for c in columns)
+    return conn.execute(text(
+        f"SELECT {columns_sql} FROM {table} WHERE {not_null} "
+        f"GROUP BY {columns_sql} HAVING COUNT(*) > 1"
+    )).all()
+
+
+def upgrade(conn: Connection) -> None:
+    for name, table, columns, _ in UNIQUE_INDEXES:
+        duplicates = find_duplicates(conn, table, columns)
+        if duplicates:
+            values = ", ".join(str(tuple(d)) for d in duplicates[:10])
+            raise RuntimeError(
+                f"Cannot create {name}: {table} has duplicate {', '.join(columns)} values {values}"
+            )
+
+    for name, table, columns, replaced in UNIQUE_INDEXES:
+        if not has_index(conn, table, name):
+            conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table} ({', '.join(columns)})"))
+        if has_index(conn, table, replaced):
+            conn.execute(text(f"DROP INDEX {replaced}"))
@@ -0,0 +1,46 @@
+"""
+Full-text index over task titles and descriptions for TaskService.search_tasks.
+
+Postgres gets a GIN index on a 'simple' tsvector expression; 'simple' only
+lowercases, which suits the mixed Persian/English titles. The expression must
+stay identical to TASK_DOCUMENT in services/task_services.py, or the planner
+will not use the index.
+
+SQLite gets an external-content FTS5 table kept in sync by triggers.
+Other databases are left without a text index.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from migrations import has_index, has_table
+
+POSTGRES_INDEX = (
+    "CREATE INDEX ix_tasks_search ON tasks USING GIN "
+    "(to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '')))"
+)
+
+SQLITE_STATEMENTS = [
+    "CREATE VIRTUAL TABLE tasks_fts USING fts5("
+    "title, description, content='tasks', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+    "INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+    "END",
+    "CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "END",
+    "CREATE TRIGGER tasks_fts_update AFTER UPDATE ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+    "END",
+    # Index the tasks which already exist
+    "INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')",
+]
+
+
+def upgrade(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        if not has_index(conn, "tasks", "ix_tasks_search"):
+            conn.execute(text(POSTGRES_INDEX))
+    elif conn.dialect.name == "sqlite":
+        if not has_table(conn, "tasks_fts"):
+            for statement in SQLITE_STATEMENTS:
+                conn.execute(text(statement))
@@ -0,0 +1,47 @@
+"""
+Archive tables for tasks moved out of the hot tasks table by services/archive.py.
+
+tasks_archive keeps the original task ID in task_id but has its own primary key,
+since SQLite may hand the ID of a deleted task to a new one. Assignments and
+attachments are archived against that key. Group, topic and admin are kept as
+plain IDs without foreign keys, so archived tasks outlive the rows they refer to.
+"""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text
+from sqlalchemy.engine import Connection
+
+metadata = MetaData()
+
+Table(
+    "tasks_archive", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("task_id", Integer, nullable=False, index=True),
+    Column("group_id", Integer, nullable=True, index=True),
+    Column("topic_id", Integer, nullable=True),
+    Column("admin_id", Integer, nullable=True, index=True),
+    Column("title", String(255), nullable=False),
+    Column("description", Text, nullable=True),
+    Column("start_date", DateTime, nullable=True),
+    Column("end_date", DateTime, nullable=True),
+    Column("status", String(50), nullable=False),
+    Column("archived_at", DateTime, nullable=False),
+)
+
+Table(
+    "users_tasks_archive", metadata,
+    Column("archive_id", Integer, ForeignKey("tasks_archive.id", ondelete="CASCADE"), primary_key=True),
+    Column("user_id", Integer, primary_key=True, index=True),
+)
+
+Table(
+    "task_attachments_archive", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("archive_id", Integer, ForeignKey("tasks_archive.id", ondelete="CASCADE"), nullable=False, index=True),
+    Column("file_id", String(255), nullable=False),
+    Column("file_unique_id", String(255), nullable=False),
+    Column("media_type", String(20), nullable=False),
+    Column("added_at", DateTime, nullable=False),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    metadata.create_all(conn, checkfirst=True)
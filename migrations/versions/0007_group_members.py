@@ -0,0 +1,26 @@
+"""
+group_members: the status of each known member of a group, by Telegram user ID.
+
+Filled from chat_member and my_chat_member updates by handlers/member_handlers.py.
+Telegram has no API listing all members of a group, so the table starts empty and
+members show up as their status changes.
+"""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table
+from sqlalchemy.engine import Connection
+
+metadata = MetaData()
+
+# Referenced table, only so the foreign key can be created
+Table("groups", metadata, Column("id", Integer, primary_key=True))
+
+Table(
+    "group_members", metadata,
+    Column("group_id", Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True),
+    Column("telegram_user_id", String(255), primary_key=True, index=True),
+    Column("status", String(20), nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    metadata.tables["group_members"].create(conn, checkfirst=True)
@@ -1,7 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, PickleType, inspect
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base, engine
-from sqlalchemy.ext.mutable import MutableList
 from datetime import datetime
 from logger import logger
 
@@ -17,9 +16,13 @@ class Group(Base):
 
 class Topic(Base):
     __tablename__ = "topics"
+    __table_args__ = (
+        # Conflict target of get_or_create_topic, also serves lookups on group_id alone
+        Index("uq_topics_group_id_telegram_id", "group_id", "telegram_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    telegram_id = Column(String(255), nullable=False)
+    telegram_id = Column(String(255), nullable=False, index=True)
     link = Column(String(255), nullable=True)
     name = Column(String(255), nullable=True)
     group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
@@ -29,6 +32,11 @@ class Topic(Base):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Conflict targets of get_or_create_user
+        Index("uq_users_telegram_id", "telegram_id", unique=True),
+        Index("uq_users_username", "username", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(String(255), nullable=True)
@@ -40,16 +48,21 @@ class User(Base):
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        # Also serves lookups on group_id alone
+        Index("ix_tasks_group_id_topic_id", "group_id", "topic_id"),
+        # The full-text index is dialect specific and only created by migration 0005
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=True)
-    topic_id = Column(Integer, ForeignKey("topics.id", ondelete="CASCADE"), nullable=True)
-    admin_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    topic_id = Column(Integer, ForeignKey("topics.id", ondelete="CASCADE"), nullable=True, index=True)
+    admin_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
     title = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
     start_date = Column(DateTime, nullable=True, default=datetime.now)
-    end_date = Column(DateTime, nullable=True)
-    status = Column(String(50), default="pending", nullable=False)
+    end_date = Column(DateTime, nullable=True, index=True)
+    status = Column(String(50), default="pending", nullable=False, index=True)
     
     group = relationship("Group", back_populates="tasks")
     topic = relationship("Topic", back_populates="tasks")
@@ -62,37 +75,94 @@ class UserTask(Base):
     __tablename__ = "users_tasks"
     
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
-    task_id = Column(Integer, ForeignKey("tasks.id", ondelete="CASCADE"), primary_key=True)
+    # The primary key starts with user_id, so task_id needs its own index
+    task_id = Column(Integer, ForeignKey("tasks.id", ondelete="CASCADE"), primary_key=True, index=True)
     
     user = relationship("User", back_populates="tasks")
     task = relationship("Task", back_populates="assigned_users")
 
 
+class GroupMember(Base):
+    __tablename__ = "group_members"
+    
+    # Mirror of the members of each group, kept from chat_member updates, see member_handlers.py.
+    # Members are stored by Telegram ID, so they need no User row; rows are removed when they leave.
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    # The primary key starts with group_id, so lookups by user need their own index
+    telegram_user_id = Column(String(255), primary_key=True, index=True)
+    status = Column(String(20), nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.now)
+
+
 class TaskAttachment(Base):
     __tablename__ = "task_attachments"
+    __table_args__ = (
+        # The same file can be attached to a task only once
+        UniqueConstraint("task_id", "file_unique_id", name="uq_task_attachments_task_id_file_unique_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    task_id = Column(Integer, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False)
+    task_id = Column(Integer, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False, index=True)
     
-    attachment_ids = Column(MutableList.as_mutable(PickleType), default=[]) 
+    file_id = Column(String(255), nullable=False)
+    file_unique_id = Column(String(255), nullable=False)
+    media_type = Column(String(20), nullable=False, default="document")
+    added_at = Column(DateTime, nullable=False, default=datetime.now)
 
     # Relationship back to the task
     task = relationship("Task", back_populates="attachments")
 
 
+# ===== Archive of finished and old tasks, see services/archive.py =====
+# Archived tasks get their own IDs, since SQLite may reuse the ID of a deleted task.
+# The group, topic and admin columns are plain IDs without foreign keys,
+# so archived tasks outlive the rows they refer to.
+class TaskArchive(Base):
+    __tablename__ = "tasks_archive"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False, index=True)
+    group_id = Column(Integer, nullable=True, index=True)
+    topic_id = Column(Integer, nullable=True)
+    admin_id = Column(Integer, nullable=True, index=True)
+    title = Column(String(255), nullable=False)
+    description = Column(Text, nullable=True)
+    start_date = Column(DateTime, nullable=True)
+    end_date = Column(DateTime, nullable=True)
+    status = Column(String(50), nullable=False)
+    archived_at = Column(DateTime, nullable=False, default=datetime.now)
+
+    assigned_users = relationship("UserTaskArchive", cascade="all, delete")
+    attachments = relationship("TaskAttachmentArchive", cascade="all, delete")
+
+class UserTaskArchive(Base):
+    __tablename__ = "users_tasks_archive"
+    
+    archive_id = Column(Integer, ForeignKey("tasks_archive.id", ondelete="CASCADE"), primary_key=True)
+    # Serves the archived tasks of a user
+    user_id = Column(Integer, primary_key=True, index=True)
+
+class TaskAttachmentArchive(Base):
+    __tablename__ = "task_attachments_archive"
+
+    id = Column(Integer, primary_key=True, index=True)
+    archive_id = Column(Integer, ForeignKey("tasks_archive.id", ondelete="CASCADE"), nullable=False, index=True)
+    file_id = Column(String(255), nullable=False)
+    file_unique_id = Column(String(255), nullable=False)
+    media_type = Column(String(20), nullable=False)
+    added_at = Column(DateTime, nullable=False)
+
+
 def init_db():
+    """
+    Bring the database schema up to date by applying pending migrations.
+    Prefer running `python -m migrations upgrade` before starting the bot.
+    """
+    from migrations import upgrade
     try:
-        inspector = inspect(engine)
-        existing_tables = inspector.get_table_names()
-
-        if not existing_tables:
-            logger.info("No existing tables found. Creating tables ...")
-            Base.metadata.create_all(bind=engine)
-            logger.info("Tables created successfully.")
-        else:
-            logger.info("Tables already exist. Skipping creation.")
+        upgrade(engine)
     except Exception:
-        logger.exception("Failed to create the tables")
+        logger.exception("Failed to migrate the database")
 
 if __name__ == "__main__":
     init_db()
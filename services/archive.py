@@ -0,0 +1,107 @@
+"""
+Archive job: moves finished and old tasks out of the hot tables.
+
+A task is archived when its status is one of ARCHIVE_STATUSES, or when its
+end date passed more than Config.ARCHIVE_AFTER_DAYS days ago. The task, its
+assignments and its attachments are copied to the *_archive tables and deleted
+from the live ones in the same transaction, BATCH_SIZE tasks at a time.
+
+The job uses the sync engine and is meant to run in db_executor, see main.py.
+"""
+from __future__ import annotations
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, or_, select
+from sqlalchemy.engine import Engine
+from models import Task, UserTask, TaskAttachment, TaskArchive, UserTaskArchive, TaskAttachmentArchive
+from config import config
+from logger import logger
+
+# Statuses of tasks which are no longer worked on
+ARCHIVE_STATUSES = ("done", "canceled")
+
+# Tasks moved per transaction, keeps row locks short
+BATCH_SIZE = 500
+
+TASK_COLUMNS = ["group_id", "topic_id", "admin_id", "title", "description", "start_date", "end_date", "status"]
+
+
+def archive_tasks(engine: Engine = None, after_days: int = None) -> int:
+    """
+    Move all archivable tasks to the archive tables.
+    Returns the number of archived tasks.
+    """
+    if engine is None:
+        from database import engine
+    after_days = config.ARCHIVE_AFTER_DAYS if after_days is None else after_days
+
+    archived = 0
+    while True:
+        with engine.begin() as conn:
+            moved = _archive_batch(conn, datetime.now(), after_days)
+        archived += moved
+        if moved < BATCH_SIZE:
+            break
+
+    if archived:
+        logger.info(f"Archived {archived} task(s)")
+    return archived
+
+
+def _archive_batch(conn, now: datetime, after_days: int) -> int:
+    """Archive up to BATCH_SIZE tasks inside the caller's transaction"""
+    cutoff = now - timedelta(days=after_days)
+    tasks = conn.execute(
+        select(Task.__table__)
+        .where(or_(Task.status.in_(ARCHIVE_STATUSES), Task.end_date < cutoff))
+        .order_by(Task.id)
+        .limit(BATCH_SIZE)
+        # Tasks being edited right now are left for the next run
+        .with_for_update(skip_locked=True)
+    ).mappings().all()
+    if not tasks:
+        return 0
+    task_ids = [task["id"] for task in tasks]
+
+    # Archive the tasks and map each task ID to its archive ID.
+    # Rows are passed as executemany parameters rather than one multi-row VALUES, so SQLAlchemy
+    # splits them into statements within the driver's bound parameter limit (999 on old SQLite).
+    archive_ids = dict(
+        (task_id, archive_id)
+        for archive_id, task_id in conn.execute(
+            insert(TaskArchive).returning(TaskArchive.id, TaskArchive.task_id),
+            [
+                {"task_id": task["id"], "archived_at": now, **{c: task[c] for c in TASK_COLUMNS}}
+                for task in tasks
+            ],
+        )
+    )
+
+    assignments = conn.execute(
+        select(UserTask.user_id, UserTask.task_id).where(UserTask.task_id.in_(task_ids))
+    ).all()
+    if assignments:
+        conn.execute(insert(UserTaskArchive), [
+            {"archive_id": archive_ids[task_id], "user_id": user_id}
+            for user_id, task_id in assignments
+        ])
+
+    attachments = conn.execute(
+        select(TaskAttachment.__table__).where(TaskAttachment.task_id.in_(task_ids))
+    ).mappings().all()
+    if attachments:
+        conn.execute(insert(TaskAttachmentArchive), [
+            {
+                "archive_id": archive_ids[attachment["task_id"]],
+                "file_id": attachment["file_id"],
+                "file_unique_id": attachment["file_unique_id"],
+                "media_type": attachment["media_type"],
+                "added_at": attachment["added_at"],
+            }
+            for attachment in attachments
+        ])
+
+    # Children first, SQLite does not cascade unless foreign keys are enabled
+    conn.execute(delete(TaskAttachment).where(TaskAttachment.task_id.in_(task_ids)))
+    conn.execute(delete(UserTask).where(UserTask.task_id.in_(task_ids)))
+    conn.execute(delete(Task).where(Task.id.in_(task_ids)))
+    return len(tasks)
@@ -0,0 +1,216 @@
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable
+from config import config
+from database import after_commit
+
+# Returned by TTLCache.get for keys which are not cached, None is a valid cached value
+MISSING = object()
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries expire ttl seconds after they were set.
+    Holds at most maxsize entries; the least recently used one is dropped first.
+    Only used from the event loop, so it needs no locking.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Cached value of key, or MISSING"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def pop_where(self, predicate: Callable[[Any], bool]) -> None:
+        """Drop every entry whose value matches predicate. Scans the whole cache, meant for rare writes"""
+        for key in [key for key, (_, value) in self._entries.items() if predicate(value)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class GenerationCache(TTLCache):
+    """
+    TTLCache for values loaded while other updates may change them. generation grows with
+    every invalidation, and set_if_current only stores a value when none happened since its
+    loading started: a value loaded while a change was being committed may be the old one.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize, ttl)
+        self.generation = 0
+
+    def set_if_current(self, key: Hashable, value: Any, generation: int) -> None:
+        if generation == self.generation:
+            self.set(key, value)
+
+    def pop(self, key: Hashable) -> None:
+        self.generation += 1
+        super().pop(key)
+
+    def pop_where(self, predicate: Callable[[Any], bool]) -> None:
+        self.generation += 1
+        super().pop_where(predicate)
+
+    def clear(self) -> None:
+        self.generation += 1
+        super().clear()
+
+
+# ===== User identity cache =====
+@dataclass(frozen=True)
+class UserIdentity:
+    """The fields of a user most handlers need, cached by UserService.get_identity"""
+    id: int
+    username: str
+    telegram_id: str | None
+    is_admin: bool
+
+# Identity of each Telegram ID, or None for Telegram IDs without a user
+user_identity_cache = GenerationCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+
+
+# ===== Chat admin cache =====
+# Administrators of each group chat, {Telegram user ID: aiogram User}, see handlers.funcs.get_chat_admins
+chat_admin_cache = TTLCache(maxsize=config.CHAT_ADMIN_CACHE_SIZE, ttl=config.CHAT_ADMIN_CACHE_TTL)
+
+
+# ===== Rendered task card cache =====
+# Views of a task card, the callback data prefix of each
+TASK_CARD_VIEWS = ("view_task", "show_task")
+
+@dataclass(frozen=True)
+class RenderedCard:
+    """Text and inline keyboard of a task card message, cached by handle_view_task"""
+    text: str
+    keyboard: Any
+    # Admin and assigned users shown on the card
+    usernames: frozenset[str]
+
+# Rendered card of each (task ID, view)
+task_card_cache = GenerationCache(maxsize=config.TASK_CARD_CACHE_SIZE, ttl=config.TASK_CARD_CACHE_TTL)
+
+# Marks every card stale in a session's "stale_cards", see cached_task_card
+ALL_CARDS = "*"
+
+def cached_task_card(db, key: tuple[int, str]) -> RenderedCard | Any:
+    """
+    Cached card of (task ID, view), or MISSING.
+    Until the session commits the cache still holds the cards it changed, so those are MISSING for it.
+    """
+    stale = db.info.get("stale_cards", ())
+    if key[0] in stale or ALL_CARDS in stale:
+        return MISSING
+    return task_card_cache.get(key)
+
+def forget_task_card(db, task_id: int) -> None:
+    """Drop every view of a changed or deleted task from task_card_cache, once the session committed"""
+    db.info.setdefault("stale_cards", set()).add(task_id)
+    after_commit(db, partial(_forget_task_card, task_id))
+
+def _forget_task_card(task_id: int) -> None:
+    for view in TASK_CARD_VIEWS:
+        task_card_cache.pop((task_id, view))
+
+def forget_user_cards(db, username: str) -> None:
+    """Drop the cards showing a changed or deleted user, once the session committed"""
+    db.info.setdefault("stale_cards", set()).add(ALL_CARDS)
+    after_commit(db, partial(task_card_cache.pop_where, lambda card: username in card.usernames))
+
+
+# ===== Group and topic resolution map =====
+class ChatMap:
+    """
+    Internal IDs of the registered groups and topics, keyed by their Telegram IDs:
+    groups maps a chat ID to its group ID, topics maps (group ID, thread ID) to a topic ID.
+    Entries are only added once the transaction which created or read the row committed.
+    Groups and topics are never deleted, so entries only go stale when rows are removed
+    by hand; load() then replaces the whole map. version grows with every change.
+    """
+    def __init__(self):
+        self.groups: Dict[str, int] = {}
+        self.topics: Dict[tuple[int, str], int] = {}
+        self.version = 0
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, groups: Dict[str, int], topics: Dict[tuple[int, str], int]) -> None:
+        """Replace the map with a full snapshot of the groups and topics tables"""
+        self.groups = groups
+        self.topics = topics
+        self.version += 1
+        self.loaded = True
+
+    def group_id(self, telegram_id: str) -> int | None:
+        group_id = self.groups.get(telegram_id)
+        if group_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return group_id
+
+    def topic_id(self, group_id: int, telegram_id: str) -> int | None:
+        topic_id = self.topics.get((group_id, telegram_id))
+        if topic_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return topic_id
+
+    def add_group(self, telegram_id: str, group_id: int) -> None:
+        if self.groups.get(telegram_id) != group_id:
+            self.groups[telegram_id] = group_id
+            self.version += 1
+
+    def add_topic(self, group_id: int, telegram_id: str, topic_id: int) -> None:
+        if self.topics.get((group_id, telegram_id)) != topic_id:
+            self.topics[(group_id, telegram_id)] = topic_id
+            self.version += 1
+
+    def stats(self) -> Dict[str, int | float | bool]:
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "loaded": self.loaded,
+            "groups": len(self.groups),
+            "topics": len(self.topics),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+# Filled by TaskService.load_chat_map at startup, see TaskService.resolve_group_id
+chat_map = ChatMap()
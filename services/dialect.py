@@ -0,0 +1,23 @@
+from __future__ import annotations
+from sqlalchemy import insert as sql_insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# INSERT constructs which support ON CONFLICT, per dialect name
+_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+def supports_upserts(dialect: str) -> bool:
+    """Whether the get-or-create and assignment upserts of the services work on a dialect, checked on startup"""
+    return dialect in _INSERTS
+
+def insert(db: AsyncSession, entity):
+    """
+    Build an INSERT for the dialect of the session's database,
+    so ON CONFLICT clauses can be used on Postgres and SQLite.
+    Other dialects get a plain INSERT, on which an ON CONFLICT clause fails inside
+    transactional and is returned as a ServiceError.
+    """
+    return _INSERTS.get(db.get_bind().dialect.name, sql_insert)(entity)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Literal
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+# Postgres SQLSTATEs of transient conflicts: serialization_failure and deadlock_detected
+TRANSIENT_SQLSTATES = {"40001", "40P01"}
+
+@dataclass(frozen=True)
+class ServiceError:
+    """
+    Returned by a service method instead of raising, see handlers.funcs.transactional.
+    It is falsy, so `if not result` checks treat it like the None returned before.
+    - kind: "conflict" for transient conflicts which were retried and still failed,
+      "integrity" for constraint violations, "database" for other database errors
+      and "error" for everything else.
+    """
+    method: str
+    kind: Literal["conflict", "integrity", "database", "error"]
+    message: str
+
+    def __bool__(self) -> bool:
+        return False
+
+    @classmethod
+    def from_exception(cls, method: str, error: Exception) -> ServiceError:
+        if is_transient(error):
+            kind = "conflict"
+        elif isinstance(error, IntegrityError):
+            kind = "integrity"
+        elif isinstance(error, DBAPIError):
+            kind = "database"
+        else:
+            kind = "error"
+        return cls(method=method, kind=kind, message=str(error))
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether an error is a conflict with a concurrent transaction, which may succeed when run again"""
+    if not isinstance(error, DBAPIError):
+        return False
+    sqlstate = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+    if sqlstate in TRANSIENT_SQLSTATES:
+        return True
+    return is_locked(error)
+
+
+def is_locked(error: Exception) -> bool:
+    """
+    Whether SQLite gave up waiting for the write lock of another connection.
+    Unlike Postgres conflicts this only fails the statement, not the transaction around it.
+    """
+    return isinstance(error, DBAPIError) and "database is locked" in str(error.orig)
@@ -0,0 +1,67 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Tuple
+
+# Rows shown on one page of a list keyboard
+PAGE_SIZE = 10
+
+@dataclass(frozen=True)
+class Page:
+    """
+    One page of a paginated list.
+    Cursors are short strings which fit in callback_data. For keyset pages
+    they are ">{id}" for the rows after id and "<{id}" for the rows before id.
+    They are None when there is no page in that direction.
+    """
+    items: List
+    prev_cursor: str | None
+    next_cursor: str | None
+
+
+def parse_cursor(cursor: str | None) -> Tuple[str | None, int | None]:
+    """
+    Split a cursor into its direction and last seen id.
+    Missing or malformed cursors point at the first page.
+    """
+    if not cursor or cursor[0] not in "<>" or not cursor[1:].isdigit():
+        return None, None
+    return cursor[0], int(cursor[1:])
+
+
+async def paginate(db: AsyncSession, query: Select, key, cursor: str = None, limit: int = PAGE_SIZE) -> Page:
+    """
+    Fetch one page of query ordered by the unique column key (usually the primary key).
+    Only limit + 1 rows are read; the extra row tells whether another page exists.
+    """
+    direction, last_id = parse_cursor(cursor)
+
+    if direction == "<":
+        rows = (await db.scalars(
+            query.where(key < last_id).order_by(key.desc()).limit(limit + 1)
+        )).all()
+        has_prev = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        has_next = True
+    else:
+        if direction == ">":
+            query = query.where(key > last_id)
+        rows = (await db.scalars(query.order_by(key).limit(limit + 1))).all()
+        has_prev = direction == ">"
+        has_next = len(rows) > limit
+        rows = list(rows[:limit])
+
+    if not rows:
+        # The rows around the cursor were deleted, keep a way back to the other side
+        return Page(
+            items=[],
+            prev_cursor=f"<{last_id + 1}" if direction == ">" else None,
+            next_cursor=f">{last_id - 1}" if direction == "<" else None,
+        )
+
+    return Page(
+        items=rows,
+        prev_cursor=f"<{getattr(rows[0], key.key)}" if has_prev else None,
+        next_cursor=f">{getattr(rows[-1], key.key)}" if has_next else None,
+    )
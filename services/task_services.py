@@ -1,97 +1,199 @@
 from __future__ import annotations
-from sqlalchemy.orm import Session
-from models import Group, Topic, User, Task, UserTask, TaskAttachment
+from sqlalchemy import bindparam, column, func, literal_column, or_, select, table, insert as sql_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from models import Group, Topic, User, Task, UserTask, TaskAttachment, TaskArchive, UserTaskArchive
+from dataclasses import dataclass
 from datetime import datetime
+from functools import partial
 from logger import logger
-from typing import List, Literal
-from handlers.funcs import exception_decorator
+from database import after_commit
+from typing import Dict, List, Literal, Tuple
+import re
+from handlers.funcs import transactional
+from .errors import ServiceError
+from .dialect import insert
+from .pagination import Page, PAGE_SIZE, paginate
+from .cache import chat_map, forget_task_card
+
+@dataclass(frozen=True)
+class TaskCard:
+    """
+    Read model of a task together with its admin, group, topic and assigned users.
+    Plain values only, so it can be used after the session is closed.
+    """
+    id: int
+    title: str
+    description: str | None
+    start_date: datetime | None
+    end_date: datetime | None
+    status: str
+    admin_username: str | None
+    group_id: int | None
+    group_name: str | None
+    topic_id: int | None
+    topic_name: str | None
+    topic_link: str | None
+    usernames: Tuple[str, ...]
+
+# Text searched by search_tasks on Postgres, identical to the ix_tasks_search index expression
+TASK_DOCUMENT = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))"
+
+# FTS5 table indexing tasks on SQLite
+tasks_fts = table("tasks_fts", column("rowid"), column("rank"))
+
+def search_terms(query: str) -> List[str]:
+    """Words of a search query; anything else could break the tsquery/FTS5 syntax"""
+    return re.findall(r"\w+", query.lower())
+
+# ===== Prebuilt statements of the per-update group and topic lookups =====
+# Executed with bound parameters, like the user lookups in user_services.py
+GROUP_BY_ID = select(Group).where(Group.id == bindparam("id")).limit(1)
+GROUP_BY_TELEGRAM_ID = select(Group).where(Group.telegram_id == bindparam("tID")).limit(1)
+TOPIC_BY_ID = select(Topic).where(Topic.id == bindparam("id")).limit(1)
+TOPIC_BY_TELEGRAM_ID = select(Topic).where(Topic.telegram_id == bindparam("tID")).limit(1)
+TOPIC_BY_GROUP_AND_TELEGRAM_ID = select(Topic).where(
+    Topic.group_id == bindparam("group_id"), Topic.telegram_id == bindparam("tID")
+).limit(1)
+
 
 class TaskService:
     @staticmethod
-    @exception_decorator
-    def get_or_create_group(db: Session, telegram_group_id: str, name: str = None) -> Group | None:
+    @transactional
+    async def get_or_create_group(db: AsyncSession, telegram_group_id: str, name: str = None) -> Group | None | ServiceError:
         """
         Retrieve a group by its telegram_group_id, or create a new one if it does not exist.
+        Done as a single INSERT ... ON CONFLICT, so concurrent calls can not create duplicates.
         """
         if not telegram_group_id:
             return None
         telegram_group_id = str(telegram_group_id)
         
-        # Query for an existing group
-        group = db.query(Group).filter(Group.telegram_id == telegram_group_id).first()
-        
-        if not group:
-            # Create new group if it does not exist
-            group = Group(telegram_id=telegram_group_id, name=name)
-            db.add(group)
-            db.commit()
-            db.refresh(group)
+        stmt = insert(db, Group).values(telegram_id=telegram_group_id, name=name)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Group.telegram_id],
+            # No-op update, so RETURNING also gives back an existing group
+            set_={"telegram_id": stmt.excluded.telegram_id},
+        ).returning(Group)
+        group = await db.scalar(stmt, execution_options={"populate_existing": True})
+        after_commit(db, partial(chat_map.add_group, group.telegram_id, group.id))
         return group
     
     @staticmethod
-    @exception_decorator
-    def get_group(db: Session, id: int = None, tID: str = None) -> Group | None:
+    @transactional(read_only=True)
+    async def get_group(db: AsyncSession, id: int = None, tID: str = None) -> Group | None | ServiceError:
         """
         Retrieve a group either by its database ID or Telegram ID.
         """
         if id==None and tID==None:
             return None
         if tID:
-            group = db.query(Group).filter(Group.telegram_id == tID).first()
+            group = await db.scalar(GROUP_BY_TELEGRAM_ID, {"tID": tID})
         else:
-            group = db.query(Group).filter(Group.id == id).first()
+            group = await db.scalar(GROUP_BY_ID, {"id": id})
         return group
     
     @staticmethod
-    @exception_decorator
-    def get_topic(db: Session, id: int = None, tID: int = None) -> Topic | None:
+    @transactional(read_only=True)
+    async def get_topic(db: AsyncSession, id: int = None, tID: int = None, group_id: int = None) -> Topic | None | ServiceError:
         """
-        Retrieve a topic by its database ID.
+        Retrieve a topic by its database ID, or by its Telegram thread ID.
+        Thread IDs are only unique within a group, pass group_id to look one up in its group.
         """
+        if tID and group_id:
+            topic = await db.scalar(TOPIC_BY_GROUP_AND_TELEGRAM_ID, {"group_id": group_id, "tID": str(tID)})
+            return topic
         if tID:
-            topic = db.query(Topic).filter(Topic.telegram_id == tID).first()
+            topic = await db.scalar(TOPIC_BY_TELEGRAM_ID, {"tID": tID})
             return topic
         if id==None:
             return None
-        topic = db.query(Topic).filter(Topic.id == id).first()
+        topic = await db.scalar(TOPIC_BY_ID, {"id": id})
         return topic
 
     @staticmethod
-    @exception_decorator
-    def get_or_create_topic(db: Session, telegram_topic_id: str, group_id: int, name: str, link: str):
+    @transactional
+    async def get_or_create_topic(db: AsyncSession, telegram_topic_id: str, group_id: int, name: str, link: str):
         """
         Retrieve a topic by its telegram_topic_id and group_id,
         or create a new one if it does not exist.
+        Done as a single INSERT ... ON CONFLICT, so concurrent calls can not create duplicates.
         """
         if not telegram_topic_id:
             return None
         telegram_topic_id = str(telegram_topic_id)
             
-        # Query for an existing topic
-        topic = db.query(Topic).filter(
-            Topic.telegram_id == telegram_topic_id, 
-            Topic.group_id == group_id
-        ).first()
-        
-        if not topic:
-            # Create new topic if it does not exist
-            topic = Topic(telegram_id=telegram_topic_id, group_id=group_id, name=name, link=link)
-            db.add(topic)
-            db.commit()
-            db.refresh(topic)
+        stmt = insert(db, Topic).values(telegram_id=telegram_topic_id, group_id=group_id, name=name, link=link)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Topic.group_id, Topic.telegram_id],
+            # No-op update, so RETURNING also gives back an existing topic
+            set_={"telegram_id": stmt.excluded.telegram_id},
+        ).returning(Topic)
+        topic = await db.scalar(stmt, execution_options={"populate_existing": True})
+        after_commit(db, partial(chat_map.add_topic, topic.group_id, topic.telegram_id, topic.id))
         return topic
 
+    # ===== Group and topic resolution, see services/cache.py =====
+    @staticmethod
+    @transactional(read_only=True)
+    async def load_chat_map(db: AsyncSession) -> int | ServiceError:
+        """
+        Rebuild chat_map from the groups and topics tables.
+        Done at startup, and whenever the tables were changed outside the bot.
+        Returns the new version of the map.
+        """
+        groups = dict((await db.execute(select(Group.telegram_id, Group.id))).all())
+        topics = {
+            (group_id, telegram_id): topic_id
+            for topic_id, group_id, telegram_id in (await db.execute(select(Topic.id, Topic.group_id, Topic.telegram_id))).all()
+        }
+        chat_map.load(groups, topics)
+        logger.info(f"Loaded {len(groups)} group(s) and {len(topics)} topic(s) into the chat map")
+        return chat_map.version
+
+    @staticmethod
+    async def resolve_group_id(db: AsyncSession, tID: str) -> int | None | ServiceError:
+        """
+        Retrieve the ID of the group with a Telegram chat ID.
+        Served from chat_map; only groups missing from it, unregistered ones included, are looked up in the database.
+        """
+        tID = str(tID)
+        group_id = chat_map.group_id(tID)
+        if group_id is not None:
+            return group_id
+        group = await TaskService.get_group(db=db, tID=tID)
+        if not group:
+            return group
+        after_commit(db, partial(chat_map.add_group, group.telegram_id, group.id))
+        return group.id
+
+    @staticmethod
+    async def resolve_topic_id(db: AsyncSession, group_id: int, tID: str) -> int | None | ServiceError:
+        """
+        Retrieve the ID of the topic with a Telegram thread ID in a group.
+        Served from chat_map like resolve_group_id.
+        """
+        tID = str(tID)
+        topic_id = chat_map.topic_id(group_id, tID)
+        if topic_id is not None:
+            return topic_id
+        topic = await TaskService.get_topic(db=db, tID=tID, group_id=group_id)
+        if not topic:
+            return topic
+        after_commit(db, partial(chat_map.add_topic, topic.group_id, topic.telegram_id, topic.id))
+        return topic.id
+
     @staticmethod
-    @exception_decorator
-    def create_task(
-        db: Session,
+    @transactional
+    async def create_task(
+        db: AsyncSession,
         title: str,
         group_id: int = None,
         topic_id: int = None,
         admin_id: int = None,
         description: str = None,
         end_date = None
-    ) -> Task | None:
+    ) -> Task | ServiceError:
         """
         Create a new task with optional group, topic, admin, title, description, and end_date.
         If end_date is a string in 'YYYY-MM-DD' format, convert it to datetime.
@@ -115,82 +217,156 @@ class TaskService:
             end_date=end_date_obj
         )
         db.add(task)
-        db.commit()
-        db.refresh(task)
+        await db.flush()
+        await db.refresh(task)
         return task
     
     @staticmethod
-    @exception_decorator
-    def get_task_by_admin_id(db: Session, admin_id: int) -> List[Task] | None:
+    @transactional
+    async def create_tasks_bulk(
+        db: AsyncSession,
+        titles: List[str],
+        admin_id: int,
+        group_id: int = None,
+        topic_id: int = None,
+    ) -> List[int] | ServiceError:
+        """
+        Create one task per title with a single multi-row INSERT.
+        All tasks share the admin, group and topic. Returns the IDs of the new tasks.
+        """
+        if not titles:
+            return []
+
+        now = datetime.now()
+        rows = [
+            {
+                "group_id": group_id,
+                "topic_id": topic_id,
+                "admin_id": admin_id,
+                "title": title,
+                "start_date": now,
+                "status": "pending",
+            }
+            for title in titles
+        ]
+        task_ids = await db.scalars(sql_insert(Task).values(rows).returning(Task.id))
+        return task_ids.all()
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_task_by_admin_id(db: AsyncSession, admin_id: int) -> List[Task] | ServiceError:
         """
         Retrieve all tasks created by a specific admin.
         """
-        tasks = db.query(Task).filter(
-            Task.admin_id == admin_id
-        ).all()
-        return tasks
+        tasks = await db.scalars(
+            select(Task).where(Task.admin_id == admin_id)
+        )
+        return tasks.all()
     
     @staticmethod
-    @exception_decorator
-    def get_task_by_id(db: Session, id: int) -> Task | None:
+    @transactional(read_only=True)
+    async def get_task_by_id(db: AsyncSession, id: int) -> Task | None | ServiceError:
         """
         Retrieve a single task by its database ID.
         """
-        task = db.query(Task).filter(
-            Task.id == id
-        ).first()
+        task = await db.scalar(
+            select(Task).where(Task.id == id).limit(1)
+        )
         return task
     
     @staticmethod
-    @exception_decorator
-    def delete_task(db: Session, task: Task) -> True | None:
+    @transactional(read_only=True)
+    async def get_task_card(db: AsyncSession, task_id: int) -> TaskCard | None | ServiceError:
+        """
+        Load a task with its admin, group, topic and assigned users in one joined query
+        (plus one IN query for the assigned users) and return it as a TaskCard.
+        """
+        task = await db.scalar(
+            select(Task)
+            .options(
+                joinedload(Task.admin_user),
+                joinedload(Task.group),
+                joinedload(Task.topic),
+                selectinload(Task.assigned_users).joinedload(UserTask.user),
+            )
+            .where(Task.id == task_id)
+        )
+        if not task:
+            return None
+
+        return TaskCard(
+            id=task.id,
+            title=task.title,
+            description=task.description,
+            start_date=task.start_date,
+            end_date=task.end_date,
+            status=task.status,
+            admin_username=task.admin_user.username if task.admin_user else None,
+            group_id=task.group.id if task.group else None,
+            group_name=task.group.name if task.group else None,
+            topic_id=task.topic.id if task.topic else None,
+            topic_name=task.topic.name if task.topic else None,
+            topic_link=task.topic.link if task.topic else None,
+            usernames=tuple(
+                assignment.user.username
+                for assignment in sorted(task.assigned_users, key=lambda a: a.user_id)
+            ),
+        )
+    
+    @staticmethod
+    @transactional
+    async def delete_task(db: AsyncSession, task: Task) -> True | ServiceError:
         """
         Delete a task from the database.
         """
-        db.delete(task)
-        db.commit()
+        await db.delete(task)
+        await db.flush()
+        forget_task_card(db, task.id)
         return True
 
     @staticmethod
-    @exception_decorator
-    def get_task_users(db: Session, task_id: int) -> List[User] | None:
+    @transactional(read_only=True)
+    async def get_task_users(db: AsyncSession, task_id: int) -> List[User] | ServiceError:
         """
         Retrieve all users assigned to a specific task.
         """
-        assigned_users = db.query(User).join(UserTask).filter(
-            UserTask.task_id == task_id
-        ).all()
-        return assigned_users
+        assigned_users = await db.scalars(
+            select(User).join(UserTask).where(UserTask.task_id == task_id)
+        )
+        return assigned_users.all()
 
     @staticmethod
-    @exception_decorator
-    def delete_user_from_task(db: Session, task_id: int, user_id: int) -> Literal[True, "NOT_EXIST"] | None:
+    @transactional
+    async def delete_user_from_task(db: AsyncSession, task_id: int, user_id: int) -> Literal[True, "NOT_EXIST"] | ServiceError:
         """
         Remove a user assignment from a task.
         Returns "NOT_EXIST" if the user-task relation does not exist.
         """
-        user_task_assignment = db.query(UserTask).filter(
-            UserTask.user_id == user_id,
-            UserTask.task_id == task_id
-        ).first()
+        user_task_assignment = await db.scalar(
+            select(UserTask).where(
+                UserTask.user_id == user_id,
+                UserTask.task_id == task_id
+            ).limit(1)
+        )
 
         if not user_task_assignment:
             return "NOT_EXIST"
 
-        db.delete(user_task_assignment)
-        db.commit()
+        await db.delete(user_task_assignment)
+        await db.flush()
+        forget_task_card(db, task_id)
         return True
 
     @staticmethod
-    @exception_decorator
-    def edit_task(db: Session, task_id: int, name: str = None, description: str = None, start_date: str = None, end_date: str = None) -> Literal[True, "NOT_EXIST"] | None:
+    @transactional
+    async def edit_task(db: AsyncSession, task_id: int, name: str = None, description: str = None, start_date: str = None, end_date: str = None, status: str = None) -> Literal[True, "NOT_EXIST"] | ServiceError:
         """
-        Edit task details such as name, description, start_date, and end_date.
+        Edit task details such as name, description, start_date, end_date and status.
         Returns "NOT_EXIST" if the task does not exist.
         """
-        task = db.query(Task).filter(
-            Task.id == task_id
-        ).first()
+        task = await db.scalar(
+            select(Task).where(Task.id == task_id).limit(1)
+        )
 
         if not task:
             return "NOT_EXIST"
@@ -203,89 +379,312 @@ class TaskService:
             task.start_date = start_date
         if end_date:
             task.end_date = end_date
+        if status:
+            task.status = status
 
-        db.commit()
-        db.refresh(task)
+        await db.flush()
+        await db.refresh(task)
+        forget_task_card(db, task_id)
         return True
 
     @staticmethod
-    @exception_decorator
-    def get_all_groups(db: Session) -> List[Group] | None:
+    @transactional(read_only=True)
+    async def get_all_groups(db: AsyncSession) -> List[Group] | ServiceError:
         """
         Retrieve all groups from the database.
         """
-        groups = db.query(Group).all()
-        return groups
+        groups = await db.scalars(select(Group))
+        return groups.all()
     
     @staticmethod
-    @exception_decorator
-    def get_all_topics(db: Session, group_id: int = None) -> List[Topic] | None:
+    @transactional(read_only=True)
+    async def get_all_topics(db: AsyncSession, group_id: int = None) -> List[Topic] | ServiceError:
         """
         Retrieve all topics from the database.
         """
         if group_id:
-            topics = db.query(Topic).filter(Topic.group_id == group_id).all()
-            return topics
-        topics = db.query(Topic).all()
-        return topics
+            topics = await db.scalars(select(Topic).where(Topic.group_id == group_id))
+            return topics.all()
+        topics = await db.scalars(select(Topic))
+        return topics.all()
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_groups_page(db: AsyncSession, cursor: str = None, limit: int = PAGE_SIZE) -> Page | ServiceError:
+        """
+        Retrieve one page of groups ordered by ID.
+        """
+        return await paginate(db, select(Group), Group.id, cursor=cursor, limit=limit)
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_topics_page(db: AsyncSession, group_id: int, cursor: str = None, limit: int = PAGE_SIZE) -> Page | ServiceError:
+        """
+        Retrieve one page of a group's topics ordered by ID.
+        """
+        query = select(Topic).where(Topic.group_id == group_id)
+        return await paginate(db, query, Topic.id, cursor=cursor, limit=limit)
     
     @staticmethod
-    @exception_decorator
-    def get_all_tasks(db: Session, group_id: int = None, topic_id: int = None) -> List[Task] | None:
+    def _tasks_query(group_id: int = None, topic_id: int = None, user_id: int = None):
         """
-        Retrieve all tasks.
-        It can be filltered by group_id or topic_id
+        Build the task query shared by get_all_tasks and get_tasks_page.
+        group_id/topic_id False means tasks without a group/topic.
+        With user_id only the tasks assigned to the user are returned.
         """
         if group_id != None and topic_id == False:
-            tasks = db.query(Task).filter(Task.group_id==group_id, Task.topic_id.is_(None)).all()
+            query = select(Task).where(Task.group_id==group_id, Task.topic_id.is_(None))
         elif group_id:
-            tasks = db.query(Task).filter(Task.group_id == group_id).all()
+            query = select(Task).where(Task.group_id == group_id)
         elif group_id == False:
-            tasks = db.query(Task).filter(Task.group_id.is_(None)).all()
+            query = select(Task).where(Task.group_id.is_(None))
         elif topic_id:
-            tasks = db.query(Task).filter(Task.topic_id == topic_id).all()
+            query = select(Task).where(Task.topic_id == topic_id)
         elif topic_id == False:
-            tasks = db.query(Task).filter(Task.topic_id.is_(None)).all() 
+            query = select(Task).where(Task.topic_id.is_(None))
         else:
-            tasks = db.query(Task).all()
-        return tasks
+            query = select(Task)
+
+        if user_id:
+            query = query.where(Task.id.in_(select(UserTask.task_id).where(UserTask.user_id == user_id)))
+        return query
 
     @staticmethod
-    @exception_decorator
-    def get_tasks_for_user(db: Session, user_id: int) -> List[Task]:
+    @transactional(read_only=True)
+    async def get_all_tasks(db: AsyncSession, group_id: int = None, topic_id: int = None) -> List[Task] | ServiceError:
         """
-        Retrieve all tasks assigned to a specific user.
+        Retrieve all tasks.
+        It can be filltered by group_id or topic_id
         """
-        tasks = db.query(Task).join(UserTask).filter(
-            UserTask.user_id == user_id
-        ).all()
-        return tasks
+        tasks = await db.scalars(TaskService._tasks_query(group_id=group_id, topic_id=topic_id))
+        return tasks.all()
 
-class TaskAttachmentService:
-    
     @staticmethod
-    @exception_decorator
-    def get_attachments(db: Session, task_id: int) -> List[int]:
-        """Get all attachment IDs for a task"""
-        record = db.query(TaskAttachment).filter(TaskAttachment.task_id == task_id).first()
-        if record:
-            return record.attachment_ids
-        return []
-
-    @staticmethod
-    @exception_decorator
-    def add_attachment(db: Session, task_id: int, attachment_id: str) -> None:
-        """Add a new attachment ID to a task"""
-        record = db.query(TaskAttachment).filter(TaskAttachment.task_id == task_id).first()
-        if record:
-            # Append if not exists
-            if attachment_id not in record.attachment_ids:
-                record.attachment_ids.append(attachment_id)
+    @transactional(read_only=True)
+    async def get_tasks_page(db: AsyncSession, group_id: int = None, topic_id: int = None, user_id: int = None, cursor: str = None, limit: int = PAGE_SIZE) -> Page | ServiceError:
+        """
+        Retrieve one page of tasks ordered by ID, filtered like get_all_tasks,
+        or to the tasks assigned to a user (user_id).
+        """
+        query = TaskService._tasks_query(group_id=group_id, topic_id=topic_id, user_id=user_id)
+        return await paginate(db, query, Task.id, cursor=cursor, limit=limit)
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def count_tasks(db: AsyncSession, group_id: int = None, topic_id: int = None) -> int | ServiceError:
+        """
+        Count tasks with SELECT COUNT, filtered like get_all_tasks.
+        """
+        query = TaskService._tasks_query(group_id=group_id, topic_id=topic_id)
+        return await db.scalar(query.with_only_columns(func.count(Task.id)))
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def count_tasks_by_status(db: AsyncSession, group_id: int = None, topic_id: int = None) -> Dict[str, int] | ServiceError:
+        """
+        Count tasks per status, filtered like get_all_tasks.
+        """
+        query = TaskService._tasks_query(group_id=group_id, topic_id=topic_id)
+        rows = await db.execute(
+            query.with_only_columns(Task.status, func.count(Task.id)).group_by(Task.status)
+        )
+        return dict(rows.all())
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def count_tasks_per_group(db: AsyncSession, group_ids: List[int]) -> Dict[int, int] | ServiceError:
+        """
+        Count the tasks of each given group with one GROUP BY query.
+        Groups without tasks are missing from the result.
+        """
+        if not group_ids:
+            return {}
+        rows = await db.execute(
+            select(Task.group_id, func.count(Task.id))
+            .where(Task.group_id.in_(group_ids))
+            .group_by(Task.group_id)
+        )
+        return dict(rows.all())
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def count_groups(db: AsyncSession) -> int | ServiceError:
+        """
+        Count all groups.
+        """
+        return await db.scalar(select(func.count(Group.id)))
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def count_topics(db: AsyncSession, group_id: int) -> int | ServiceError:
+        """
+        Count the topics of a group.
+        """
+        return await db.scalar(select(func.count(Topic.id)).where(Topic.group_id == group_id))
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def search_tasks(db: AsyncSession, query: str, user_id: int = None, group_id: int = None, cursor: str = None, limit: int = PAGE_SIZE) -> Page | ServiceError:
+        """
+        Full-text search over task titles and descriptions, best matches first.
+        Every word must match, as a prefix of a word of the task.
+        Results are limited to a group's tasks (group_id), or to the tasks
+        a user created or is assigned to (user_id).
+        Uses the ix_tasks_search GIN index on Postgres and the tasks_fts table on SQLite.
+        Other databases fall back to unranked case-insensitive substring matches.
+        The cursors of the returned page are result offsets.
+        """
+        terms = search_terms(query)
+        if not terms:
+            return Page(items=[], prev_cursor=None, next_cursor=None)
+
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            tsquery = func.to_tsquery(literal_column("'simple'"), " & ".join(f"{term}:*" for term in terms))
+            document = literal_column(TASK_DOCUMENT)
+            stmt = (
+                select(Task)
+                .where(document.op("@@")(tsquery))
+                .order_by(func.ts_rank(document, tsquery).desc(), Task.id)
+            )
+        elif dialect == "sqlite":
+            stmt = (
+                select(Task)
+                .join(tasks_fts, tasks_fts.c.rowid == Task.id)
+                .where(literal_column("tasks_fts").op("MATCH")(" ".join(f'"{term}"*' for term in terms)))
+                .order_by(tasks_fts.c.rank, Task.id)
+            )
         else:
-            record = TaskAttachment(task_id=task_id, attachment_ids=[attachment_id])
-            db.add(record)
-        db.commit()
+            stmt = (
+                select(Task)
+                .where(*(
+                    or_(Task.title.icontains(term, autoescape=True), Task.description.icontains(term, autoescape=True))
+                    for term in terms
+                ))
+                .order_by(Task.id)
+            )
+
+        if group_id is not None:
+            stmt = stmt.where(Task.group_id == group_id)
+        if user_id is not None:
+            stmt = stmt.where(or_(
+                Task.admin_id == user_id,
+                Task.id.in_(select(UserTask.task_id).where(UserTask.user_id == user_id)),
+            ))
+
+        # Ranked results have no stable key to seek on, so pages use offsets
+        offset = int(cursor) if cursor and cursor.isdigit() else 0
+        tasks = (await db.scalars(stmt.offset(offset).limit(limit + 1))).all()
+        return Page(
+            items=list(tasks[:limit]),
+            prev_cursor=str(max(offset - limit, 0)) if offset > 0 else None,
+            next_cursor=str(offset + limit) if len(tasks) > limit else None,
+        )
 
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_tasks_for_user(db: AsyncSession, user_id: int) -> List[Task] | ServiceError:
+        """
+        Retrieve all tasks assigned to a specific user.
+        """
+        tasks = await db.scalars(
+            select(Task).join(UserTask).where(UserTask.user_id == user_id)
+        )
+        return tasks.all()
+    # ===== Archived tasks, moved out of the tasks table by services/archive.py =====
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_archived_tasks_page(db: AsyncSession, cursor: str = None, limit: int = PAGE_SIZE) -> Page | ServiceError:
+        """
+        Retrieve one page of archived tasks ordered by archive ID.
+        """
+        return await paginate(db, select(TaskArchive), TaskArchive.id, cursor=cursor, limit=limit)
 
+    @staticmethod
+    @transactional(read_only=True)
+    async def count_archived_tasks(db: AsyncSession) -> int | ServiceError:
+        """
+        Count archived tasks with SELECT COUNT.
+        """
+        return await db.scalar(select(func.count(TaskArchive.id)))
 
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_archived_task_card(db: AsyncSession, archive_id: int) -> TaskCard | None | ServiceError:
+        """
+        Load an archived task as a TaskCard. Its admin, group and topic are looked up
+        by ID and left empty when they were deleted after archiving.
+        The card ID is the archive ID.
+        """
+        row = (await db.execute(
+            select(TaskArchive, User.username, Group.name, Topic.name, Topic.link)
+            .outerjoin(User, User.id == TaskArchive.admin_id)
+            .outerjoin(Group, Group.id == TaskArchive.group_id)
+            .outerjoin(Topic, Topic.id == TaskArchive.topic_id)
+            .where(TaskArchive.id == archive_id)
+        )).first()
+        if not row:
+            return None
+        task, admin_username, group_name, topic_name, topic_link = row
 
+        usernames = await db.scalars(
+            select(User.username)
+            .join(UserTaskArchive, UserTaskArchive.user_id == User.id)
+            .where(UserTaskArchive.archive_id == archive_id)
+            .order_by(User.id)
+        )
+
+        return TaskCard(
+            id=task.id,
+            title=task.title,
+            description=task.description,
+            start_date=task.start_date,
+            end_date=task.end_date,
+            status=task.status,
+            admin_username=admin_username,
+            group_id=task.group_id if group_name is not None else None,
+            group_name=group_name,
+            topic_id=task.topic_id if topic_name is not None else None,
+            topic_name=topic_name,
+            topic_link=topic_link,
+            usernames=tuple(usernames.all()),
+        )
+
+
+class TaskAttachmentService:
+    
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_attachments(db: AsyncSession, task_id: int) -> List[TaskAttachment] | ServiceError:
+        """Get all attachments of a task, in the order they were added"""
+        attachments = await db.scalars(
+            select(TaskAttachment)
+            .where(TaskAttachment.task_id == task_id)
+            .order_by(TaskAttachment.id)
+        )
+        return attachments.all()
+
+    @staticmethod
+    @transactional
+    async def add_attachment(db: AsyncSession, task_id: int, file_id: str, file_unique_id: str, media_type: str = "document") -> Literal[True, "EXIST"] | ServiceError:
+        """
+        Add a new attachment to a task.
+        Returns "EXIST" if the same file is already attached to the task.
+        """
+        stmt = (
+            insert(db, TaskAttachment)
+            .values(
+                task_id=task_id,
+                file_id=file_id,
+                file_unique_id=file_unique_id,
+                media_type=media_type,
+                added_at=datetime.now(),
+            )
+            .on_conflict_do_nothing(index_elements=["task_id", "file_unique_id"])
+            .returning(TaskAttachment.id)
+        )
+        attachment_id = await db.scalar(stmt)
+        if attachment_id is None:
+            return "EXIST"
+        forget_task_card(db, task_id)
+        return True
@@ -1,14 +1,33 @@
 from __future__ import annotations
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from models import User, UserTask
-from handlers.funcs import exception_decorator
-from typing import Literal, Generator
+from datetime import datetime
+from functools import partial
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import bindparam, delete, func, literal, or_, select, update
+from models import User, UserTask, Task, GroupMember
+from handlers.funcs import transactional
+from database import after_commit, use_primary
+from .errors import ServiceError
+from typing import Iterable, Literal, List
+from .cache import MISSING, UserIdentity, forget_task_card, forget_user_cards, user_identity_cache
+from .dialect import insert
+from .pagination import Page, PAGE_SIZE, paginate
+
+# ===== Prebuilt statements of the per-update user lookups =====
+# Built once at import and executed with bound parameters, so a call neither rebuilds
+# the select() nor recomputes its cache key before SQLAlchemy finds the compiled SQL.
+USER_BY_ID = select(User).where(User.id == bindparam("user_ID")).limit(1)
+USER_BY_TELEGRAM_ID = select(User).where(User.telegram_id == bindparam("user_tID")).limit(1)
+USER_BY_USERNAME = select(User).where(User.username == bindparam("username")).limit(1)
+USER_BY_TELEGRAM_ID_AND_USERNAME = (
+    select(User)
+    .where(User.telegram_id == bindparam("user_tID"), User.username == bindparam("username"))
+    .limit(1)
+)
 
 class UserService:        
     @staticmethod
-    @exception_decorator
-    def get_user(db: Session, username: str = None, user_tID: str = None, user_ID: int = None) -> User | None:
+    @transactional(read_only=True)
+    async def get_user(db: AsyncSession, username: str = None, user_tID: str = None, user_ID: int = None) -> User | None | ServiceError:
         """
         Retrieve a user by one or more identifiers:
         - username
@@ -21,104 +40,242 @@ class UserService:
             user_tID = str(user_tID)
 
         if user_ID:
-            return db.query(User).filter(User.id == user_ID).first()
+            return await db.scalar(USER_BY_ID, {"user_ID": user_ID})
         elif username is not None and user_tID is not None:
-            return db.query(User).filter(User.telegram_id == user_tID, User.username == username).first()
+            return await db.scalar(USER_BY_TELEGRAM_ID_AND_USERNAME, {"user_tID": user_tID, "username": username})
         elif username is not None:
-            return db.query(User).filter(User.username == username).first()
+            return await db.scalar(USER_BY_USERNAME, {"username": username})
         elif user_tID is not None:
-            return db.query(User).filter(User.telegram_id == user_tID).first()
-        else:
-            return None
+            return await db.scalar(USER_BY_TELEGRAM_ID, {"user_tID": user_tID})
+        return None
     
     @staticmethod
-    @exception_decorator
-    def get_or_create_user(db: Session, username: str, telegram_id: int = None, is_admin: bool = False) -> User | None:
+    @transactional
+    async def get_or_create_user(db: AsyncSession, username: str, telegram_id: int = None, is_admin: bool = False) -> User | None | ServiceError:
         """
-        Retrieve a user by username or Telegram ID.
+        Retrieve a user by Telegram ID or username.
         If the user does not exist, create a new one.
-        Updates admin status and Telegram ID if user already exists.
+        Updates admin status, username and Telegram ID if user already exists.
+        With a Telegram ID the user is resolved by it first:
+        - a username added by an admin without Telegram ID is linked to the account, or merged
+          into it when the account is already registered under an older username
+        - a username still held by another Telegram account, which changed it since, is released
+        The write itself is a single INSERT ... ON CONFLICT, so concurrent calls can not create duplicates.
         """
         if not username:
             return None
-        if telegram_id:
-            user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        else:
-            user = db.query(User).filter(User.username == username).first()
+        if not telegram_id:
+            user = await UserService._upsert_user(db, username=username, is_admin=is_admin, conflict="username")
+            UserService._forget_identity(db, user)
+            return user
 
-        if not user:
-            user = User(username=username, is_admin=is_admin)
-            db.add(user)
+        telegram_id = str(telegram_id)
+        account = await db.scalar(USER_BY_TELEGRAM_ID, {"user_tID": telegram_id})
+        holder = await db.scalar(USER_BY_USERNAME, {"username": username})
 
-        if telegram_id:
-            user.telegram_id = telegram_id
-        user.is_admin = is_admin
-        
-        db.commit()
-        db.refresh(user)
+        conflict = "telegram_id"
+        if holder is not None and holder is not account:
+            if holder.telegram_id is None and account is None:
+                # Links a username added by an admin to the Telegram account using it
+                conflict = "username"
+            elif holder.telegram_id is None:
+                await UserService._merge_user(db, source=holder, target=account)
+            else:
+                await UserService._release_username(db, holder)
+        if account is not None and account.username != username:
+            # The account is renamed, its cards show the old username
+            forget_user_cards(db, account.username)
+
+        user = await UserService._upsert_user(db, username=username, telegram_id=telegram_id, is_admin=is_admin, conflict=conflict)
+        UserService._forget_identity(db, user)
         return user
+
+    @staticmethod
+    async def _merge_user(db: AsyncSession, source: User, target: User) -> None:
+        """Move the assignments and created tasks of a user without Telegram ID to target, and delete it"""
+        await db.execute(
+            insert(db, UserTask)
+            .from_select(
+                ["user_id", "task_id"],
+                select(literal(target.id), UserTask.task_id).where(UserTask.user_id == source.id),
+            )
+            .on_conflict_do_nothing(index_elements=[UserTask.user_id, UserTask.task_id])
+        )
+        await db.execute(update(Task).where(Task.admin_id == source.id).values(admin_id=target.id))
+        await db.execute(delete(UserTask).where(UserTask.user_id == source.id))
+        await db.execute(delete(User).where(User.id == source.id))
+        db.expunge(source)
+        forget_user_cards(db, source.username)
+
+    @staticmethod
+    async def _release_username(db: AsyncSession, user: User) -> None:
+        """
+        Rename a user whose username was taken over by another Telegram account.
+        "~" never appears in Telegram usernames, so the new one can not conflict with a real one.
+        """
+        forget_user_cards(db, user.username)
+        user.username = f"{user.username}~{user.telegram_id}"
+        await db.flush()
+        UserService._forget_identity(db, user)
+
+    # ===== Cached identities, see services/cache.py =====
+    @staticmethod
+    async def get_identity(db: AsyncSession, user_tID: str) -> UserIdentity | None | ServiceError:
+        """
+        Retrieve the ID, username and admin role of the user with a Telegram ID.
+        Served from user_identity_cache for up to Config.USER_CACHE_TTL seconds, unregistered
+        Telegram IDs included. Writes to a user drop it from the cache through _forget_identity.
+        """
+        user_tID = str(user_tID)
+        if db.info.get("stale_identities"):
+            # The cache still holds the users this session changed until it commits
+            return await UserService._load_identity(db=db, user_tID=user_tID, cache=False)
+        identity = user_identity_cache.get(user_tID)
+        if identity is MISSING:
+            identity = await UserService._load_identity(db=db, user_tID=user_tID)
+        return identity
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def _load_identity(db: AsyncSession, user_tID: str, cache: bool = True) -> UserIdentity | None | ServiceError:
+        """Load an identity from the primary, a lagging replica would keep a revoked admin role cached"""
+        generation = user_identity_cache.generation
+        use_primary(db)
+        user = await db.scalar(USER_BY_TELEGRAM_ID, {"user_tID": user_tID})
+        identity = UserIdentity(
+            id=user.id,
+            username=user.username,
+            telegram_id=user.telegram_id,
+            is_admin=user.is_admin,
+        ) if user else None
+        if cache:
+            user_identity_cache.set_if_current(user_tID, identity, generation)
+        return identity
+
+    @staticmethod
+    def _forget_identity(db: AsyncSession, user: User) -> None:
+        """
+        Drop a changed or deleted user from user_identity_cache, under its current and any older
+        Telegram ID, once the session committed. Until then the session bypasses the cache.
+        """
+        db.info["stale_identities"] = True
+        after_commit(db, partial(UserService._pop_identity, user.id, user.telegram_id))
+
+    @staticmethod
+    def _pop_identity(user_ID: int, user_tID: str | None) -> None:
+        if user_tID:
+            user_identity_cache.pop(user_tID)
+        user_identity_cache.pop_where(lambda identity: identity is not None and identity.id == user_ID)
+
+    @staticmethod
+    async def _upsert_user(db: AsyncSession, username: str, is_admin: bool, conflict: Literal["username", "telegram_id"], telegram_id: str = None) -> User:
+        """
+        Insert a user, or update the one holding the same `conflict` column.
+        The other columns given are copied onto an existing user.
+        """
+        values = {"username": username, "is_admin": is_admin}
+        if telegram_id:
+            values["telegram_id"] = telegram_id
+
+        stmt = insert(db, User).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[getattr(User, conflict)],
+            set_={column: stmt.excluded[column] for column in values if column != conflict},
+        ).returning(User)
+        return await db.scalar(stmt, execution_options={"populate_existing": True})
     
     @staticmethod
-    @exception_decorator
-    def assign_user_to_task(db: Session, user_ID: str, task_id: int) -> True | None:
+    @transactional
+    async def assign_user_to_task(db: AsyncSession, user_ID: str, task_id: int) -> True | ServiceError:
         """
         Assign a user to a task.
         Checks if the assignment already exists to avoid duplicates.
         """
-        existing_assignment = db.query(UserTask).filter(
-            UserTask.user_id == user_ID,
-            UserTask.task_id == task_id
-        ).first()
+        existing_assignment = await db.scalar(
+            select(UserTask).where(
+                UserTask.user_id == user_ID,
+                UserTask.task_id == task_id
+            ).limit(1)
+        )
         
         if not existing_assignment:
             user_task = UserTask(user_id=user_ID, task_id=task_id)
             db.add(user_task)
-            db.commit()
+            await db.flush()
+            forget_task_card(db, task_id)
         
         return True
     
     @staticmethod
-    @exception_decorator
-    def is_admin(db: Session, user_tID: str = None, username: str = None) -> bool | None:
+    @transactional
+    async def assign_users_to_task(db: AsyncSession, task_id: int, user_ids: List[int]) -> List[int] | ServiceError:
+        """
+        Assign several users to a task with a single INSERT.
+        Users already assigned to the task are skipped by ON CONFLICT DO NOTHING.
+        Returns the IDs of the newly assigned users.
+        """
+        if not user_ids:
+            return []
+
+        stmt = (
+            insert(db, UserTask)
+            .values([{"user_id": user_id, "task_id": task_id} for user_id in set(user_ids)])
+            .on_conflict_do_nothing(index_elements=[UserTask.user_id, UserTask.task_id])
+            .returning(UserTask.user_id)
+        )
+        assigned = (await db.scalars(stmt)).all()
+        if assigned:
+            forget_task_card(db, task_id)
+        return assigned
+    
+    @staticmethod
+    @transactional(read_only=True)
+    async def is_admin(db: AsyncSession, user_tID: str = None, username: str = None) -> bool | None | ServiceError:
         """
         Check if a user is an admin.
         Returns True, False, or None if the user does not exist.
         """
-        user = UserService.get_user(db=db, username=username, user_tID=user_tID)
+        if user_tID and not username:
+            user = await UserService.get_identity(db=db, user_tID=user_tID)
+        else:
+            user = await UserService.get_user(db=db, username=username, user_tID=user_tID)
+        if isinstance(user, ServiceError):
+            return user
         if not user:
             return None
         
         return user.is_admin
     
     @staticmethod
-    @exception_decorator
-    def del_user(db: Session, username: str = None, user_ID: int = None) -> Literal[True, "NOT_EXIST"] | None:
+    @transactional
+    async def del_user(db: AsyncSession, username: str = None, user_ID: int = None) -> Literal[True, "NOT_EXIST"] | ServiceError:
         """
         Delete a user by username or internal ID.
         Returns True if deleted, "NOT_EXIST" if the user was not found.
         """
-        user = UserService.get_user(db=db, username=username, user_ID=user_ID)
+        user = await UserService.get_user(db=db, username=username, user_ID=user_ID)
+        if isinstance(user, ServiceError):
+            return user
         if not user:
             return "NOT_EXIST"
         
-        db.delete(user)
-        db.commit()
+        await db.delete(user)
+        await db.flush()
+        UserService._forget_identity(db, user)
+        forget_user_cards(db, user.username)
 
         return True
 
     @staticmethod
-    @exception_decorator
-    def get_all_users(db: Session, user_tID: str = None, username: str = None, task_id: int = None) -> Generator[User, None, None]:
+    def _users_query(user_tID: str = None, username: str = None, task_id: int = None, group_id: int = None, telegram_ids: Iterable[str] = ()):
         """
-        Retrieve all users optionally filtered by:
-        - Exclude the user with given Telegram ID
-        - Exclude the user with given username
-        - Exclude users already assigned to a specific task
-        Returns a generator of User objects.
+        Build the user query shared by get_all_users and get_users_page.
+        With group_id only members of the group are returned, as mirrored in group_members,
+        plus the users whose Telegram ID is in telegram_ids.
         """
         if user_tID:
             user_tID = str(user_tID)
-            query = db.query(User).filter(
+            query = select(User).where(
                 or_(
                     User.telegram_id != user_tID,
                     User.telegram_id.is_(None)
@@ -126,35 +283,114 @@ class UserService:
             )
             if task_id:
                 # Exclude users already assigned to the task
-                subq = db.query(UserTask.user_id).filter(UserTask.task_id == task_id)
-                query = query.filter(User.id.notin_(subq))
+                subq = select(UserTask.user_id).where(UserTask.task_id == task_id)
+                query = query.where(User.id.notin_(subq))
                 
         elif username:
-            query = db.query(User).filter(
+            query = select(User).where(
                 or_(
                     User.username != username,
                     User.username.is_(None)
                 )
             )
         else:
-            query = db.query(User)
+            query = select(User)
+
+        if group_id:
+            members = select(GroupMember.telegram_user_id).where(GroupMember.group_id == group_id)
+            query = query.where(or_(User.telegram_id.in_(members), User.telegram_id.in_(list(telegram_ids))))
+        return query
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_all_users(db: AsyncSession, user_tID: str = None, username: str = None, task_id: int = None, group_id: int = None, telegram_ids: Iterable[str] = ()) -> List[User] | ServiceError:
+        """
+        Retrieve all users optionally filtered by:
+        - Exclude the user with given Telegram ID
+        - Exclude the user with given username
+        - Exclude users already assigned to a specific task
+        - Only members of a group, or users with one of telegram_ids
+        Returns a list of User objects.
+        """
+        users = await db.scalars(UserService._users_query(user_tID=user_tID, username=username, task_id=task_id, group_id=group_id, telegram_ids=telegram_ids))
+        return users.all()
+
+    @staticmethod
+    @transactional(read_only=True)
+    async def count_users(db: AsyncSession, user_tID: str = None, username: str = None, task_id: int = None) -> int | ServiceError:
+        """
+        Count users with SELECT COUNT, filtered like get_all_users.
+        """
+        query = UserService._users_query(user_tID=user_tID, username=username, task_id=task_id)
+        return await db.scalar(query.with_only_columns(func.count(User.id)))
 
-        yield from query 
+    @staticmethod
+    @transactional(read_only=True)
+    async def get_users_page(db: AsyncSession, user_tID: str = None, username: str = None, task_id: int = None, group_id: int = None, telegram_ids: Iterable[str] = (), cursor: str = None, limit: int = PAGE_SIZE) -> Page | ServiceError:
+        """
+        Retrieve one page of users ordered by ID, filtered like get_all_users.
+        """
+        query = UserService._users_query(user_tID=user_tID, username=username, task_id=task_id, group_id=group_id, telegram_ids=telegram_ids)
+        return await paginate(db, query, User.id, cursor=cursor, limit=limit)
 
     @staticmethod
-    @exception_decorator
-    def toggle_user(db: Session, user_ID: int = None) -> True | None:
+    @transactional
+    async def toggle_user(db: AsyncSession, user_ID: int = None) -> True | None | ServiceError:
         """
         Toggle the admin status of a user.
         If user is admin, remove admin; if not, grant admin.
         """
-        user = UserService.get_user(db=db, user_ID=user_ID)
+        user = await UserService.get_user(db=db, user_ID=user_ID)
+        if isinstance(user, ServiceError):
+            return user
         if not user:
             return None
         
         user.is_admin = not user.is_admin
 
-        db.commit()
-        db.refresh(user)
+        await db.flush()
+        await db.refresh(user)
+        UserService._forget_identity(db, user)
+
+        return True
+
+
+# Member statuses of users who are in a group; left and kicked members are removed from group_members
+MEMBER_STATUSES = ("creator", "administrator", "member", "restricted")
 
+class GroupMemberService:
+    @staticmethod
+    @transactional
+    async def set_member_status(db: AsyncSession, group_id: int, telegram_user_id: str, status: str) -> True | ServiceError:
+        """
+        Record the status of a user in a group.
+        Users whose status is not in MEMBER_STATUSES are removed from the group.
+        """
+        telegram_user_id = str(telegram_user_id)
+        if status not in MEMBER_STATUSES:
+            await db.execute(
+                delete(GroupMember).where(
+                    GroupMember.group_id == group_id,
+                    GroupMember.telegram_user_id == telegram_user_id,
+                )
+            )
+            return True
+
+        stmt = insert(db, GroupMember).values(
+            group_id=group_id, telegram_user_id=telegram_user_id, status=status, updated_at=datetime.now()
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[GroupMember.group_id, GroupMember.telegram_user_id],
+            set_={"status": stmt.excluded.status, "updated_at": stmt.excluded.updated_at},
+        )
+        await db.execute(stmt)
+        return True
+
+    @staticmethod
+    @transactional
+    async def clear_group(db: AsyncSession, group_id: int) -> True | ServiceError:
+        """
+        Forget all members of a group, used when the bot leaves it and stops receiving its updates.
+        """
+        await db.execute(delete(GroupMember).where(GroupMember.group_id == group_id))
         return True